@@ -8,11 +8,22 @@ This library implements an interface for the Transitland Feed Registry, Transitl
 Modules:
   registry - Feed Registry reader
   entities - Transitland entities  
+  stoptable - Compact columnar Stop storage
+  stream - Streaming GTFS linkage for bootstrap
   geom - Geometry utilities
+  spatial - In-memory spatial index of stops
   util - Other utilities
+  httppool - Pooled keep-alive HTTP connections
+  cache - TTL cache for Datastore responses
+  retry - Retry policy and rate limiting
+  jsonstream - Incremental decoding of large JSON responses
   errors - Exceptions
   bootstrap - Create Transitland Feed from GTFS URL
+  bulk - Bootstrap many GTFS feeds in parallel
+  upload - Upload bootstrapped feeds to the Datastore as changesets
   fetch - Feed aggregator
+  store - Content-addressed feed store
+  benchmark - Benchmarks for client internals
   
 """
 
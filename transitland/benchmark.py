@@ -0,0 +1,177 @@
+"""Benchmarks for Transitland client internals."""
+import argparse
+import multiprocessing
+import random
+import resource
+import time
+
+import mzgeohash
+
+import geom
+import testing
+from datastore import Datastore
+from spatial import SpatialIndex
+from route import Route
+from stop import Stop
+from stoptable import StopTable
+
+def timed(func, *args, **kwargs):
+  """Return (seconds, result) for a single call."""
+  t = time.time()
+  ret = func(*args, **kwargs)
+  return time.time() - t, ret
+
+def random_points(count, lon=-122.2, lat=37.4, spread=0.5, seed=0):
+  r = random.Random(seed)
+  return [
+    [lon + r.uniform(-spread, spread), lat + r.uniform(-spread, spread)]
+    for i in range(count)
+  ]
+
+def bench_geom(sizes=(10000, 100000, 1000000)):
+  """geom.geohash_features pure Python path vs. numpy path."""
+  if geom.numpy is None:
+    print "numpy not installed; skipping."
+    return
+  print "%10s %12s %12s %8s"%('points', 'python (s)', 'numpy (s)', 'speedup')
+  for size in sizes:
+    points = random_points(size)
+    array = geom.numpy.array(points, dtype=geom.numpy.float64)
+    t1, expect = timed(
+      lambda: mzgeohash.neighborsfit(geom.centroid(points), points)
+    )
+    t2, result = timed(geom.geohash_points, array)
+    assert result == expect, "Mismatch: %s != %s"%(result, expect)
+    print "%10d %12.3f %12.3f %7.1fx"%(size, t1, t2, t1/max(t2, 1e-9))
+
+def maxrss(func, *args):
+  """Return the peak memory growth (MB) of func(*args) in a child process."""
+  def child(queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t, ret = timed(func, *args)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(((after - before) / 1024.0, t))
+  queue = multiprocessing.Queue()
+  p = multiprocessing.Process(target=child, args=(queue,))
+  p.start()
+  ret = queue.get()
+  p.join()
+  return ret
+
+def _stop_rows(size):
+  for i, (lon, lat) in enumerate(random_points(size)):
+    yield {
+      'name': 'Stop %d'%(i % 1000),
+      'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+      'identifiers': ['gtfs://f-9q9-test/s/%d'%i],
+      'tags': {'wheelchair_boarding': '', 'zone_id': str(i % 10)},
+      'timezone': 'America/Los_Angeles'
+    }
+
+def _load_stops(size, routesize=50):
+  route = None
+  stops = []
+  for i, row in enumerate(_stop_rows(size)):
+    if i % routesize == 0:
+      route = Route(name='route %d'%i)
+    stop = Stop(**row)
+    route.add_child(stop)
+    stops.append(stop)
+  return stops
+
+def _load_stoptable(size, routesize=50):
+  route = None
+  table = StopTable()
+  for i, row in enumerate(_stop_rows(size)):
+    if i % routesize == 0:
+      route = Route(name='route %d'%i)
+    route.add_child(table.add(**row))
+  return table
+
+def bench_stoptable(sizes=(10000, 100000, 1000000)):
+  """Memory use of Stop entities vs. StopTable, linked into routes."""
+  print "%10s %12s %12s %8s"%('stops', 'Stop (MB)', 'Table (MB)', 'ratio')
+  for size in sizes:
+    m1, t1 = maxrss(_load_stops, size)
+    m2, t2 = maxrss(_load_stoptable, size)
+    print "%10d %12.1f %12.1f %7.1fx"%(size, m1, m2, m1/max(m2, 0.1))
+
+def _datastore_requests(url, count, pool_size):
+  ds = Datastore(url, pool_size=pool_size)
+  for i in range(count):
+    ds.getjson('/api/v1/stops?identifier=%s'%i)
+  ds.pool.close()
+
+def bench_datastore(sizes=(1000, 10000)):
+  """Datastore requests/sec to a local server, with and without pooling."""
+  app = lambda method, path, data: (200, {'stops': []})
+  print "%10s %12s %12s %8s"%('requests', 'new (req/s)', 'pool (req/s)', 'speedup')
+  with testing.Server(handler=testing.JSONRequestHandler, app=app) as server:
+    for size in sizes:
+      t1, _ = timed(_datastore_requests, server.url(), size, 0)
+      t2, _ = timed(_datastore_requests, server.url(), size, 4)
+      print "%10d %12.0f %12.0f %7.1fx"%(size, size/t1, size/t2, t1/max(t2, 1e-9))
+
+def _datastore_stops(url, stream):
+  """Read all stops. Returns the seconds to the first stop."""
+  t = time.time()
+  first = None
+  for stop in Datastore(url).iter_stops(stream=stream):
+    if first is None:
+      first = time.time() - t
+  return first
+
+def bench_stream(sizes=(10000, 100000)):
+  """Peak memory and time to the first Stop, for whole vs. streamed responses."""
+  print "%10s %12s %12s %14s %14s"%('stops', 'whole (MB)', 'stream (MB)', 'whole 1st (s)', 'stream 1st (s)')
+  for size in sizes:
+    data = {'stops': list(_stop_rows(size))}
+    app = lambda method, path, body: (200, data)
+    with testing.Server(handler=testing.JSONRequestHandler, app=app) as server:
+      m1, t1 = maxrss(_datastore_stops, server.url(), False)
+      m2, t2 = maxrss(_datastore_stops, server.url(), True)
+      f1 = _datastore_stops(server.url(), False)
+      f2 = _datastore_stops(server.url(), True)
+    print "%10d %12.1f %12.1f %14.3f %14.3f"%(size, m1, m2, f1, f2)
+
+def bench_spatial(sizes=(10000, 100000, 1000000), queries=1000):
+  """SpatialIndex bulk load, and radius and nearest query times."""
+  print "%10s %10s %14s %14s %14s"%('points', 'load (s)', '500m (ms/q)', 'k=1 (ms/q)', 'k=10 (ms/q)')
+  for size in sizes:
+    points = random_points(size)
+    lon, lat = zip(*points)
+    if geom.numpy:
+      lon, lat = geom.numpy.array(lon), geom.numpy.array(lat)
+    index = SpatialIndex()
+    t1, _ = timed(index.load, lon, lat)
+    targets = random_points(queries, seed=1)
+    t2, _ = timed(lambda: [index.within(i, 500) for i in targets])
+    t3, _ = timed(lambda: [index.nearest(i) for i in targets])
+    t4, _ = timed(lambda: [index.nearest(i, k=10) for i in targets])
+    print "%10d %10.3f %14.3f %14.3f %14.3f"%(size, t1, t2*1000/queries, t3*1000/queries, t4*1000/queries)
+
+BENCHMARKS = {
+  'datastore': bench_datastore,
+  'geom': bench_geom,
+  'spatial': bench_spatial,
+  'stoptable': bench_stoptable,
+  'stream': bench_stream
+}
+
+def run():
+  parser = argparse.ArgumentParser(description='Transitland benchmarks')
+  parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run')
+  parser.add_argument(
+    '--sizes',
+    help='Comma separated input sizes; each benchmark has its own default'
+  )
+  args = parser.parse_args()
+  kwargs = {}
+  if args.sizes:
+    kwargs['sizes'] = [int(i) for i in args.sizes.split(',')]
+  for name in args.benchmarks or sorted(BENCHMARKS):
+    print "Benchmark:", name
+    BENCHMARKS[name](**kwargs)
+
+if __name__ == "__main__":
+  run()
@@ -28,6 +28,10 @@ if __name__ == "__main__":
     action='store_true', 
     dest='printjson'
   )
+  parser.add_argument(
+    '--stream', 
+    help='Read trips and stop_times row by row instead of preloading the feed', 
+    action='store_true')
   parser.add_argument(
     '--debug', 
     help='Show helpful debugging information', 
@@ -54,7 +58,8 @@ if __name__ == "__main__":
   if args.feedname:
     kw['feedname'] = args.feedname
   feed = entities.Feed(**kw)
-  feed.bootstrap_gtfs(f)
+  timer = util.Timer()
+  feed.bootstrap_gtfs(f, stream=args.stream, timer=timer)
   
   # Print basic feed information.
   print "Feed:", feed.onestop()
@@ -66,6 +71,10 @@ if __name__ == "__main__":
     print "  Operator:", operator.name()
     print "    Routes:", len(operator.routes())
     print "    Stops:", len(operator.stops())
+  # Print time for each bootstrap stage.
+  print "  Timings:"
+  for stage, t in timer.stages.items():
+    print "    %s: %0.3fs"%(stage, t)
 
   # Write out updated feed.
   output = args.output or '%s.json'%feed.onestop()
@@ -0,0 +1,184 @@
+"""Bootstrap many GTFS feeds in parallel worker processes."""
+import argparse
+import multiprocessing
+import Queue
+import os
+import time
+import traceback
+
+import mzgtfs.feed
+
+import util
+import registry
+import entities
+
+def registry_jobs(path, gtfs_path='.', feedids=None):
+  """Jobs for feeds in a Feed Registry; GTFS files are <onestopId>.zip."""
+  r = registry.FeedRegistry(path=path)
+  ret = []
+  for feedid in feedids or sorted(r.feeds()):
+    feed = r.feed(feedid)
+    ret.append({
+      'key': feedid,
+      'filename': os.path.join(gtfs_path, '%s.zip'%feedid),
+      'feed': feed.json()
+    })
+  return ret
+
+def file_jobs(filenames):
+  """Jobs for GTFS files.
+
+  Files named <onestopId>.zip, as written by fetch, keep that Onestop ID;
+  otherwise the file basename is used as the feed name.
+  """
+  ret = []
+  for filename in filenames:
+    name = os.path.splitext(os.path.basename(filename))[0]
+    job = {'key': filename, 'filename': filename}
+    if name.startswith('%s-'%entities.Feed.onestop_type):
+      job['feed'] = {'onestopId': name}
+    else:
+      job['feedname'] = name
+    ret.append(job)
+  return ret
+
+def bootstrap_feed(job, stream=False):
+  """Bootstrap a single job. Returns the Feed."""
+  data = job.get('feed')
+  feed = entities.Feed.from_json(data) if data else entities.Feed()
+  filename = job['filename']
+  if data and not os.path.exists(filename):
+    filename = feed.download(filename)
+  gtfs_feed = mzgtfs.feed.Feed(filename)
+  feed.bootstrap_gtfs(
+    gtfs_feed,
+    feedname=job.get('feedname', 'unknown'),
+    stream=stream
+  )
+  return feed
+
+def bootstrap_job(job, stream=False):
+  """Bootstrap a single job. Returns a result dict."""
+  t = time.time()
+  feed = bootstrap_feed(job, stream=stream)
+  return {
+    'key': job['key'],
+    'onestopId': feed.onestop(),
+    'stops': len(feed.stops()),
+    'routes': len(feed.routes()),
+    'operators': len(feed.operators()),
+    'json': feed.json(),
+    'time': time.time() - t,
+    'error': None
+  }
+
+def _error(job, error, t):
+  return {
+    'key': job['key'],
+    'onestopId': None,
+    'stops': 0,
+    'routes': 0,
+    'operators': 0,
+    'json': None,
+    'time': time.time() - t,
+    'error': error
+  }
+
+def _worker(func, index, job, queue):
+  t = time.time()
+  try:
+    result = func(job)
+  except Exception, e:
+    result = _error(job, '%s: %s\n%s'%(e.__class__.__name__, e, traceback.format_exc()), t)
+  queue.put((index, result))
+
+def bootstrap_many(jobs, workers=None, timeout=None, func=bootstrap_job):
+  """Run func(job) for each job in a separate process.
+
+  At most workers processes run at once. Results are yielded in
+  completion order; a job that raises, crashes, or runs longer than
+  timeout seconds yields a result with 'error' set. Each job yields
+  one result, even if several jobs have the same key.
+  """
+  workers = workers or multiprocessing.cpu_count()
+  queue = multiprocessing.Queue()
+  pending = list(enumerate(jobs))[::-1]
+  # Job index -> (process, job, start time)
+  running = {}
+  while pending or running:
+    while pending and len(running) < workers:
+      index, job = pending.pop()
+      p = multiprocessing.Process(target=_worker, args=(func, index, job, queue))
+      p.daemon = True
+      p.start()
+      running[index] = (p, job, time.time())
+    try:
+      index, result = queue.get(timeout=0.1)
+    except Queue.Empty:
+      index, result = None, None
+    if result:
+      p, job, t = running.pop(index)
+      p.join()
+      yield result
+    for index, (p, job, t) in running.items():
+      if timeout and time.time() - t > timeout:
+        p.terminate()
+        p.join()
+        running.pop(index)
+        yield _error(job, 'Timeout after %0.1fs'%timeout, t)
+      elif p.exitcode not in (None, 0):
+        running.pop(index)
+        yield _error(job, 'Worker exited with code %s'%p.exitcode, t)
+
+def run():
+  parser = argparse.ArgumentParser(
+    description='Bootstrap many GTFS feeds in parallel.'
+  )
+  parser.add_argument('filenames', nargs='*', help='GTFS feed filenames')
+  parser.add_argument('--registry', help='Feed Registry Path')
+  parser.add_argument('--gtfs', help='Directory of <onestopId>.zip GTFS files for --registry', default='.')
+  parser.add_argument('--output', help='Directory for <onestopId>.json output')
+  parser.add_argument('--workers', help='Worker processes', type=int)
+  parser.add_argument('--timeout', help='Per-feed timeout, in seconds', type=float)
+  parser.add_argument('--stream', help='Use streaming bootstrap', action='store_true')
+  args = parser.parse_args()
+
+  if args.registry:
+    jobs = registry_jobs(args.registry, gtfs_path=args.gtfs, feedids=args.filenames)
+  else:
+    jobs = file_jobs(args.filenames)
+  if not jobs:
+    raise Exception("No feeds specified! Try --registry or GTFS filenames")
+
+  func = bootstrap_job
+  if args.stream:
+    func = lambda job:bootstrap_job(job, stream=True)
+
+  t = time.time()
+  row = "%-40s %-40s %7s %7s %9s %8s"
+  print row%('Feed', 'Onestop ID', 'Stops', 'Routes', 'Operators', 'Time (s)')
+  failed = []
+  for result in bootstrap_many(jobs, workers=args.workers, timeout=args.timeout, func=func):
+    if result['error']:
+      failed.append(result)
+      print row%(result['key'], 'ERROR', '-', '-', '-', '%0.2f'%result['time'])
+      continue
+    print row%(
+      result['key'],
+      result['onestopId'],
+      result['stops'],
+      result['routes'],
+      result['operators'],
+      '%0.2f'%result['time']
+    )
+    if args.output:
+      output = os.path.join(args.output, '%s.json'%result['onestopId'])
+      with open(output, 'w') as f:
+        util.json_pretty_dump(result['json'], f)
+  print "Feeds: %s, errors: %s, wall time: %0.2fs"%(len(jobs), len(failed), time.time() - t)
+  for result in failed:
+    print "Error: %s"%result['key']
+    print result['error']
+
+if __name__ == "__main__":
+  run()
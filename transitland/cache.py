@@ -0,0 +1,149 @@
+"""TTL cache for Datastore GET responses."""
+import collections
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import urllib
+import urlparse
+
+import util
+
+# Directory for cached responses, below ResponseCache.path.
+CACHE_DIR = '.transitland-responses'
+
+def normalize(endpoint):
+  """An endpoint's scheme and host, if any, path and sorted query string."""
+  parsed = urlparse.urlparse(endpoint)
+  path = '/%s'%'/'.join(i for i in parsed.path.split('/') if i)
+  if parsed.netloc:
+    path = '%s://%s%s'%(parsed.scheme.lower(), parsed.netloc.lower(), path)
+  query = urllib.urlencode(sorted(urlparse.parse_qsl(parsed.query, keep_blank_values=True)))
+  if query:
+    return '%s?%s'%(path, query)
+  return path
+
+def cache_key(endpoint, apitoken=None):
+  """Cache key for an endpoint, requested with an API token.
+
+  Responses may differ by host and token, so both are part of the key;
+  the token only as a digest, as keys are written to disk.
+  """
+  ret = normalize(endpoint)
+  if apitoken:
+    ret = '%s#%s'%(ret, hashlib.sha1(apitoken).hexdigest())
+  return ret
+
+def collection(endpoint):
+  """The resource collection of an endpoint or key, e.g. /api/v1/stops."""
+  path = urlparse.urlparse(normalize(endpoint)).path
+  return '/'.join(path.split('/')[:4])
+
+class ResponseCache(object):
+  """LRU cache of JSON responses, with per-endpoint TTLs.
+
+  Up to maxsize responses are kept in memory. If path is given, they
+  are also written to disk, in its CACHE_DIR subdirectory, and read
+  back after a restart. Responses are kept by host and API token; see
+  cache_key().
+  Responses expire after ttl seconds, or ttls[collection] for a
+  collection such as '/api/v1/stops'. stats counts 'hit', 'disk_hit',
+  'miss', 'expired' and 'invalidated'.
+  """
+  def __init__(self, maxsize=1024, ttl=300, ttls=None, path=None):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.ttls = dict((collection(k), v) for k, v in (ttls or {}).items())
+    self.path = path
+    self.stats = util.Stats()
+    self.clock = time.time
+    # key -> (expires, JSON text); JSON text so callers get a copy.
+    self._memory = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def _root(self):
+    return os.path.join(self.path, CACHE_DIR)
+
+  def _filename(self, key):
+    return os.path.join(
+      self._root(),
+      collection(key).strip('/').replace('/', '.'),
+      '%s.json'%hashlib.sha1(key).hexdigest()
+    )
+
+  def _read(self, key):
+    with self._lock:
+      entry = self._memory.pop(key, None)
+      if entry:
+        self._memory[key] = entry
+        return entry, 'hit'
+    if self.path:
+      entry = util.read_json(self._filename(key))
+      if entry.get('key') == key:
+        entry = (entry['expires'], entry['data'])
+        self._remember(key, entry)
+        return entry, 'disk_hit'
+    return None, 'miss'
+
+  def _remember(self, key, entry):
+    with self._lock:
+      self._memory.pop(key, None)
+      self._memory[key] = entry
+      while len(self._memory) > self.maxsize:
+        self._memory.popitem(last=False)
+
+  def get(self, endpoint, apitoken=None):
+    """Return the cached response for an endpoint, or None."""
+    key = cache_key(endpoint, apitoken=apitoken)
+    entry, stat = self._read(key)
+    if entry and entry[0] < self.clock():
+      entry, stat = None, 'expired'
+      self._discard(key)
+    self.stats.incr(stat)
+    if entry:
+      return json.loads(entry[1])
+
+  def set(self, endpoint, data, apitoken=None):
+    """Cache the response for an endpoint."""
+    key = cache_key(endpoint, apitoken=apitoken)
+    entry = (self.clock() + self.ttls.get(collection(key), self.ttl), json.dumps(data))
+    self._remember(key, entry)
+    if self.path:
+      filename = self._filename(key)
+      if not os.path.exists(os.path.dirname(filename)):
+        try:
+          os.makedirs(os.path.dirname(filename))
+        except OSError:
+          # Created by another thread or process.
+          pass
+      tmp = '%s.%s.tmp'%(filename, threading.current_thread().ident)
+      with open(tmp, 'w') as f:
+        json.dump({'key': key, 'expires': entry[0], 'data': entry[1]}, f)
+      os.rename(tmp, filename)
+
+  def _discard(self, key):
+    with self._lock:
+      self._memory.pop(key, None)
+    if self.path and os.path.exists(self._filename(key)):
+      os.unlink(self._filename(key))
+
+  def invalidate(self, endpoint=None):
+    """Remove cached responses in the collection of endpoint, or all.
+
+    Responses from every host and API token are removed.
+    """
+    prefix = collection(endpoint) if endpoint else None
+    with self._lock:
+      keys = [k for k in self._memory if prefix is None or collection(k) == prefix]
+      for key in keys:
+        del self._memory[key]
+    self.stats.incr('invalidated', len(keys))
+    if self.path:
+      # Only CACHE_DIR is removed, never other files below path.
+      root = self._root()
+      if prefix:
+        root = os.path.join(root, prefix.strip('/').replace('/', '.'))
+      if os.path.isdir(root):
+        shutil.rmtree(root)
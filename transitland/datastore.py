@@ -1,61 +1,619 @@
 """Transitland Datastore interface."""
+import Queue
+import collections
+import copy
+import httplib
 import json
+import socket
+import threading
 import urllib
-import urllib2
 import time
+import zlib
 
+import cache
 import entities
 import errors
+import geom
+import httppool
+import jsonstream
+import util
+
+# Entity collections: response key -> (path, entity from JSON).
+# Operators are listed without their stops and routes.
+COLLECTIONS = {
+  'stops': ('/api/v1/stops', entities.Stop.from_json),
+  'routes': ('/api/v1/routes', entities.Route.from_json),
+  'operators': ('/api/v1/operators', lambda data:entities.Operator(**data))
+}
 
 class Datastore(object):
-  def __init__(self, endpoint, apitoken=None, debug=False, log=None):
+  """Transitland Datastore API client.
+
+  Requests share a pool of keep-alive connections; see
+  httppool.ConnectionPool for pool_size and idle_timeout. GET responses
+  are cached in cache, an optional cache.ResponseCache; a POST
+  invalidates the cached responses it may change. Failed requests are
+  retried according to retry, an optional retry.RetryPolicy, and
+  ratelimit, an optional retry.TokenBucket, limits the request rate; a
+  TokenBucket may be shared by several Datastores. With coalesce=True,
+  identical GETs in flight at the same time share one request; see
+  SingleFlight.
+
+  With compress=True, gzip and deflate responses are accepted and
+  decoded. POST bodies of at least compress_min bytes are sent gzipped;
+  None disables this, as not every server accepts them. transfer_stats
+  counts bytes on the wire, 'sent' and 'received', and before encoding
+  or after decoding, 'sent_decoded' and 'received_decoded'.
+  """
+  def __init__(self, endpoint, apitoken=None, debug=False, log=None, pool_size=4, idle_timeout=60, timeout=None, cache=None, retry=None, ratelimit=None, coalesce=True, compress=True, compress_min=None):
     self.host = endpoint
     self.debug = debug
     self.apitoken = apitoken
     self.log = log or (lambda x:x)
+    self.cache = cache
+    self.retry = retry
+    self.ratelimit = ratelimit
+    self.singleflight = SingleFlight() if coalesce else None
+    self.compress = compress
+    self.compress_min = compress_min
+    self.transfer_stats = util.Stats()
+    self.resolve_stats = {}
+    self.spatial_stats = {}
+    self.pool = httppool.ConnectionPool(
+      size=pool_size,
+      idle_timeout=idle_timeout,
+      timeout=timeout
+    )
 
   def _request(self, endpoint, data=None):
-    req = urllib2.Request('%s/%s'%(self.host, endpoint))
-    req.add_header('Content-Type', 'application/json')
-    if self.apitoken:
-      req.add_header('Authorization', 'Token token=%s'%self.apitoken)
+    response = self._send(endpoint, data=data)
     try:
-      if data is not None:
-        response = urllib2.urlopen(req, json.dumps(data))
-      else:
-        response = urllib2.urlopen(req)
-    except urllib2.HTTPError, e: 
-      raise errors.DatastoreError(e.reason, response_code=e.code, response_body=e.read())
-    except urllib2.URLError, e:
-      raise errors.DatastoreError(e.reason)
-    except Exception, e:
-      raise
-    data = response.read()
-    try:
-      return json.loads(data)
+      return json.loads(response.body)
     except ValueError, e:
-      raise errors.DatastoreError("Invalid JSON response", response_code=response.code, response_body=data)
+      raise errors.DatastoreError("Invalid JSON response", response_code=response.status, response_body=response.body)
+
+  def _url(self, endpoint):
+    if endpoint.startswith(('http://', 'https://')):
+      return endpoint
+    return '%s/%s'%(self.host.rstrip('/'), endpoint.lstrip('/'))
+
+  def _send(self, endpoint, data=None, stream=False):
+    """Send a request, with retries. Returns a successful response.
+
+    With stream=True, returns an httppool.StreamingResponse; its body
+    is not read or decoded. The apitoken is only sent to the Datastore
+    host, not to absolute urls elsewhere, e.g. in meta.next.
+    """
+    url = self._url(endpoint)
+    headers = {'Content-Type': 'application/json'}
+    if self.apitoken and httppool.same_host(url, self.host):
+      headers['Authorization'] = 'Token token=%s'%self.apitoken
+    if self.compress:
+      headers['Accept-Encoding'] = 'gzip, deflate'
+    method, body = 'GET', None
+    if data is not None:
+      method, body = 'POST', json.dumps(data)
+      self.transfer_stats.incr('sent_decoded', len(body))
+      if self.compress_min is not None and len(body) >= self.compress_min:
+        body = httppool.encode(body, 'gzip')
+        headers['Content-Encoding'] = 'gzip'
+    attempt = 0
+    while True:
+      if self.ratelimit:
+        self.ratelimit.acquire()
+      try:
+        if body:
+          self.transfer_stats.incr('sent', len(body))
+        if stream:
+          response = self.pool.open(method, url, body=body, headers=headers)
+          if response.status >= 400:
+            # Read the error, to report it.
+            response = httppool.Response(response.status, response.reason, response.headers, response.read())
+            self._decode(response)
+        else:
+          response = self.pool.request(method, url, body=body, headers=headers)
+          self._decode(response)
+      except (socket.error, httplib.HTTPException), e:
+        if self.retry and self.retry.retryable(method, attempt):
+          self.retry.wait(attempt)
+          attempt += 1
+          continue
+        raise errors.DatastoreError(str(e) or e.__class__.__name__)
+      if response.status < 400:
+        break
+      if self.retry and self.retry.retryable(method, attempt, status=response.status):
+        self.retry.wait(attempt, retry_after=response.getheader('Retry-After'))
+        attempt += 1
+        continue
+      raise errors.DatastoreError(response.reason, response_code=response.status, response_body=response.body)
+    return response
+
+  def _decode(self, response):
+    """Decode the response body in place, counting transfer_stats."""
+    self.transfer_stats.incr('received', len(response.body))
+    encoding = response.getheader('Content-Encoding')
+    if encoding and self.compress:
+      try:
+        response.body = httppool.decode(response.body, encoding)
+      except (zlib.error, ValueError), e:
+        raise errors.DatastoreError("Invalid %s response: %s"%(encoding, e), response_code=response.status)
+    self.transfer_stats.incr('received_decoded', len(response.body))
+
+  def _iter_content(self, response, blocksize=65536):
+    """Yield the decoded body of a StreamingResponse, counting transfer_stats."""
+    encoding = response.getheader('Content-Encoding')
+    decoder = None
+    if encoding and self.compress:
+      decoder = httppool.decoder(encoding)
+    for data in response.iter_content(blocksize):
+      self.transfer_stats.incr('received', len(data))
+      if decoder:
+        data = decoder.decompress(data)
+      self.transfer_stats.incr('received_decoded', len(data))
+      yield data
+    if decoder:
+      data = decoder.flush()
+      self.transfer_stats.incr('received_decoded', len(data))
+      yield data
+
+  def _stream_json(self, endpoint, key, other=None):
+    """Yield each item of response[key], decoded as it is received.
+
+    The other keys of the response are added to the dict other.
+    """
+    response = self._send(endpoint, stream=True)
+    try:
+      for item in jsonstream.iter_array(self._iter_content(response), key, other=other):
+        yield item
+    except (socket.error, httplib.HTTPException), e:
+      raise errors.DatastoreError(str(e) or e.__class__.__name__)
+    except (zlib.error, ValueError), e:
+      raise errors.DatastoreError("Invalid JSON response: %s"%e, response_code=response.status)
+    finally:
+      response.close()
 
   def postjson(self, endpoint, data=None):
-    return self._request(endpoint, data=data or {})
+    try:
+      return self._request(endpoint, data=data or {})
+    finally:
+      if self.cache:
+        # Changesets may change any entity.
+        if cache.collection(endpoint) == '/api/v1/changesets':
+          self.cache.invalidate()
+        else:
+          self.cache.invalidate(endpoint)
 
   def getjson(self, endpoint):
-    return self._request(endpoint)
+    if self.cache:
+      data = self.cache.get(self._url(endpoint), apitoken=self.apitoken)
+      if data is not None:
+        return data
+    if self.singleflight:
+      key = cache.cache_key(self._url(endpoint), apitoken=self.apitoken)
+      return self.singleflight.do(key, lambda:self._getjson(endpoint))
+    return self._getjson(endpoint)
 
-  def stops(self, point=None, radius=1000, identifier=None):
-    endpoint = '/api/v1/stops'
+  def _getjson(self, endpoint):
+    data = self._request(endpoint)
+    if self.cache:
+      self.cache.set(self._url(endpoint), data, apitoken=self.apitoken)
+    return data
+
+  def _endpoint(self, path, point=None, radius=1000, identifier=None, per_page=None, identifiers=None, bbox=None):
+    query = []
+    if bbox:
+      query = [('bbox', ','.join('%0.8f'%i for i in bbox))]
     if identifier:
-      endpoint = '/api/v1/stops?identifier=%s'%(identifier)
+      query = [('identifier', identifier)]
+    if identifiers:
+      query = [('identifier_in', ','.join(identifiers))]
     if point:
-      endpoint = '/api/v1/stops?lon=%0.8f&lat=%0.8f&r=%d'%(
-        point[0],
-        point[1],
-        radius
-      )
-    response = self.getjson(endpoint)
-    stops = set()
-    for i in response['stops']:
-      e = entities.Stop.from_json(i)
-      stops.add(e)
-    return stops
+      query = [
+        ('lon', '%0.8f'%point[0]),
+        ('lat', '%0.8f'%point[1]),
+        ('r', '%d'%radius)
+      ]
+    if per_page:
+      query.append(('per_page', per_page))
+    if query:
+      path = '%s?%s'%(path, urllib.urlencode(query))
+    return path
+
+  def _getjson_async(self, endpoint):
+    """Start a getjson in a background thread; call the result to wait."""
+    result = {}
+    def target():
+      try:
+        result['data'] = self.getjson(endpoint)
+      except Exception, e:
+        result['error'] = e
+    t = threading.Thread(target=target)
+    t.daemon = True
+    t.start()
+    def wait():
+      t.join()
+      if 'error' in result:
+        raise result['error']
+      return result['data']
+    return wait
+
+  def iter_json(self, endpoint, key, prefetch=True, stream=False):
+    """Yield each item of response[key], following meta.next to later pages.
+
+    With prefetch=True, the next page is requested in the background
+    while the current page is consumed; at most two pages are held.
+
+    With stream=True, items are instead decoded as each 64 KB block is
+    received, so only one item and block are held, and the first item
+    arrives before the rest of the page. Streamed pages are not
+    prefetched, cached or coalesced.
+    """
+    if stream:
+      while endpoint:
+        other = {}
+        for item in self._stream_json(endpoint, key, other=other):
+          yield item
+        endpoint = (other.get('meta') or {}).get('next')
+      return
+    data = self.getjson(endpoint)
+    while True:
+      nexturl = data.get('meta', {}).get('next')
+      wait = None
+      if nexturl and prefetch:
+        wait = self._getjson_async(nexturl)
+      for item in data.get(key, []):
+        yield item
+      if not nexturl:
+        break
+      if wait:
+        data = wait()
+      else:
+        data = self.getjson(nexturl)
+
+  def _map(self, func, items, workers=4):
+    """Call func(item) on up to workers threads. Returns results in order."""
+    items = list(items)
+    results = [None] * len(items)
+    failed = []
+    queue = Queue.Queue()
+    for i in enumerate(items):
+      queue.put(i)
+    def work():
+      while not failed:
+        try:
+          index, item = queue.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          results[index] = func(item)
+        except Exception, e:
+          failed.append(e)
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(items)))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    if failed:
+      raise failed[0]
+    return results
+
+  def _iter_entities(self, key, stream=False, **query):
+    path, factory = COLLECTIONS[key]
+    for i in self.iter_json(self._endpoint(path, **query), key, stream=stream):
+      yield factory(i)
+
+  def iter_stops(self, point=None, radius=1000, identifier=None, per_page=None, stream=False):
+    """Yield Stops, one page at a time, or as received with stream=True."""
+    return self._iter_entities('stops', point=point, radius=radius, identifier=identifier, per_page=per_page, stream=stream)
+
+  def iter_routes(self, point=None, radius=1000, identifier=None, per_page=None, stream=False):
+    """Yield Routes, one page at a time, or as received with stream=True."""
+    return self._iter_entities('routes', point=point, radius=radius, identifier=identifier, per_page=per_page, stream=stream)
+
+  def iter_operators(self, point=None, radius=1000, identifier=None, per_page=None, stream=False):
+    """Yield Operators, one page at a time, or as received with stream=True.
+
+    Operators do not include stops or routes.
+    """
+    return self._iter_entities('operators', point=point, radius=radius, identifier=identifier, per_page=per_page, stream=stream)
+
+  def resolve_identifiers(self, identifiers, key='stops', max_length=2000, workers=4):
+    """Return a dict of identifier to entity, for many identifiers.
+
+    Identifiers are de-duplicated and split into batches, each requested
+    with the identifier_in query parameter in a url of at most
+    max_length characters. Up to workers batches are requested at once.
+    Unresolved identifiers are omitted. Statistics for the last call
+    are kept in resolve_stats.
+
+    identifier_in is assumed, not checked in advance: if the Datastore
+    ignores it and returns an entity with none of the batch's
+    identifiers, that batch is instead resolved with one identifier
+    query per identifier. Raises errors.DatastoreError if those are
+    ignored too.
+    """
+    t = time.time()
+    identifiers = list(identifiers)
+    path, factory = COLLECTIONS[key]
+    base = len(self.host) + len(self._endpoint(path, identifiers=['-'], per_page=999999))
+    batches = []
+    batch, length = [], base
+    for identifier in sorted(set(identifiers)):
+      # Quoted identifier, and a quoted comma.
+      size = len(urllib.quote(identifier, safe='')) + 3
+      if batch and length + size > max_length:
+        batches.append(batch)
+        batch, length = [], base
+      batch.append(identifier)
+      length += size
+    if batch:
+      batches.append(batch)
+
+    def lookup(endpoint, wanted):
+      # None if an entity matches no wanted identifier: the query was ignored.
+      found = {}
+      for data in self.iter_json(endpoint, key, prefetch=False):
+        entity = factory(data)
+        matched = wanted & set(entity.identifiers())
+        if not matched:
+          return None
+        for identifier in matched:
+          found[identifier] = entity
+      return found
+
+    fallbacks = []
+    def resolve(batch):
+      found = lookup(self._endpoint(path, identifiers=batch, per_page=len(batch)), set(batch))
+      if found is not None:
+        return found
+      fallbacks.append(batch)
+      found = {}
+      for identifier in batch:
+        ret = lookup(self._endpoint(path, identifier=identifier), set([identifier]))
+        if ret is None:
+          raise errors.DatastoreError("Datastore ignored the identifier query for %s"%identifier)
+        found.update(ret)
+      return found
+
+    ret = {}
+    for found in self._map(resolve, batches, workers=workers):
+      ret.update(found)
+    self.resolve_stats = {
+      'identifiers': len(identifiers),
+      'unique': sum(len(i) for i in batches),
+      'resolved': len(ret),
+      'batches': len(batches),
+      'batch_sizes': [len(i) for i in batches],
+      'fallback_batches': len(fallbacks),
+      'time': time.time() - t
+    }
+    return ret
+
+  def stops_near(self, points, radius=1000, workers=4, stream=False):
+    """Return a set of Stops within radius meters of each point.
+
+    Instead of a query for each point, the points are covered with
+    geohash cells (see geom.geohash_cover), each cell is queried once
+    by bounding box, and the results are filtered to each point's
+    radius. With stream=True, each cell's stops are decoded as they are
+    received; see iter_json. Statistics for the last call are kept in
+    spatial_stats.
+    """
+    t = time.time()
+    points = list(points)
+    cells, length = geom.geohash_cover(points, radius)
+    query = lambda cell:list(self._iter_entities('stops', bbox=geom.geohash_bbox(cell), stream=stream))
+    # Candidate stops, by geohash cell.
+    candidates = collections.defaultdict(dict)
+    for stops in self._map(query, sorted(cells), workers=workers):
+      for stop in stops:
+        if stop.point():
+          cell = geom.geohash_encode(stop.point(), length=length)
+          candidates[cell][stop.onestop()] = stop
+    ret = []
+    for point in points:
+      ret.append(set(
+        stop
+        for cell in geom.bbox_cells(geom.radius_bbox(point, radius), length)
+        for stop in candidates[cell].values()
+        if geom.haversine(point, stop.point()) <= radius
+      ))
+    self.spatial_stats = {
+      'points': len(points),
+      'cells': len(cells),
+      'length': length,
+      'candidates': sum(len(i) for i in candidates.values()),
+      'time': time.time() - t
+    }
+    return ret
+
+  def stops(self, point=None, radius=1000, identifier=None):
+    """Return a set of Stops, from all pages."""
+    return set(self.iter_stops(point=point, radius=radius, identifier=identifier))
+
+class AsyncResult(object):
+  """The pending result of an AsyncDatastore request."""
+  def __init__(self):
+    self._event = threading.Event()
+    self._value = None
+    self._error = None
+
+  def _set(self, value=None, error=None):
+    self._value = value
+    self._error = error
+    self._event.set()
+
+  def done(self):
+    return self._event.is_set()
+
+  def result(self, timeout=None):
+    """Wait for the result; raises the request's exception, if any."""
+    if not self._event.wait(timeout):
+      raise errors.DatastoreError("Timed out waiting for result")
+    if self._error:
+      raise self._error
+    return self._value
+
+class SingleFlight(object):
+  """Coalesce concurrent calls with the same key into one call.
+
+  The first caller runs the call; callers with the same key that arrive
+  while it is in flight wait for it, and get a copy of its result, or
+  the same exception. Waiters copy from a private copy of the result,
+  so the first caller may modify the result it gets. If the call is interrupted by another
+  BaseException, e.g. KeyboardInterrupt, they get errors.DatastoreError.
+  stats counts 'calls', 'flights' and 'coalesced'.
+  """
+  def __init__(self):
+    self.stats = util.Stats()
+    # key -> [AsyncResult, number of waiters]
+    self._flights = {}
+    self._lock = threading.Lock()
+
+  def do(self, key, func):
+    """Return func(), or the result of an identical call in flight."""
+    with self._lock:
+      entry = self._flights.get(key)
+      leader = entry is None
+      if leader:
+        entry = self._flights[key] = [AsyncResult(), 0]
+      else:
+        entry[1] += 1
+    flight = entry[0]
+    self.stats.incr('calls')
+    if not leader:
+      self.stats.incr('coalesced')
+      return copy.deepcopy(flight.result())
+    self.stats.incr('flights')
+    value, error, done = None, None, False
+    try:
+      value = func()
+      done = True
+      return value
+    except Exception, e:
+      error, done = e, True
+      raise
+    finally:
+      # No waiters join once the entry is removed.
+      with self._lock:
+        waiters = self._flights.pop(key)[1]
+      if not done:
+        flight._set(error=errors.DatastoreError("Coalesced call was interrupted"))
+      elif error:
+        flight._set(error=error)
+      elif waiters:
+        flight._set(value=copy.deepcopy(value))
+      else:
+        flight._set(value=value)
+
+  def ratio(self):
+    """Fraction of calls that were coalesced."""
+    return self.stats['coalesced'] / float(self.stats['calls'] or 1)
+
+class AsyncDatastore(Datastore):
+  """Datastore client for many concurrent requests.
+
+  Requests run on concurrency worker threads, which bounds the number
+  in flight, and each has a socket timeout of timeout seconds. The
+  *_async methods return an AsyncResult; gather() and the map_*
+  methods wait for many results, returned in input order.
+
+  Example:
+    with AsyncDatastore(endpoint, concurrency=16) as ds:
+      results = ds.map_stops(points, radius=100)
+  """
+  def __init__(self, endpoint, concurrency=8, timeout=30, **kwargs):
+    kwargs.setdefault('pool_size', concurrency)
+    super(AsyncDatastore, self).__init__(endpoint, timeout=timeout, **kwargs)
+    self.concurrency = concurrency
+    self._queue = Queue.Queue()
+    self._workers = []
+    self._lock = threading.Lock()
+
+  def _start(self):
+    with self._lock:
+      while len(self._workers) < self.concurrency:
+        t = threading.Thread(target=self._work)
+        t.daemon = True
+        t.start()
+        self._workers.append(t)
+
+  def _work(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      func, args, kwargs, result = item
+      try:
+        result._set(value=func(*args, **kwargs))
+      except Exception, e:
+        result._set(error=e)
+      finally:
+        if not result.done():
+          # e.g. SystemExit: this thread ends, and _start() replaces it.
+          result._set(error=errors.DatastoreError("Request was interrupted"))
+          with self._lock:
+            if threading.current_thread() in self._workers:
+              self._workers.remove(threading.current_thread())
+
+  def submit(self, func, *args, **kwargs):
+    """Run func(*args, **kwargs) on a worker thread. Returns an AsyncResult."""
+    self._start()
+    result = AsyncResult()
+    self._queue.put((func, args, kwargs, result))
+    return result
+
+  def getjson_async(self, endpoint):
+    return self.submit(self.getjson, endpoint)
+
+  def postjson_async(self, endpoint, data=None):
+    return self.submit(self.postjson, endpoint, data=data)
+
+  def stops_async(self, point=None, radius=1000, identifier=None):
+    return self.submit(self.stops, point=point, radius=radius, identifier=identifier)
+
+  def gather(self, results, return_exceptions=False):
+    """Wait for AsyncResults, and return their values in order.
+
+    By default, the first exception is raised; with
+    return_exceptions=True, exceptions are returned in place of values.
+    """
+    ret = []
+    for result in results:
+      try:
+        ret.append(result.result())
+      except Exception, e:
+        if not return_exceptions:
+          raise
+        ret.append(e)
+    return ret
+
+  def map_getjson(self, endpoints, return_exceptions=False):
+    """getjson for each endpoint, concurrently."""
+    return self.gather(
+      [self.getjson_async(i) for i in endpoints],
+      return_exceptions=return_exceptions
+    )
+
+  def map_stops(self, points, radius=1000, return_exceptions=False):
+    """stops() around each point, concurrently."""
+    return self.gather(
+      [self.stops_async(point=i, radius=radius) for i in points],
+      return_exceptions=return_exceptions
+    )
+
+  def close(self):
+    """Stop the worker threads, and close idle connections."""
+    with self._lock:
+      workers, self._workers = self._workers, []
+    for t in workers:
+      self._queue.put(None)
+    for t in workers:
+      t.join()
+    self.pool.close()
+
+  def __enter__(self):
+    return self
 
+  def __exit__(self, *args):
+    self.close()
@@ -1,5 +1,6 @@
 """Base Transitland Entity."""
 import json
+import collections
 
 import mzgeohash
 
@@ -9,8 +10,12 @@ import errors
 
 class Entity(object):
   """A Transitland Entity."""  
+  # Subclasses without __slots__ also have a __dict__.
+  __slots__ = ('data', 'parents', 'children', '_cache', '_graph')
   # OnestopID prefix.
   onestop_type = None
+  # Materialized graph statistics, shared by all entities.
+  graph_stats = collections.Counter()
 
   def __init__(self, **data):
     """Set name, Onestop ID, and geometry."""
@@ -20,7 +25,37 @@ class Entity(object):
     self.data = data
     self.parents = set()
     self.children = set()
+    # Memoized derived values, e.g. Onestop ID and geohash.
+    self._cache = {}
+    # Materialized descendants and ancestors; see descendants().
+    self._graph = {}
     self.init(**data)
+
+  # Pickle support; protocols 0 and 1 require this with __slots__.
+  def _slots(self):
+    """Return the slot descriptors of this entity's class, by name."""
+    ret = {}
+    for cls in reversed(type(self).__mro__):
+      for slot in cls.__dict__.get('__slots__', ()):
+        ret[slot] = cls.__dict__[slot]
+    return ret
+
+  def __getstate__(self):
+    state = dict(getattr(self, '__dict__', {}))
+    for slot, descriptor in self._slots().items():
+      try:
+        state[slot] = descriptor.__get__(self)
+      except AttributeError:
+        pass
+    return state
+
+  def __setstate__(self, state):
+    slots = self._slots()
+    for key, value in state.items():
+      if key in slots:
+        slots[key].__set__(self, value)
+      else:
+        self.__dict__[key] = value
     
   def init(self, **kwargs):
     """Subclass init hook."""
@@ -30,6 +65,11 @@ class Entity(object):
   def name(self):
     """A reasonable display name for the entity."""
     return self.data.get('name')
+
+  def set_name(self, name):
+    """Set the name; derived values are recomputed."""
+    self.data['name'] = name
+    self.invalidate()
   
   def id(self):
     """Alias to onestop()"""
@@ -37,7 +77,7 @@ class Entity(object):
 
   def onestop(self):
     """Return the Onestop ID for this entity."""
-    return self.data.get('onestopId') or self.make_onestop()
+    return self.data.get('onestopId') or self._memo('onestopId', self.make_onestop)
 
   def make_onestop(self, geohash=None, name=None):
     geohash = geohash or self.geohash()
@@ -58,9 +98,26 @@ class Entity(object):
     s = s.strip() 
     return s
 
+  # Memoized values.
+  def _memo(self, key, func):
+    """Return a memoized value, calling func() if not yet computed."""
+    if key not in self._cache:
+      self._cache[key] = func()
+    return self._cache[key]
+
+  def invalidate(self):
+    """Clear memoized values for this entity and its ancestors."""
+    self._cache.clear()
+    for entity in self._related('parents'):
+      entity._cache.clear()
+
   # Entity geometry.
   def geohash(self):
     """Return the geohash for this entity."""
+    return self._memo('geohash', self.make_geohash)
+
+  def make_geohash(self):
+    """Compute the geohash for this entity."""
     raise NotImplementedError
 
   def geometry(self):
@@ -68,6 +125,11 @@ class Entity(object):
     # TODO: Right now, this has to be supplied by GTFS Entity...
     return self.data.get('geometry')
 
+  def set_geometry(self, geometry):
+    """Set the geometry; derived values are recomputed."""
+    self.data['geometry'] = geometry
+    self.invalidate()
+
   def point(self):
     """Return a point for this entity."""
     raise NotImplementedError
@@ -80,9 +142,10 @@ class Entity(object):
   # Load from GTFS entity.
   @classmethod
   def from_gtfs(cls, gtfs_entity, feedid, **kw):
+    if 'geometry' not in kw:
+      kw['geometry'] = gtfs_entity.geometry()
     entity = cls(
       name=gtfs_entity.name(),
-      geometry=gtfs_entity.geometry(),
       **kw
     )
     entity.add_identifier(gtfs_entity.feedid(feedid))
@@ -123,6 +186,9 @@ class Entity(object):
       self.data['identifiers'] = []
     if identifier not in self.data['identifiers']:
       self.data['identifiers'].append(identifier)
+      # Ancestors index descendants by identifier.
+      for parent in self.parents:
+        parent.invalidate()
   
   # Rename
   def merge(self, item):
@@ -131,9 +197,9 @@ class Entity(object):
       self.add_identifier(identifier)
     # merge name and geometry.
     if 'name' in item.data:
-      self.data['name'] = item.data['name']
+      self.set_name(item.data['name'])
     if 'geometry' in item.data:
-      self.data['geometry'] = item.data['geometry']
+      self.set_geometry(item.data['geometry'])
     # merge tags
     for k,v in item.tags().items():
       self.set_tag(k,v)
@@ -148,8 +214,19 @@ class Entity(object):
   # Graph.
   def pclink(self, parent, child):
     """Create a parent-child relationship."""
+    if child in parent.children:
+      return
     parent.children.add(child)
     child.parents.add(parent)
+    # Update materialized descendants and ancestors.
+    above = set([parent]) | parent._related('parents')
+    below = set([child]) | child._related('children')
+    for entity in above:
+      entity._graph_update('children', below)
+    for entity in below:
+      entity._graph_update('parents', above)
+    # The parent geohash depends on its descendants.
+    parent.invalidate()
 
   # ... children
   def add_child(self, child):
@@ -160,4 +237,88 @@ class Entity(object):
   def add_parent(self, parent):
     """Add a parent relationship."""
     self.pclink(parent, self)  
+
+  # ... descendants and ancestors
+  def descendants(self, onestop_type=None):
+    """Return a read-only view of all entities below this entity."""
+    return util.SetView(self._graph_get('children')[onestop_type])
+
+  def ancestors(self, onestop_type=None):
+    """Return a read-only view of all entities above this entity."""
+    return util.SetView(self._graph_get('parents')[onestop_type])
+
+  def _walk(self, key):
+    """Return all entities reachable through 'parents' or 'children'."""
+    ret = set()
+    stack = list(getattr(self, key))
+    while stack:
+      entity = stack.pop()
+      if entity in ret:
+        continue
+      ret.add(entity)
+      stack.extend(getattr(entity, key))
+    return ret
+
+  def _related(self, key):
+    """Return materialized related entities, or walk the graph."""
+    if key in self._graph:
+      return self._graph[key][None]
+    return self._walk(key)
+
+  def _graph_get(self, key):
+    """Return related entities grouped by onestop_type; None is all."""
+    if key in self._graph:
+      self.graph_stats['hit'] += 1
+      return self._graph[key]
+    self.graph_stats['rebuild'] += 1
+    group = collections.defaultdict(set)
+    for entity in self._walk(key):
+      group[None].add(entity)
+      group[entity.onestop_type].add(entity)
+    self._graph[key] = group
+    return group
+
+  def _graph_update(self, key, entities):
+    """Add newly linked entities to materialized related entities."""
+    if key not in self._graph:
+      return
+    self.graph_stats['update'] += 1
+    group = self._graph[key]
+    for entity in entities:
+      group[None].add(entity)
+      group[entity.onestop_type].add(entity)
+
+  # Lookup.
+  def _index(self):
+    """Return a dict of descendant Onestop IDs and identifiers to entities."""
+    def build():
+      index = {}
+      for entity in self.descendants():
+        index.setdefault(entity.onestop(), entity)
+        for identifier in entity.identifiers():
+          index.setdefault(identifier, entity)
+      return index
+    return self._memo('index', build)
+
+  def _find(self, key, onestop_type=None):
+    """Return a single descendant by Onestop ID or identifier."""
+    entity = self._index().get(key)
+    if entity is None:
+      raise ValueError('No result')
+    if onestop_type and entity.onestop_type != onestop_type:
+      raise ValueError('No result')
+    return entity
+
+  def find(self, keys, onestop_type=None):
+    """Return a dict of descendants by Onestop ID or identifier.
+    
+    Keys without a matching descendant are omitted.
+    """
+    ret = {}
+    for key in keys:
+      try:
+        ret[key] = self._find(key, onestop_type=onestop_type)
+      except ValueError:
+        pass
+    return ret
     
\ No newline at end of file
@@ -11,6 +11,9 @@ class InvalidFeedRegistryError(ValueError):
   
 class InvalidChecksumError(ValueError):
   pass
+
+class IncompleteDownloadError(IOError):
+  pass
   
 class DatastoreError(Exception):
   def __init__(self, message, response_code=None, response_body=None):
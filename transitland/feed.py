@@ -3,7 +3,7 @@ import os
 
 import geom
 import util
-import errors
+import stream as gtfsstream
 from entity import Entity
 from operator import Operator
 from stop import Stop
@@ -21,40 +21,75 @@ class Feed(Entity):
     return self.data.get('feedFormat', 'gtfs')
 
   # Download the latest feed.
-  def verify_sha1(self, filename, sha1):
+  def verify_sha1(self, filename, sha1, hashcache=None):
     """Check if a file is validly cached."""
-    if os.path.exists(filename):
-      if sha1 and util.sha1file(filename) == sha1:
-        return True
+    if filename and sha1 and os.path.exists(filename):
+      if hashcache:
+        return hashcache.sha1(filename) == sha1
+      return util.sha1file(filename) == sha1
     return False
 
-  def download(self, filename=None, cache=True, verify=True, sha1=None):
-    """Download the GTFS feed to a file. Return filename."""
-    if cache and self.verify_sha1(filename, sha1):
+  def download(self, filename=None, cache=True, verify=True, sha1=None, hashcache=None, store=None):
+    """Download the GTFS feed to a file. Return filename.
+
+    With cache=True, an existing file is kept if it matches sha1, or if
+    the server reports it has not been modified since it was downloaded.
+    With verify=True, the checksum is computed during the download, and
+    filename is only replaced if it matches sha1. An optional
+    util.HashCache avoids hashing unchanged files again.
+
+    If a store.FeedStore is given, the feed is downloaded into the store
+    instead of filename, and the stored filename is returned.
+    """
+    if store:
+      return store.download(self, sha1=sha1 if verify else None, hashcache=hashcache)
+    if cache and self.verify_sha1(filename, sha1, hashcache=hashcache):
       return filename
-    filename = util.download(self.url(), filename)
-    if verify and sha1 and not self.verify_sha1(filename, sha1):
-      raise errors.InvalidChecksumError("Incorrect checksum: %s, expected %s"%(
-        util.sha1file(filename),
-        sha1
-      ))
-    return filename
+    return util.download(
+      self.url(),
+      filename,
+      conditional=cache,
+      sha1=sha1 if verify else None,
+      hashcache=hashcache
+    )
 
   # Load / dump
   def load_gtfs(self, *args, **kwargs):
     return self.bootstrap_gtfs(*args, **kwargs)
 
-  def bootstrap_gtfs(self, gtfs_feed, feedname='unknown', populate=True):
-    # Make sure the GTFS feed is completely loaded.
-    gtfs_feed.preload()
+  def bootstrap_gtfs(self, gtfs_feed, feedname='unknown', populate=True, stream=False, timer=None):
+    """Create Operators, Routes and Stops from a GTFS feed.
+
+    By default, the GTFS feed is completely preloaded. With stream=True,
+    trips and stop_times are read row by row to link routes to stops.
+    Elapsed time for each stage is recorded in timer, a util.Timer.
+    """
+    timer = timer or util.Timer()
+    with timer.stage('load'):
+      if stream:
+        self._link_gtfs_agencies(gtfs_feed)
+      else:
+        # Make sure the GTFS feed is completely loaded.
+        gtfs_feed.preload()
+
+    # Link routes to stops in a single pass over stop_times.
+    with timer.stage('linkage'):
+      linkage = gtfsstream.Linkage(patterns=stream)
+      if stream:
+        linkage.read_trips(gtfs_feed.iterread('trips'))
+        linkage.read_stop_times(gtfs_feed.iterread('stop_times'))
+      else:
+        linkage.read_trips(gtfs_feed.trips())
+        linkage.read_stop_times(gtfs_feed.read('stop_times'))
 
     # Set onestopId
-    if 'onestopId' not in self.data:
-      self.data['onestopId'] = self.make_onestop(
-        geohash=geom.geohash_features(gtfs_feed.stops()),
-        name=feedname
-      )
-    feedid = self.onestop()
+    with timer.stage('geohash'):
+      if 'onestopId' not in self.data:
+        self.data['onestopId'] = self.make_onestop(
+          geohash=geom.geohash_features(gtfs_feed.stops()),
+          name=feedname
+        )
+      feedid = self.onestop()
 
     # Override operator Onestop IDs
     agency_onestop = {}
@@ -73,55 +108,87 @@ class Feed(Entity):
       return
 
     # Create TL Stops
-    stops = {}
-    # sort; process all parent stations first.
-    order = []
-    order += sorted(filter(lambda x:x.location_type()==1, gtfs_feed.stops()), key=lambda x:x.id())
-    order += sorted(filter(lambda x:x.location_type()!=1, gtfs_feed.stops()), key=lambda x:x.id())
-    for gtfs_stop in order:
-      # Create stop from GTFS
-      stop = Stop.from_gtfs(gtfs_stop, feedid)
-      # Merge into parent station
-      parent = gtfs_stop.get('parent_station')
-      if parent:
-        stop = gtfs_feed.stop(parent)._tl_ref
-      # Merge with existing stop
-      key = stop.onestop()
-      stop = stops.get(key) or stop
-      stops[key] = stop
-      # Add identifiers and tags
-      gtfs_stop._tl_ref = stop
-      stop.add_identifier(gtfs_stop.feedid(feedid))
+    with timer.stage('stops'):
+      stops = {}
+      # sort; process all parent stations first.
+      order = []
+      order += sorted(filter(lambda x:x.location_type()==1, gtfs_feed.stops()), key=lambda x:x.id())
+      order += sorted(filter(lambda x:x.location_type()!=1, gtfs_feed.stops()), key=lambda x:x.id())
+      for gtfs_stop in order:
+        # Create stop from GTFS
+        stop = Stop.from_gtfs(gtfs_stop, feedid)
+        # Merge into parent station
+        parent = gtfs_stop.get('parent_station')
+        if parent:
+          stop = gtfs_feed.stop(parent)._tl_ref
+        # Merge with existing stop
+        key = stop.onestop()
+        stop = stops.get(key) or stop
+        stops[key] = stop
+        # Add identifiers and tags
+        gtfs_stop._tl_ref = stop
+        stop.add_identifier(gtfs_stop.feedid(feedid))
 
     # Create TL Routes
-    for gtfs_route in gtfs_feed.routes():
-      if not gtfs_route.stops():
-        continue
-      # Create route from GTFS
-      route = Route.from_gtfs(gtfs_route, feedid)
-      # Link to TL Stops
-      for gtfs_stop in gtfs_route.stops():
-        t = getattr(gtfs_stop, '_tl_ref', None)
-        if t:
-          route.add_child(t)
-      # Maintain reference to GTFS Route
-      gtfs_route._tl_ref = route
+    with timer.stage('routes'):
+      # Route geometries are built from the linkage when streaming.
+      if stream:
+        points = dict((i.id(), i.point()) for i in gtfs_feed.stops())
+        try:
+          shapes = gtfs_feed.shapes()
+        except KeyError:
+          shapes = {}
+      route_stops = {}
+      for gtfs_route in gtfs_feed.routes():
+        gtfs_stops = [gtfs_feed.stop(i) for i in linkage.stops(gtfs_route.id())]
+        if not gtfs_stops:
+          continue
+        # Create route from GTFS
+        kw = {}
+        if stream:
+          kw['geometry'] = gtfsstream.route_geometry(linkage, gtfs_route.id(), points, shapes)
+        route = Route.from_gtfs(gtfs_route, feedid, **kw)
+        # Link to TL Stops
+        for gtfs_stop in gtfs_stops:
+          t = getattr(gtfs_stop, '_tl_ref', None)
+          if t:
+            route.add_child(t)
+        # Maintain reference to GTFS Route
+        gtfs_route._tl_ref = route
+        route_stops[gtfs_route] = gtfs_stops
 
     # Create TL Agencies
-    for gtfs_agency in gtfs_agencies:
-      operator = Operator.from_gtfs(
-        gtfs_agency,
-        feedid,
-        onestop_id=agency_onestop.get(gtfs_agency.id())
+    with timer.stage('operators'):
+      for gtfs_agency in gtfs_agencies:
+        kw = {}
+        if stream:
+          gtfs_stops = set()
+          for gtfs_route in gtfs_agency.routes():
+            gtfs_stops |= set(route_stops.get(gtfs_route, []))
+          kw['geometry'] = gtfsstream.agency_geometry(gtfs_stops)
+        operator = Operator.from_gtfs(
+          gtfs_agency,
+          feedid,
+          onestop_id=agency_onestop.get(gtfs_agency.id()),
+          **kw
+        )
+        for gtfs_route in gtfs_agency.routes():
+          t = getattr(gtfs_route, '_tl_ref', None)
+          if t:
+            operator.add_child(t)
+        # Add agency to feed
+        self.add_child(operator)
+
+  def _link_gtfs_agencies(self, gtfs_feed):
+    """Link GTFS routes to agencies, as in mzgtfs Feed.preload()."""
+    default_agency_id = None
+    agencies = gtfs_feed.agencies()
+    if len(agencies) == 1:
+      default_agency_id = agencies[0].get('agency_id')
+    for gtfs_route in gtfs_feed.routes():
+      gtfs_route.add_parent(
+        gtfs_feed.agency(gtfs_route.get('agency_id') or default_agency_id)
       )
-      for gtfs_route in gtfs_agency.routes():
-        t = getattr(gtfs_route, '_tl_ref', None)
-        if t:
-          operator.add_child(t)
-      # Inelegant.
-      operator._cache_onestop()
-      # Add agency to feed
-      self.add_child(operator)
 
   def json(self):
     return {
@@ -132,8 +199,8 @@ class Feed(Entity):
       "operatorsInFeed": self.operatorsInFeed()
     }
 
-  def geohash(self):
-    return geom.geohash_features(self.stops())
+  def make_geohash(self):
+    return geom.geohash_features(self.descendants('s'))
 
   # Graph
   def operatorsInFeed(self):
@@ -154,25 +221,19 @@ class Feed(Entity):
     return set(self.children) # copy
 
   def operator(self, onestop_id):
-    """Return a single operator by Onestop ID."""
-    return util.filtfirst(self.operators(), onestop=onestop_id)
+    """Return a single operator by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='o')
 
   def routes(self):
-    routes = set()
-    for i in self.operators():
-      routes |= i.routes()
-    return routes
+    return set(self.descendants('r')) # copy
 
   def route(self, onestop_id):
-    """Return a single route by Onestop ID."""
-    return util.filtfirst(self.routes(), onestop=onestop_id)
+    """Return a single route by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='r')
 
   def stops(self):
-    stops = set()
-    for i in self.operators():
-      stops |= i.stops()
-    return stops
+    return set(self.descendants('s')) # copy
 
   def stop(self, onestop_id):
-    """Return a single stop by Onestop ID."""
-    return util.filtfirst(self.stops(), onestop=onestop_id)
+    """Return a single stop by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='s')
@@ -1,14 +1,77 @@
 """Fetch Transitland Feed Registry feeds."""
 import argparse
+import collections
+import os
+import Queue
+import threading
+import urlparse
 
 import registry
+import store
 import util
 
+# SHA1s of downloaded feeds, in the download directory.
+HASHCACHE = '.transitland-sha1.json'
+
+def _host(url):
+  return urlparse.urlparse(url or '').netloc
+
+def fetch_feeds(feeds, path='.', workers=4, per_host=2, hashcache=None, store=None):
+  """Download feeds concurrently to <path>/<onestopId>.zip.
+
+  At most workers downloads run at once, and at most per_host to any
+  single host. Yields (feed, filename, error) as each download finishes;
+  error is None on success, otherwise the exception. hashcache is an
+  optional util.HashCache for verifying existing files. If a
+  store.FeedStore is given, feeds are downloaded into the store, and
+  filename is the stored version.
+  """
+  results = Queue.Queue()
+  pending = list(feeds)
+  active = collections.Counter()
+  running = 0
+
+  def download(feed, filename):
+    try:
+      filename = feed.download(filename, hashcache=hashcache, store=store)
+      results.put((feed, filename, None))
+    except Exception, e:
+      results.put((feed, filename, e))
+
+  while pending or running:
+    # Start downloads for hosts below the per-host limit.
+    for feed in list(pending):
+      if running >= workers:
+        break
+      host = _host(feed.url())
+      if active[host] >= per_host:
+        continue
+      pending.remove(feed)
+      active[host] += 1
+      running += 1
+      filename = os.path.join(path, '%s.zip'%feed.onestop())
+      t = threading.Thread(target=download, args=(feed, filename))
+      t.daemon = True
+      t.start()
+    # Wait for a download to finish.
+    try:
+      feed, filename, error = results.get(timeout=1)
+    except Queue.Empty:
+      continue
+    active[_host(feed.url())] -= 1
+    running -= 1
+    yield feed, filename, error
+
 def run():
   parser = argparse.ArgumentParser(description='Fetch Transitland Feeds')
   parser.add_argument('feedids', nargs='*', help='Feed IDs')
   parser.add_argument('--registry', help='Feed Registry Path')
   parser.add_argument('--all', help='Update all feeds', action='store_true')
+  parser.add_argument('--workers', help='Concurrent downloads', type=int, default=4)
+  parser.add_argument('--per-host', help='Concurrent downloads per host', type=int, default=2)
+  parser.add_argument('--store', help='Download into a content-addressed feed store at this path')
+  parser.add_argument('--max-bytes', help='Feed store size limit, in bytes', type=int)
+  parser.add_argument('--rehash', help='Ignore the hash cache, and hash existing files again', action='store_true')
   parser.add_argument('--verbose', help='Verbosity', type=int, default=1)
   args = parser.parse_args()
 
@@ -19,11 +82,40 @@ def run():
     feedids = r.feeds()
   if len(feedids) == 0:
     raise Exception("No feeds specified! Try --all")
-  for feedid in feedids:
-    feed = r.feed(feedid)
-    filename = '%s.zip'%feed.onestop()
-    print "Downloading: %s -> %s"%(feed.url(), filename)
-    feed.download(filename)
+  feeds = [r.feed(feedid) for feedid in feedids]
+  failed = []
+  feedstore = None
+  path = '.'
+  if args.store:
+    feedstore = store.FeedStore(args.store, max_bytes=args.max_bytes)
+    path = args.store
+  hashcache = util.HashCache(os.path.join(path, HASHCACHE), rehash=args.rehash)
+  results = fetch_feeds(
+    feeds,
+    workers=args.workers,
+    per_host=args.per_host,
+    hashcache=hashcache,
+    store=feedstore
+  )
+  for count, (feed, filename, error) in enumerate(results, 1):
+    if error:
+      failed.append(feed)
+      print "[%s/%s] Error: %s: %s"%(count, len(feeds), feed.onestop(), error)
+    else:
+      print "[%s/%s] Downloaded: %s -> %s"%(count, len(feeds), feed.url(), filename)
+  print "Feeds: %s, errors: %s, downloaded: %s, not modified: %s"%(
+    len(feeds),
+    len(failed),
+    util.download_stats['downloaded'],
+    util.download_stats['not_modified']
+  )
+  print "Hash cache: hits: %s, misses: %s"%(
+    hashcache.stats['hit'],
+    hashcache.stats['miss']
+  )
+  hashcache.save()
+  if feedstore:
+    print "Store: %s versions, %s bytes"%(len(feedstore.objects), feedstore.size())
 
 if __name__ == "__main__":
-  run()
\ No newline at end of file
+  run()
@@ -1,20 +1,178 @@
 """Geometry utilities."""
+import collections
+import math
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 import mzgeohash
 
 import errors
 
+# Geohash base 32 alphabet, and mzgeohash.encode() default length.
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 12
+
 def geohash_features(features):
   """mzgeohash.neighborsfit on a list of features that implement point()."""
   # Filter stops without valid coordinates...
   points = [feature.point() for feature in features if feature.point()]
   if not points:
     raise errors.NoPointsError("Not enough points.")
+  if numpy:
+    return geohash_points(numpy.array(points, dtype=numpy.float64))
   c = centroid(points)
   return mzgeohash.neighborsfit(c, points)
-  
+
 def centroid(points):
   """Return the lon,lat simple geometric centroid for features."""
   # Todo: Geographic center, or simple average?
   x = sum(i[0] for i in points)
   y = sum(i[1] for i in points)
   return x/len(points), y/len(points)
+
+# Mean earth radius, in meters.
+EARTH_RADIUS = 6371008.8
+
+def haversine(a, b):
+  """Great circle distance, in meters, between two lon,lat points."""
+  lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+  h = math.sin((lat2 - lat1) / 2)**2 + \
+    math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+  return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+def geohash_size(length):
+  """Return the (width, height) in degrees of geohash cells of length."""
+  return 360.0 / 2**((5 * length + 1) / 2), 180.0 / 2**(5 * length / 2)
+
+def geohash_encode(point, length=GEOHASH_LENGTH):
+  """mzgeohash.encode(), also for odd lengths."""
+  return mzgeohash.encode(point, length=length + length % 2)[:length]
+
+def geohash_bbox(geohash):
+  """Return the (minlon, minlat, maxlon, maxlat) of a geohash cell."""
+  lon, lat = mzgeohash.decode(geohash)
+  width, height = geohash_size(len(geohash))
+  return lon - width / 2, lat - height / 2, lon + width / 2, lat + height / 2
+
+def radius_bbox(point, radius):
+  """Return the (minlon, minlat, maxlon, maxlat) around a circle.
+
+  Longitudes may be outside -180 to 180 near the antimeridian. If the
+  circle contains a pole, the bbox spans all longitudes.
+  """
+  angle = float(radius) / EARTH_RADIUS
+  dlat = math.degrees(angle)
+  minlat, maxlat = point[1] - dlat, point[1] + dlat
+  if minlat <= -90 or maxlat >= 90:
+    return -180.0, max(minlat, -90.0), 180.0, min(maxlat, 90.0)
+  # The circle's east and west extents are north or south of the
+  # point; dlat / cos(lat) is the smaller extent along the parallel.
+  dlon = math.degrees(math.asin(min(math.sin(angle) / math.cos(math.radians(point[1])), 1.0)))
+  return point[0] - dlon, minlat, point[0] + dlon, maxlat
+
+def bbox_cells(bbox, length):
+  """Return the geohash cells of length that intersect a bbox."""
+  width, height = geohash_size(length)
+  minlon, minlat, maxlon, maxlat = bbox
+  if maxlon - minlon >= 360:
+    minlon, maxlon = -180.0, 180.0
+  lons = [minlon + i * width for i in range(int((maxlon - minlon) / width) + 1)] + [maxlon]
+  lats = [minlat + i * height for i in range(int((maxlat - minlat) / height) + 1)] + [maxlat]
+  # Wrap longitudes across the antimeridian.
+  lons = [lon if -180 <= lon <= 180 else (lon + 180.0) % 360.0 - 180.0 for lon in lons]
+  return set(geohash_encode((lon, lat), length=length) for lon in lons for lat in lats)
+
+def geohash_cover(points, radius, length=None):
+  """Return (cells, length): geohash cells covering circles around points.
+
+  By default, length is the longest geohash length whose cells are
+  larger than each circle, so each circle needs at most four cells; circles around a pole
+  may need more.
+  Cells are then merged into their parent if all 32 children are
+  present.
+  """
+  bboxes = [radius_bbox(point, radius) for point in points]
+  if length is None:
+    length = 1
+    for i in range(GEOHASH_LENGTH, 0, -1):
+      width, height = geohash_size(i)
+      if all(b[2] - b[0] <= width and b[3] - b[1] <= height for b in bboxes):
+        length = i
+        break
+  cells = set()
+  for b in bboxes:
+    cells |= bbox_cells(b, length)
+  # Merge complete sets of children.
+  while True:
+    parents = collections.Counter(i[:-1] for i in cells if len(i) > 1)
+    full = [k for k, v in parents.items() if v == len(BASE32)]
+    if not full:
+      return cells, length
+    for parent in full:
+      cells -= set(parent + i for i in BASE32)
+      cells.add(parent)
+
+# Batch geometry; requires numpy.
+def geohash_points(points):
+  """mzgeohash.neighborsfit on an (N,2) array of lon,lat points."""
+  if len(points) == 0:
+    raise errors.NoPointsError("Not enough points.")
+  return neighborsfit_points(centroid_points(points), points)
+
+def centroid_points(points):
+  """centroid() for an (N,2) array of lon,lat points."""
+  # cumsum adds in order, matching the rounding of sum() in centroid().
+  x = numpy.cumsum(points[:,0])[-1]
+  y = numpy.cumsum(points[:,1])[-1]
+  return float(x)/len(points), float(y)/len(points)
+
+def encode_points(points, length=GEOHASH_LENGTH):
+  """Encode an (N,2) array of lon,lat points to integer geohashes.
+
+  Each geohash character is 5 bits; the result is a uint64 array, so
+  length must be 12 or less. Uses the same bisection as mzgeohash.encode().
+  """
+  one = numpy.uint64(1)
+  two = numpy.uint64(2)
+  lon = points[:,0]
+  lat = points[:,1]
+  lon_lower = numpy.full(len(points), -180.0)
+  lon_upper = numpy.full(len(points), 180.0)
+  lon_middle = numpy.zeros(len(points))
+  lat_lower = numpy.full(len(points), -90.0)
+  lat_upper = numpy.full(len(points), 90.0)
+  lat_middle = numpy.zeros(len(points))
+  ret = numpy.zeros(len(points), dtype=numpy.uint64)
+  for i in range(length / 2 * 5):
+    lon_bit = lon >= lon_middle
+    lon_lower = numpy.where(lon_bit, lon_middle, lon_lower)
+    lon_upper = numpy.where(lon_bit, lon_upper, lon_middle)
+    lon_middle = (lon_upper + lon_lower) / 2
+    lat_bit = lat >= lat_middle
+    lat_lower = numpy.where(lat_bit, lat_middle, lat_lower)
+    lat_upper = numpy.where(lat_bit, lat_upper, lat_middle)
+    lat_middle = (lat_upper + lat_lower) / 2
+    ret = (ret << two) | (lon_bit.astype(numpy.uint64) << one) | lat_bit.astype(numpy.uint64)
+  return ret
+
+def geohash_to_int(geohash):
+  """Return the integer value of a geohash string."""
+  ret = 0
+  for i in geohash:
+    ret = (ret << 5) | BASE32.index(i)
+  return ret
+
+def neighborsfit_points(c, points):
+  """mzgeohash.neighborsfit for a centroid and an (N,2) array of points."""
+  centroid = mzgeohash.encode(c)
+  codes = encode_points(points, length=len(centroid))
+  for i in range(1, len(centroid)):
+    g = centroid[0:i]
+    n = [geohash_to_int(j) for j in set(mzgeohash.neighbors(g).values())]
+    prefixes = codes >> numpy.uint64(5 * (len(centroid) - i))
+    if not numpy.in1d(prefixes, numpy.array(n, dtype=numpy.uint64)).all():
+      break
+  return g[0:-1]
@@ -0,0 +1,293 @@
+"""Pooled keep-alive HTTP connections."""
+import errno
+import httplib
+import select
+import socket
+import threading
+import time
+import urlparse
+import zlib
+
+import util
+
+# Methods that are safe to send again; see RFC 7231 4.2.2.
+IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Headers not sent to a different host after a redirect.
+CREDENTIALS = ('authorization', 'cookie', 'proxy-authorization')
+
+def _dropped(conn):
+  """True if an idle connection was closed, or sent unexpected data."""
+  if conn.sock is None:
+    return True
+  try:
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+  except (select.error, socket.error, ValueError):
+    return True
+  return bool(readable)
+
+def _stale(error):
+  """True if a kept connection failed before any response was received."""
+  if isinstance(error, httplib.BadStatusLine):
+    return not error.line.strip("'")
+  if isinstance(error, socket.timeout):
+    return False
+  if isinstance(error, socket.error):
+    return error.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+  return False
+
+def same_host(url, other):
+  """True if two urls have the same scheme, host and port."""
+  a, b = urlparse.urlparse(url), urlparse.urlparse(other)
+  return (a.scheme, a.netloc.lower()) == (b.scheme, b.netloc.lower())
+
+def _redirect_headers(headers, url, location):
+  """Headers for a redirect; credentials are only sent to the same host."""
+  if same_host(url, location):
+    return headers
+  return dict((k, v) for k, v in (headers or {}).items() if k.lower() not in CREDENTIALS)
+
+def encode(body, encoding='gzip', level=6):
+  """Compress a body with a Content-Encoding, gzip or deflate."""
+  if encoding == 'gzip':
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(body) + c.flush()
+  if encoding == 'deflate':
+    return zlib.compress(body, level)
+  raise ValueError("Unknown Content-Encoding: %s"%encoding)
+
+def decode(body, encoding):
+  """Decompress a body with a Content-Encoding.
+
+  Raises zlib.error for invalid data, ValueError for unknown encodings.
+  """
+  encoding = (encoding or 'identity').strip().lower()
+  if encoding == 'identity':
+    return body
+  if encoding in ('gzip', 'x-gzip'):
+    # Also accepts a zlib header.
+    return zlib.decompress(body, 32 + zlib.MAX_WBITS)
+  if encoding == 'deflate':
+    # Properly zlib wrapped, but some servers send raw deflate.
+    try:
+      return zlib.decompress(body)
+    except zlib.error:
+      return zlib.decompress(body, -zlib.MAX_WBITS)
+  raise ValueError("Unknown Content-Encoding: %s"%encoding)
+
+def decoder(encoding):
+  """Incremental decoder for a Content-Encoding, or None for identity.
+
+  Returns a zlib decompress object. Unlike decode(), deflate must be
+  zlib wrapped, as the HTTP specification requires.
+  """
+  encoding = (encoding or 'identity').strip().lower()
+  if encoding == 'identity':
+    return None
+  if encoding in ('gzip', 'x-gzip'):
+    return zlib.decompressobj(32 + zlib.MAX_WBITS)
+  if encoding == 'deflate':
+    return zlib.decompressobj()
+  raise ValueError("Unknown Content-Encoding: %s"%encoding)
+
+class Response(object):
+  """A complete HTTP response. Header names are lower case."""
+  def __init__(self, status, reason, headers, body):
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.body = body
+
+  def getheader(self, name, default=None):
+    return self.headers.get(name.lower(), default)
+
+class StreamingResponse(object):
+  """An HTTP response with a body that is read incrementally.
+
+  The connection is returned to the pool once the body is read, or
+  closed if close() is called first. Header names are lower case.
+  """
+  def __init__(self, pool, key, conn, response):
+    self.status = response.status
+    self.reason = response.reason
+    self.headers = dict(response.getheaders())
+    self._pool = pool
+    self._key = key
+    self._conn = conn
+    self._response = response
+
+  def getheader(self, name, default=None):
+    return self.headers.get(name.lower(), default)
+
+  def read(self, amt=None):
+    """Read up to amt bytes of the body, or the rest; '' at the end."""
+    if self._conn is None:
+      return ''
+    try:
+      data = self._response.read(amt)
+    except (socket.error, httplib.HTTPException):
+      self.close()
+      raise
+    if not data or self._response.isclosed():
+      self.close()
+    return data
+
+  def iter_content(self, blocksize=65536):
+    """Yield the body in blocks of up to blocksize bytes."""
+    while True:
+      data = self.read(blocksize)
+      if not data:
+        break
+      yield data
+
+  def close(self):
+    """Release the connection; it is only kept if the body was read."""
+    if self._conn is None:
+      return
+    if self._response.isclosed() and not self._response.will_close:
+      self._pool._put(self._key, self._conn)
+    else:
+      self._conn.close()
+    self._conn = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+class ConnectionPool(object):
+  """Persistent HTTP connections, kept per host.
+
+  Up to size idle connections are kept for each host, and closed after
+  idle_timeout seconds unused; size=0 disables reuse. Kept connections
+  that the server has closed are discarded before use. If one fails
+  anyway, before any response is received, an idempotent request is
+  sent again on a new connection; other requests, such as POST, are
+  never sent twice. Credentials are not sent on redirects to another
+  host. Safe to use from multiple threads. stats counts 'connect',
+  'reuse' and 'dropped'.
+  """
+  def __init__(self, size=4, idle_timeout=60, timeout=None, redirects=5):
+    self.size = size
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+    self.redirects = redirects
+    self.stats = util.Stats()
+    self._idle = {}
+    self._lock = threading.Lock()
+
+  def _connect(self, key):
+    scheme, netloc = key
+    if scheme == 'https':
+      cls = httplib.HTTPSConnection
+    else:
+      cls = httplib.HTTPConnection
+    self.stats.incr('connect')
+    return cls(netloc, timeout=self.timeout)
+
+  def _get(self, key):
+    """Return (connection, reused)."""
+    now = time.time()
+    with self._lock:
+      idle = self._idle.get(key, [])
+      while idle:
+        conn, t = idle.pop()
+        if now - t < self.idle_timeout:
+          if _dropped(conn):
+            self.stats.incr('dropped')
+          else:
+            self.stats.incr('reuse')
+            return conn, True
+        conn.close()
+    return self._connect(key), False
+
+  def _put(self, key, conn):
+    with self._lock:
+      idle = self._idle.setdefault(key, [])
+      if len(idle) < self.size:
+        idle.append((conn, time.time()))
+        return
+    conn.close()
+
+  def request(self, method, url, body=None, headers=None):
+    """Send a request, following redirects. Returns a Response.
+
+    Raises socket.error or httplib.HTTPException on connection errors.
+    """
+    for i in range(self.redirects + 1):
+      response = self._request(method, url, body=body, headers=headers)
+      location = response.getheader('Location')
+      if response.status not in (301, 302, 303, 307, 308) or not location:
+        break
+      location = urlparse.urljoin(url, location)
+      headers = _redirect_headers(headers, url, location)
+      url = location
+      if response.status == 303:
+        method, body = 'GET', None
+    return response
+
+  def open(self, method, url, body=None, headers=None):
+    """Send a request, following redirects. Returns a StreamingResponse.
+
+    The body is not read; read it, or close the response, to release
+    the connection.
+    """
+    for i in range(self.redirects + 1):
+      key, conn, response, data = self._send(method, url, body=body, headers=headers, read=False)
+      response = StreamingResponse(self, key, conn, response)
+      location = response.getheader('Location')
+      if response.status not in (301, 302, 303, 307, 308) or not location or i == self.redirects:
+        break
+      response.read()
+      location = urlparse.urljoin(url, location)
+      headers = _redirect_headers(headers, url, location)
+      url = location
+      if response.status == 303:
+        method, body = 'GET', None
+    return response
+
+  def _request(self, method, url, body=None, headers=None):
+    key, conn, response, data = self._send(method, url, body=body, headers=headers)
+    if response.will_close:
+      conn.close()
+    else:
+      self._put(key, conn)
+    return Response(response.status, response.reason, dict(response.getheaders()), data)
+
+  def _send(self, method, url, body=None, headers=None, read=True):
+    """Returns (key, connection, response, body); body is None unless read."""
+    parsed = urlparse.urlparse(url)
+    key = (parsed.scheme, parsed.netloc)
+    path = parsed.path or '/'
+    if parsed.query:
+      path = '%s?%s'%(path, parsed.query)
+    while True:
+      conn, reused = self._get(key)
+      try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+      except (socket.error, httplib.HTTPException), e:
+        conn.close()
+        if reused and method in IDEMPOTENT and _stale(e):
+          # Closed by the server while idle.
+          continue
+        raise
+      break
+    data = None
+    if read:
+      try:
+        data = response.read()
+      except (socket.error, httplib.HTTPException):
+        # Part of the response was received; never sent again.
+        conn.close()
+        raise
+    return key, conn, response, data
+
+  def close(self):
+    """Close all idle connections."""
+    with self._lock:
+      for idle in self._idle.values():
+        for conn, t in idle:
+          conn.close()
+      self._idle = {}
@@ -0,0 +1,96 @@
+"""Incremental decoding of large JSON responses."""
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+class _Buffer(object):
+  """JSON text from an iterable of chunks, read as needed."""
+  def __init__(self, chunks):
+    self.chunks = iter(chunks)
+    self.text = ''
+    self.pos = 0
+    self.eof = False
+
+  def more(self):
+    """Read another chunk, dropping decoded text. False at the end."""
+    for chunk in self.chunks:
+      if chunk:
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+    self.eof = True
+    return False
+
+  def peek(self):
+    """Skip whitespace; return the next character, or '' at the end."""
+    while True:
+      self.pos = WHITESPACE.match(self.text, self.pos).end()
+      if self.pos < len(self.text):
+        return self.text[self.pos]
+      if not self.more():
+        return ''
+
+  def expect(self, chars):
+    """Consume and return the next character, one of chars."""
+    c = self.peek()
+    if not c or c not in chars:
+      raise ValueError("Expected one of %r, got %r"%(chars, c or 'end of data'))
+    self.pos += 1
+    return c
+
+  def value(self):
+    """Decode the next JSON value."""
+    self.peek()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self.text, self.pos)
+      except ValueError:
+        # Incomplete, unless there is no more data.
+        if self.more():
+          continue
+        raise
+      if end == len(self.text) and not self.eof and self.more():
+        # A number may continue in the next chunk.
+        continue
+      self.pos = end
+      return value
+
+def iter_array(chunks, key, other=None):
+  """Yield each item of data[key], where data is the JSON object in chunks.
+
+  Each item is decoded as soon as it is complete, so only the current
+  item and chunk are held. The other keys of data, before or after the
+  array, are added to the dict other, if given. Nothing is yielded if
+  data[key] is missing or not an array. Raises ValueError for invalid
+  or incomplete JSON.
+  """
+  buf = _Buffer(chunks)
+  buf.expect('{')
+  if buf.peek() == '}':
+    buf.pos += 1
+  else:
+    while True:
+      name = buf.value()
+      if not isinstance(name, basestring):
+        raise ValueError("Expected an object key, got %r"%name)
+      buf.expect(':')
+      if name == key and buf.peek() == '[':
+        buf.pos += 1
+        if buf.peek() == ']':
+          buf.pos += 1
+        else:
+          while True:
+            yield buf.value()
+            if buf.expect(',]') == ']':
+              break
+      else:
+        value = buf.value()
+        if other is not None:
+          other[name] = value
+      if buf.expect(',}') == '}':
+        break
+  if buf.peek():
+    raise ValueError("Extra data after JSON object")
@@ -1,6 +1,5 @@
 """Operator Entity."""
 import geom
-import util
 import errors
 from entity import Entity
 from stop import Stop
@@ -16,16 +15,8 @@ class Operator(Entity):
   def init(self, **data):
     self.timezone = data.pop('timezone', None)    
 
-  def geohash(self):
-    return geom.geohash_features(self.stops())
-
-  def _cache_onestop(self):
-    key = 'onestopId'
-    self.data[key] = self.data.get(key) or self.make_onestop()
-    for i in self.routes():
-      i.data[key] = i.data.get(key) or i.make_onestop()
-    for i in self.stops():
-      i.data[key] = i.data.get(key) or i.make_onestop()
+  def make_geohash(self):
+    return geom.geohash_features(self.descendants('s'))
 
   def add_tags_gtfs(self, gtfs_entity):
     keys = [
@@ -42,14 +33,17 @@ class Operator(Entity):
         self.set_tag(key, data[key])
 
   @classmethod
-  def from_json(cls, data):
-    """Load Operator from GeoJSON."""
+  def from_json(cls, data, stoptable=None):
+    """Load Operator from GeoJSON. Optionally, store stops in a StopTable."""
     agency = cls(**data)
     # Add stops
     stops = {}
     for feature in data['features']:
       if feature['onestopId'].startswith('s'):
-        stop = Stop.from_json(feature)
+        if stoptable is None:
+          stop = Stop.from_json(feature)
+        else:
+          stop = stoptable.add(**feature)
         stops[stop.onestop()] = stop
     # Add routes
     for feature in data['features']:
@@ -73,13 +67,13 @@ class Operator(Entity):
       'identifiers': sorted(self.identifiers()),
       'serves': sorted(self.serves()),
       'features': [
-        i.json() for i in sorted_onestop(self.routes() | self.stops())
+        i.json() for i in sorted_onestop(self.descendants())
       ]
     }
 
   # Graph
   def serves(self):
-    ret = set([i.onestop() for i in self.stops()])
+    ret = set([i.onestop() for i in self.descendants('s')])
     ret |= set(self.data.get('serves', []))
     return ret
 
@@ -87,15 +81,12 @@ class Operator(Entity):
     return set(self.children)
 
   def route(self, onestop_id):
-    """Return a single route by Onestop ID."""
-    return util.filtfirst(self.routes(), onestop=onestop_id)
+    """Return a single route by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='r')
 
   def stops(self):
-    stops = set()
-    for i in self.routes():
-      stops |= i.stops()
-    return stops
+    return set(self.descendants('s')) # copy
 
   def stop(self, onestop_id):
-    """Return a single stop by Onestop ID."""
-    return util.filtfirst(self.stops(), onestop=onestop_id)
+    """Return a single stop by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='s')
@@ -0,0 +1,101 @@
+"""Retry policy and client-side rate limiting for HTTP requests."""
+import email.utils
+import random
+import threading
+import time
+
+import util
+
+class RetryPolicy(object):
+  """When, and how long to wait, before retrying a failed request.
+
+  Connection errors and responses with a status in statuses are
+  retried up to retries times, with exponential backoff and full
+  jitter: a random delay of up to backoff * 2**attempt seconds, at most
+  max_backoff. A Retry-After header is used as the delay instead.
+  Requests that are not idempotent, such as POST, are only retried if
+  retry_post=True. stats counts 'retry' and 'retry_after'.
+  """
+  def __init__(self, retries=3, backoff=0.5, max_backoff=30, statuses=(429, 500, 502, 503, 504), retry_post=False):
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.statuses = set(statuses)
+    self.retry_post = retry_post
+    self.stats = util.Stats()
+    self.sleep = time.sleep
+    self.clock = time.time
+    self.random = random.Random()
+
+  def retryable(self, method, attempt, status=None):
+    """Return True if a request should be retried.
+
+    attempt counts from 0; status is None for connection errors.
+    """
+    if attempt >= self.retries:
+      return False
+    if method not in ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS') and not self.retry_post:
+      return False
+    return status is None or status in self.statuses
+
+  def delay(self, attempt, retry_after=None):
+    """Seconds to wait before retry number attempt."""
+    if retry_after:
+      seconds = self.retry_after(retry_after)
+      if seconds is not None:
+        self.stats.incr('retry_after')
+        return min(seconds, self.max_backoff)
+    return self.random.uniform(0, min(self.backoff * 2**attempt, self.max_backoff))
+
+  def retry_after(self, value):
+    """Parse a Retry-After header, as seconds or an HTTP date."""
+    try:
+      return max(0.0, float(value))
+    except ValueError:
+      pass
+    date = email.utils.parsedate_tz(value)
+    if date:
+      return max(0.0, email.utils.mktime_tz(date) - self.clock())
+
+  def wait(self, attempt, retry_after=None):
+    """Sleep before retry number attempt."""
+    self.stats.incr('retry')
+    self.sleep(self.delay(attempt, retry_after=retry_after))
+
+class TokenBucket(object):
+  """Token bucket rate limiter, shared between threads.
+
+  Allows rate requests per second on average, and bursts of up to
+  burst requests. acquire() blocks until a token is available.
+  """
+  def __init__(self, rate, burst=None):
+    self.rate = float(rate)
+    self.burst = float(burst or max(1, rate))
+    self.tokens = self.burst
+    self.sleep = time.sleep
+    self.clock = time.time
+    self.updated = None
+    self._lock = threading.Lock()
+
+  def _take(self, tokens):
+    """Take tokens if available; otherwise return the seconds to wait."""
+    with self._lock:
+      now = self.clock()
+      if self.updated is not None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      # Allow for rounding in the refill.
+      if self.tokens >= tokens - 1e-9:
+        self.tokens = max(0.0, self.tokens - tokens)
+        return 0
+      return (tokens - self.tokens) / self.rate
+
+  def acquire(self, tokens=1):
+    """Wait for and take tokens. Returns the total seconds waited."""
+    waited = 0
+    while True:
+      wait = self._take(tokens)
+      if not wait:
+        return waited
+      self.sleep(wait)
+      waited += wait
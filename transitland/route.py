@@ -8,9 +8,9 @@ class Route(Entity):
   """Transitland Route Entity."""
   onestop_type = 'r'
 
-  def geohash(self):
+  def make_geohash(self):
     """Return 10 characters of geohash."""
-    return geom.geohash_features(self.stops())
+    return geom.geohash_features(self.children)
 
   def add_tags_gtfs(self, gtfs_entity):
     keys = [
@@ -42,13 +42,13 @@ class Route(Entity):
 
   # Graph
   def serves(self):
-    ret = set([i.onestop() for i in self.stops()])
+    ret = set([i.onestop() for i in self.children])
     ret |= set(self.data.get('serves', []))
     return ret
 
   def operatedBy(self):
     """Return the first operator."""
-    ret = set(i.onestop() for i in self.operators())
+    ret = set(i.onestop() for i in self.parents)
     ret |= set(self.data.get('operatedBy', []))
     return sorted(ret)[0]
 
@@ -63,5 +63,5 @@ class Route(Entity):
     return set(self.children) # copy
 
   def stop(self, onestop_id):
-    """Return a single stop by Onestop ID."""
-    return util.filtfirst(self.stops(), onestop=onestop_id)
+    """Return a single stop by Onestop ID or identifier."""
+    return self._find(onestop_id, onestop_type='s')
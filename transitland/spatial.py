@@ -0,0 +1,252 @@
+"""In-memory spatial index of points, such as stops."""
+import array
+import heapq
+import math
+
+import geom
+
+class SpatialIndex(object):
+  """Grid of points, bucketed by geohash cell, for offline spatial queries.
+
+  Each bucket is a geohash cell of length; its key is the (column, row)
+  of the cell in the grid of all cells of that length. Radius and
+  nearest queries use haversine distances, in meters; see geom.haversine.
+
+  Results are the items given to add() and load(), or if item is
+  given, item(row) for each row number; e.g. StopTable.stop.
+  """
+  def __init__(self, length=7, item=None):
+    self.length = length
+    self.width, self.height = geom.geohash_size(length)
+    self.columns = int(round(360.0 / self.width))
+    self.rows = int(round(180.0 / self.height))
+    self.item = item
+    self.lon = array.array('d')
+    self.lat = array.array('d')
+    self.items = []
+    # (column, row) -> array of row numbers.
+    self.buckets = {}
+
+  def __len__(self):
+    return len(self.lon)
+
+  @classmethod
+  def from_entities(cls, entities, length=7):
+    """Index entities, such as Stops, by point(); skips those without."""
+    index = cls(length=length)
+    for entity in entities:
+      point = entity.point()
+      if point:
+        index.add(point, entity)
+    return index
+
+  @classmethod
+  def from_stoptable(cls, table, length=7):
+    """Index the stops of a StopTable, without creating each Stop."""
+    index = cls(length=length, item=table.stop)
+    index.load(table.lon, table.lat)
+    return index
+
+  def _cell(self, lon, lat):
+    column = min(max(int(math.floor((lon + 180.0) / self.width)), 0), self.columns - 1)
+    row = min(max(int(math.floor((lat + 90.0) / self.height)), 0), self.rows - 1)
+    return column, row
+
+  def cell(self, point):
+    """Return the geohash of the bucket for a point."""
+    return geom.geohash_encode(point, length=self.length)
+
+  def _result(self, row):
+    if self.item:
+      return self.item(row)
+    return self.items[row]
+
+  def add(self, point, item=None):
+    """Add a point, with an item to return in results. Returns the row."""
+    row = len(self.lon)
+    self.lon.append(point[0])
+    self.lat.append(point[1])
+    if not self.item:
+      self.items.append(row if item is None else item)
+    key = self._cell(point[0], point[1])
+    bucket = self.buckets.get(key)
+    if bucket is None:
+      bucket = self.buckets[key] = array.array('l')
+    bucket.append(row)
+    return row
+
+  def load(self, lon, lat, items=None):
+    """Add points from sequences or arrays of longitudes and latitudes.
+
+    Points with a NaN coordinate are skipped. items are returned in
+    results; by default, the row numbers. Uses numpy, if available.
+    """
+    start = len(self.lon)
+    for values, column in ((lon, self.lon), (lat, self.lat)):
+      if geom.numpy and isinstance(values, geom.numpy.ndarray):
+        column.fromstring(values.astype(geom.numpy.float64).tostring())
+      else:
+        column.extend(values)
+    if len(self.lon) != len(self.lat):
+      raise ValueError("Expected the same number of longitudes and latitudes")
+    if not self.item:
+      if items is None:
+        self.items.extend(xrange(start, len(self.lon)))
+      else:
+        self.items.extend(items)
+    if len(self.items) not in (0, len(self.lon)):
+      raise ValueError("Expected one item for each point")
+    if geom.numpy:
+      self._load_numpy(start)
+      return
+    for row in xrange(start, len(self.lon)):
+      lon, lat = self.lon[row], self.lat[row]
+      if math.isnan(lon) or math.isnan(lat):
+        continue
+      key = self._cell(lon, lat)
+      bucket = self.buckets.get(key)
+      if bucket is None:
+        bucket = self.buckets[key] = array.array('l')
+      bucket.append(row)
+
+  def _load_numpy(self, start):
+    numpy = geom.numpy
+    lon = numpy.frombuffer(self.lon, dtype=numpy.float64)[start:]
+    lat = numpy.frombuffer(self.lat, dtype=numpy.float64)[start:]
+    rows = numpy.flatnonzero(~(numpy.isnan(lon) | numpy.isnan(lat)))
+    columns = numpy.clip(numpy.floor((lon[rows] + 180.0) / self.width), 0, self.columns - 1).astype(numpy.int64)
+    cellrows = numpy.clip(numpy.floor((lat[rows] + 90.0) / self.height), 0, self.rows - 1).astype(numpy.int64)
+    keys = columns * self.rows + cellrows
+    order = numpy.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    rows = rows[order] + start
+    bounds = numpy.flatnonzero(numpy.diff(keys)) + 1
+    for i, j in zip(numpy.concatenate(([0], bounds)), numpy.concatenate((bounds, [len(keys)]))):
+      key = divmod(int(keys[i]), self.rows)
+      bucket = self.buckets.get(key)
+      if bucket is None:
+        bucket = self.buckets[key] = array.array('l')
+      bucket.extend(rows[i:j].tolist())
+
+  def _split(self, bbox):
+    """Split a bbox at the antimeridian; minlon > maxlon crosses it."""
+    minlon, minlat, maxlon, maxlat = bbox
+    if maxlon - minlon >= 360:
+      return [(-180.0, minlat, 180.0, maxlat)]
+    if minlon > maxlon:
+      maxlon += 360
+    if minlon < -180:
+      minlon, maxlon = minlon + 360, maxlon + 360
+    if maxlon > 180:
+      return [(minlon, minlat, 180.0, maxlat), (-180.0, minlat, maxlon - 360, maxlat)]
+    return [(minlon, minlat, maxlon, maxlat)]
+
+  def _cells(self, bbox):
+    """Return the keys of non-empty buckets that intersect a bbox."""
+    c0, r0 = self._cell(bbox[0], bbox[1])
+    c1, r1 = self._cell(bbox[2], bbox[3])
+    if (c1 - c0 + 1) * (r1 - r0 + 1) > len(self.buckets):
+      return [k for k in self.buckets if c0 <= k[0] <= c1 and r0 <= k[1] <= r1]
+    buckets = self.buckets
+    return [
+      (c, r)
+      for c in xrange(c0, c1 + 1)
+      for r in xrange(r0, r1 + 1)
+      if (c, r) in buckets
+    ]
+
+  def _bbox_rows(self, bbox):
+    lon, lat = self.lon, self.lat
+    for b in self._split(bbox):
+      minlon, minlat, maxlon, maxlat = b
+      for key in self._cells(b):
+        for row in self.buckets[key]:
+          if minlon <= lon[row] <= maxlon and minlat <= lat[row] <= maxlat:
+            yield row
+
+  def bbox(self, bbox):
+    """Return the items within (minlon, minlat, maxlon, maxlat).
+
+    If minlon > maxlon, the bbox crosses the antimeridian.
+    """
+    return [self._result(row) for row in self._bbox_rows(bbox)]
+
+  def within(self, point, radius):
+    """Return (distance, item) within radius meters of a point, nearest first."""
+    ret = []
+    for row in self._bbox_rows(geom.radius_bbox(point, radius)):
+      d = geom.haversine(point, (self.lon[row], self.lat[row]))
+      if d <= radius:
+        ret.append((d, row))
+    ret.sort()
+    return [(d, self._result(row)) for d, row in ret]
+
+  def _ring(self, column, row, ring):
+    """Yield the keys of cells ring cells away from (column, row)."""
+    if ring == 0:
+      cells = [(column, row)]
+    else:
+      cells = [(c, r) for c in xrange(column - ring, column + ring + 1) for r in (row - ring, row + ring)]
+      cells += [(c, r) for c in (column - ring, column + ring) for r in xrange(row - ring + 1, row + ring)]
+    for c, r in cells:
+      if 0 <= r < self.rows:
+        yield c % self.columns, r
+
+  def _bound(self, point, column, row, ring):
+    """Minimum distance to any cell more than ring cells away."""
+    bounds = []
+    if row - ring > 0:
+      bounds.append(point[1] - ((row - ring) * self.height - 90.0))
+    if row + ring < self.rows - 1:
+      bounds.append(((row + ring + 1) * self.height - 90.0) - point[1])
+    if 2 * ring + 1 < self.columns:
+      lat = math.radians(point[1])
+      for edge in ((column - ring) * self.width - 180.0, (column + ring + 1) * self.width - 180.0):
+        dlon = math.radians(abs(point[0] - edge))
+        # Distance to the meridian at edge.
+        bounds.append(math.degrees(math.asin(math.sin(min(dlon, math.pi / 2)) * math.cos(lat))))
+    if not bounds:
+      return float('inf')
+    return math.radians(max(min(bounds), 0.0)) * geom.EARTH_RADIUS
+
+  def nearest(self, point, k=1, radius=None):
+    """Return up to k (distance, item) nearest a point, nearest first.
+
+    Searches rings of cells outward from the point's cell, until no
+    unsearched cell can be nearer than the k-th nearest found. Items
+    further than radius meters, if given, are not returned.
+    """
+    if not self.buckets or k < 1:
+      return []
+    column, row = self._cell(point[0], point[1])
+    # Max-heap of the k nearest, as (-distance, row).
+    heap = []
+    lon, lat = self.lon, self.lat
+    seen = set()
+    ring = 0
+    while True:
+      if (2 * ring + 1)**2 > 4 * len(self.buckets):
+        # Sparse: check the remaining buckets directly.
+        keys = [key for key in self.buckets if key not in seen]
+        bound = float('inf')
+      else:
+        keys = [key for key in self._ring(column, row, ring) if key in self.buckets and key not in seen]
+        bound = self._bound(point, column, row, ring)
+      for key in keys:
+        seen.add(key)
+        for i in self.buckets[key]:
+          d = geom.haversine(point, (lon[i], lat[i]))
+          if radius is not None and d > radius:
+            continue
+          if len(heap) < k:
+            heapq.heappush(heap, (-d, i))
+          elif d < -heap[0][0]:
+            heapq.heapreplace(heap, (-d, i))
+      if bound == float('inf'):
+        break
+      if len(heap) == k and bound >= -heap[0][0]:
+        break
+      if radius is not None and bound > radius:
+        break
+      ring += 1
+    return [(-d, self._result(i)) for d, i in sorted(heap, reverse=True)]
@@ -9,11 +9,12 @@ from entity import Entity
 class Stop(Entity):
   """Transitland Stop Entity."""
   onestop_type = 's'
+  __slots__ = ('timezone',)
 
   def init(self, **data):
     self.timezone = data.pop('timezone', None)    
 
-  def geohash(self):
+  def make_geohash(self):
     """Return 10 characters of geohash."""
     return mzgeohash.encode(self.point())
 
@@ -37,7 +38,7 @@ class Stop(Entity):
   def get_timezone(self):
     if self.timezone:
       return self.timezone
-    tz = set(i.timezone for i in self.operators())
+    tz = set(i.timezone for i in self.ancestors('o'))
     if len(tz) > 1:
       raise ValueError, "Ambiguous timezone; stop used by multiple agencies with differing timezones"
     return tz.pop()
@@ -59,15 +60,12 @@ class Stop(Entity):
   # Graph
   def servedBy(self):
     """Return the operators serving this stop."""
-    ret = set([i.onestop() for i in self.operators()])
+    ret = set([i.onestop() for i in self.ancestors('o')])
     ret |= set(self.data.get('servedBy', []))
     return ret
 
   def operators(self):
-    agencies = set()
-    for i in self.parents:
-      agencies |= i.parents
-    return agencies
+    return set(self.ancestors('o')) # copy
 
   def operator(self, onestop_id):
     """Return a single operator by Onestop ID."""
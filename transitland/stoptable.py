@@ -0,0 +1,318 @@
+"""Compact columnar storage for large numbers of Stops."""
+import array
+import collections
+import math
+
+import geom
+from stop import Stop
+
+class InternedColumn(object):
+  """A column of repeated values, stored as integer codes."""
+  def __init__(self):
+    self.values = []
+    self.codes = array.array('i')
+    self._index = {}
+
+  def __len__(self):
+    return len(self.codes)
+
+  def _code(self, value, key):
+    code = self._index.get(key)
+    if code is None:
+      code = len(self.values)
+      self.values.append(value)
+      self._index[key] = code
+    return code
+
+  def append(self, value, key=None):
+    self.codes.append(self._code(value, value if key is None else key))
+
+  def set(self, row, value, key=None):
+    self.codes[row] = self._code(value, value if key is None else key)
+
+  def get(self, row):
+    return self.values[self.codes[row]]
+
+def _tags_key(tags):
+  return tuple(sorted(tags.items()))
+
+def _extra_key(data):
+  return tuple(sorted(
+    (k, tuple(v) if isinstance(v, list) else v)
+    for k, v in data.items()
+  ))
+
+class StopTable(object):
+  """Columnar Stop storage.
+
+  Coordinates are stored in float arrays; names, timezones and tags are
+  interned; identifiers are stored in a flat list indexed by offsets.
+  Rows are accessed through StopProxy objects, which can be linked into
+  the entity graph like a Stop.
+  """
+  def __init__(self):
+    self.lon = array.array('d')
+    self.lat = array.array('d')
+    self.names = InternedColumn()
+    self.timezones = InternedColumn()
+    self.tags = InternedColumn()
+    # Identifiers for row i are identifiers[offsets[i]:offsets[i+1]]
+    self.identifier_offsets = array.array('l', [0])
+    self.identifiers = []
+    # Identifiers added after the row was created.
+    self.extra_identifiers = {}
+    # Onestop IDs: explicit, or memoized when derived.
+    self.onestop_ids = []
+    self.onestop_explicit = array.array('b')
+    # Parent entities, as tuples; None when unlinked.
+    self.parents = []
+    # Any other data, e.g. servedBy; rows with the same data share a dict.
+    self.extra = {}
+    self._extra_index = {}
+
+  def __len__(self):
+    return len(self.lon)
+
+  def __iter__(self):
+    for row in xrange(len(self)):
+      yield StopProxy(self, row)
+
+  def stop(self, row):
+    """Return a proxy for a row."""
+    if not 0 <= row < len(self):
+      raise IndexError(row)
+    return StopProxy(self, row)
+
+  def add(self, name=None, geometry=None, onestopId=None, identifiers=None, tags=None, timezone=None, **data):
+    """Add a stop; returns a proxy. Arguments are as for Stop()."""
+    if 'onestop_id' in data:
+      onestopId = data.pop('onestop_id')
+    row = len(self)
+    lon, lat = _geometry_point(geometry)
+    self.lon.append(lon)
+    self.lat.append(lat)
+    self.names.append(name)
+    self.timezones.append(timezone)
+    tags = tags or {}
+    self.tags.append(tags, key=_tags_key(tags))
+    self.identifiers.extend(identifiers or [])
+    self.identifier_offsets.append(len(self.identifiers))
+    self.onestop_ids.append(onestopId)
+    self.onestop_explicit.append(1 if onestopId else 0)
+    self.parents.append(None)
+    # The GeoJSON Feature type and empty properties are added by json().
+    data.pop('type', None)
+    if not data.get('properties'):
+      data.pop('properties', None)
+    self.set_extra(row, data)
+    return StopProxy(self, row)
+
+  def set_extra(self, row, data):
+    """Set the other data for a row; do not modify it afterwards."""
+    if not data:
+      self.extra.pop(row, None)
+      return
+    try:
+      data = self._extra_index.setdefault(_extra_key(data), data)
+    except TypeError:
+      # Unhashable values, e.g. properties; not shared.
+      pass
+    self.extra[row] = data
+
+  def add_stop(self, stop):
+    """Copy a Stop entity into the table; returns a proxy."""
+    data = dict(stop.data)
+    data['timezone'] = stop.timezone
+    return self.add(**data)
+
+  @classmethod
+  def from_json(cls, features):
+    """Load stops from a list of GeoJSON Stop features."""
+    table = cls()
+    for feature in features:
+      table.add(**feature)
+    return table
+
+  def points(self):
+    """Return the stop coordinates as an (N,2) numpy array."""
+    return geom.numpy.column_stack((
+      geom.numpy.frombuffer(self.lon, dtype=geom.numpy.float64),
+      geom.numpy.frombuffer(self.lat, dtype=geom.numpy.float64)
+    ))
+
+def _geometry_point(geometry):
+  if not geometry:
+    return float('nan'), float('nan')
+  lon, lat = geometry['coordinates'][:2]
+  return lon, lat
+
+class _Parents(object):
+  """Mutable set interface over StopTable parent tuples."""
+  __slots__ = ('table', 'row')
+
+  def __init__(self, table, row):
+    self.table = table
+    self.row = row
+
+  def _get(self):
+    return self.table.parents[self.row] or ()
+
+  def add(self, entity):
+    parents = self._get()
+    if entity not in parents:
+      self.table.parents[self.row] = parents + (entity,)
+
+  def __contains__(self, entity):
+    return entity in self._get()
+
+  def __iter__(self):
+    return iter(self._get())
+
+  def __len__(self):
+    return len(self._get())
+
+class StopProxy(Stop):
+  """A Stop backed by a StopTable row."""
+  __slots__ = ('table', 'row')
+  children = frozenset()
+
+  def __init__(self, table, row):
+    self.table = table
+    self.row = row
+
+  def __eq__(self, other):
+    return (
+      isinstance(other, StopProxy) and
+      self.table is other.table and
+      self.row == other.row
+    )
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __hash__(self):
+    return hash((id(self.table), self.row))
+
+  def __reduce__(self):
+    # Proxies are hashed in parent sets, so rebuild them with their row.
+    return StopProxy, (self.table, self.row)
+
+  def __repr__(self):
+    return '<%s %s>'%(self.__class__.__name__, self.row)
+
+  # Row data.
+  @property
+  def data(self):
+    """A copy of the row data, in the same form as Stop.data."""
+    data = dict(self.table.extra.get(self.row, {}))
+    data['name'] = self.name()
+    data['geometry'] = self.geometry()
+    data['tags'] = self.tags()
+    data['identifiers'] = self.identifiers()
+    if self.table.onestop_explicit[self.row]:
+      data['onestopId'] = self.table.onestop_ids[self.row]
+    return data
+
+  @property
+  def timezone(self):
+    return self.table.timezones.get(self.row)
+
+  @property
+  def parents(self):
+    return _Parents(self.table, self.row)
+
+  def name(self):
+    return self.table.names.get(self.row)
+
+  def set_name(self, name):
+    self.table.names.set(self.row, name)
+    self.invalidate()
+
+  def onestop(self):
+    onestop = self.table.onestop_ids[self.row]
+    if onestop is None:
+      onestop = self.make_onestop()
+      self.table.onestop_ids[self.row] = onestop
+    return onestop
+
+  def geohash(self):
+    return self.make_geohash()
+
+  def point(self):
+    lon = self.table.lon[self.row]
+    lat = self.table.lat[self.row]
+    if math.isnan(lon):
+      return None
+    return [lon, lat]
+
+  def geometry(self):
+    point = self.point()
+    if point is None:
+      return None
+    return {'type': 'Point', 'coordinates': point}
+
+  def set_geometry(self, geometry):
+    lon, lat = _geometry_point(geometry)
+    self.table.lon[self.row] = lon
+    self.table.lat[self.row] = lat
+    self.invalidate()
+
+  def tags(self):
+    return dict(self.table.tags.get(self.row))
+
+  def tag(self, key):
+    return self.table.tags.get(self.row).get(key)
+
+  def add_tags(self, tags):
+    data = self.tags()
+    data.update(tags)
+    self.table.tags.set(self.row, data, key=_tags_key(data))
+
+  def identifiers(self):
+    table = self.table
+    ret = table.identifiers[
+      table.identifier_offsets[self.row]:table.identifier_offsets[self.row+1]
+    ]
+    return ret + table.extra_identifiers.get(self.row, [])
+
+  def add_identifier(self, identifier):
+    if identifier in self.identifiers():
+      return
+    self.table.extra_identifiers.setdefault(self.row, []).append(identifier)
+    for parent in self.parents:
+      parent.invalidate()
+
+  def merge(self, item):
+    super(StopProxy, self).merge(item)
+    # Entity.merge() writes relations to the data copy; keep them.
+    extra = dict(self.table.extra.get(self.row, {}))
+    for relkey in ['serves', 'servedBy', 'operatedBy']:
+      if relkey in item.data:
+        a = set(extra.get(relkey, []))
+        b = set(item.data[relkey])
+        extra[relkey] = sorted(a | b)
+    self.table.set_extra(self.row, extra)
+
+  # Memoized values are stored in the table.
+  def _memo(self, key, func):
+    return func()
+
+  def invalidate(self):
+    if not self.table.onestop_explicit[self.row]:
+      self.table.onestop_ids[self.row] = None
+    for entity in self._related('parents'):
+      entity._cache.clear()
+
+  # Graph; ancestors are walked, not materialized.
+  def _related(self, key):
+    return self._walk(key)
+
+  def _graph_get(self, key):
+    group = {None: set()}
+    for entity in self._walk(key):
+      group[None].add(entity)
+      group.setdefault(entity.onestop_type, set()).add(entity)
+    return collections.defaultdict(set, group)
+
+  def _graph_update(self, key, entities):
+    pass
@@ -0,0 +1,162 @@
+"""Content-addressed store of downloaded GTFS feeds."""
+import json
+import os
+import shutil
+import threading
+
+import util
+
+def _link(src, dst):
+  """Hard link src to dst, or copy if links are not supported."""
+  try:
+    os.link(src, dst)
+  except (AttributeError, OSError):
+    shutil.copyfile(src, dst)
+
+class FeedStore(object):
+  """Feed versions, stored once per SHA1, with size-capped LRU eviction.
+
+  Layout:
+    objects/<sha1>.zip      Each distinct feed version.
+    feeds/<onestopId>.zip   The current version of each feed; a hard link
+                            to its object, with conditional request and
+                            resume state alongside.
+    index.json              Object sizes and last access, and the
+                            versions of each feed, oldest first.
+
+  When the objects exceed max_bytes, the least recently used versions
+  are removed. The current version of each feed is never removed.
+  """
+  def __init__(self, path, max_bytes=None):
+    self.path = path
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    for d in ('objects', 'feeds'):
+      if not os.path.exists(os.path.join(path, d)):
+        os.makedirs(os.path.join(path, d))
+    index = util.read_json(os.path.join(path, 'index.json'))
+    self.objects = index.get('objects', {})
+    self.feeds = index.get('feeds', {})
+    self._clock = index.get('clock', 0)
+
+  def filename(self, sha1):
+    """Object filename for a SHA1."""
+    return os.path.join(self.path, 'objects', '%s.zip'%sha1)
+
+  def feed_filename(self, onestop_id):
+    """Filename of the current version of a feed."""
+    return os.path.join(self.path, 'feeds', '%s.zip'%onestop_id)
+
+  def _touch(self, sha1):
+    self._clock += 1
+    self.objects[sha1]['accessed'] = self._clock
+
+  def get(self, sha1):
+    """Return the filename for a SHA1, or None if not stored."""
+    with self._lock:
+      if sha1 not in self.objects:
+        return None
+      self._touch(sha1)
+      self._save()
+    return self.filename(sha1)
+
+  def current(self, onestop_id):
+    """Return the SHA1 of the current version of a feed, or None."""
+    versions = self.feeds.get(onestop_id)
+    if versions:
+      return versions[-1]
+
+  def versions(self, onestop_id):
+    """Return the stored SHA1s of a feed, oldest first."""
+    return [i for i in self.feeds.get(onestop_id, []) if i in self.objects]
+
+  def size(self):
+    """Total size of stored objects, in bytes."""
+    return sum(i['size'] for i in self.objects.values())
+
+  def add(self, onestop_id, filename, sha1=None):
+    """Store filename as the current version of a feed. Returns the SHA1."""
+    sha1 = sha1 or util.sha1file(filename)
+    with self._lock:
+      obj = self.filename(sha1)
+      if sha1 in self.objects and os.path.exists(obj):
+        # Already stored, e.g. the same feed published at two urls.
+        if not os.path.samefile(filename, obj):
+          os.unlink(filename)
+          _link(obj, filename)
+      else:
+        if os.path.exists(obj):
+          os.unlink(obj)
+        _link(filename, obj)
+        self.objects[sha1] = {'size': os.path.getsize(obj)}
+      self._touch(sha1)
+      versions = self.feeds.setdefault(onestop_id, [])
+      if sha1 in versions:
+        versions.remove(sha1)
+      versions.append(sha1)
+      self._evict()
+      self._save()
+    return sha1
+
+  def download(self, feed, sha1=None, hashcache=None):
+    """Download the current version of a feed. Returns the object filename.
+
+    Uses conditional and resumable requests; see util.transfer().
+    """
+    onestop_id = feed.onestop()
+    filename = self.feed_filename(onestop_id)
+    digest = util.transfer(
+      feed.url(),
+      filename,
+      conditional=True,
+      sha1=sha1,
+      hashcache=hashcache
+    )
+    if digest is None:
+      # Not modified.
+      current = self.current(onestop_id)
+      if current and self.get(current):
+        return self.filename(current)
+      digest = hashcache.sha1(filename) if hashcache else util.sha1file(filename)
+    self.add(onestop_id, filename, sha1=digest)
+    if hashcache:
+      hashcache.update(filename, digest)
+    return self.filename(digest)
+
+  def evict(self):
+    """Remove least recently used objects above max_bytes. Returns SHA1s."""
+    with self._lock:
+      ret = self._evict()
+      self._save()
+    return ret
+
+  def _evict(self):
+    if self.max_bytes is None:
+      return []
+    current = set(self.current(i) for i in self.feeds)
+    total = self.size()
+    ret = []
+    lru = sorted(self.objects.items(), key=lambda x:x[1].get('accessed', 0))
+    for sha1, info in lru:
+      if total <= self.max_bytes:
+        break
+      if sha1 in current:
+        continue
+      filename = self.filename(sha1)
+      if os.path.exists(filename):
+        os.unlink(filename)
+      del self.objects[sha1]
+      total -= info['size']
+      ret.append(sha1)
+    return ret
+
+  def _save(self):
+    filename = os.path.join(self.path, 'index.json')
+    tmp = '%s.tmp'%filename
+    with open(tmp, 'w') as f:
+      json.dump({
+        'objects': self.objects,
+        'feeds': self.feeds,
+        'clock': self._clock
+      }, f)
+    os.rename(tmp, filename)
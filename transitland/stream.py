@@ -0,0 +1,124 @@
+"""Streaming GTFS linkage, for bootstrapping without preloading a feed."""
+import array
+import collections
+
+import mzgtfs.geom
+
+class Linkage(object):
+  """Route -> stop membership, built from trips and stop_times rows.
+
+  GTFS IDs are replaced with integer codes as rows are read; stop_times
+  rows are not kept. With patterns=True, the ordered stops of each trip
+  are also kept, as compact integer arrays, to build route geometries.
+  """
+  def __init__(self, patterns=False):
+    self.patterns = patterns
+    # GTFS ID <-> integer code.
+    self.stop_ids = []
+    self.stop_codes = {}
+    self.route_ids = []
+    self.route_codes = {}
+    self.trip_codes = {}
+    # Trip attributes, by trip code.
+    self.trip_route = array.array('l')
+    self.trip_direction = array.array('b')
+    self.trip_shape = []
+    # Stop codes for each route code.
+    self.route_stops = []
+    # Interleaved (stop_sequence, stop code) for each trip code.
+    self.trip_stops = []
+    self._route_trips = None
+
+  def _code(self, codes, ids, key):
+    code = codes.get(key)
+    if code is None:
+      code = len(ids)
+      codes[key] = code
+      ids.append(key)
+    return code
+
+  def read_trips(self, trips):
+    """Read trips rows; returns the number of rows."""
+    count = 0
+    for trip in trips:
+      count += 1
+      route = self._code(self.route_codes, self.route_ids, trip.get('route_id'))
+      while len(self.route_stops) <= route:
+        self.route_stops.append(set())
+      self.trip_codes[trip.get('trip_id')] = len(self.trip_route)
+      self.trip_route.append(route)
+      self.trip_direction.append(1 if int(trip.get('direction_id') or 0) else 0)
+      self.trip_shape.append(trip.get('shape_id') or None)
+      if self.patterns:
+        self.trip_stops.append(array.array('l'))
+    return count
+
+  def read_stop_times(self, stop_times):
+    """Read stop_times rows in a single pass; returns the number of rows."""
+    count = 0
+    for stop_time in stop_times:
+      count += 1
+      trip = self.trip_codes.get(stop_time.get('trip_id'))
+      if trip is None:
+        continue
+      stop = self._code(self.stop_codes, self.stop_ids, stop_time.get('stop_id'))
+      self.route_stops[self.trip_route[trip]].add(stop)
+      if self.patterns:
+        self.trip_stops[trip].extend((int(stop_time.get('stop_sequence')), stop))
+    return count
+
+  def stops(self, route_id):
+    """Return the stop_ids served by a route_id."""
+    route = self.route_codes.get(route_id)
+    if route is None:
+      return []
+    return [self.stop_ids[i] for i in self.route_stops[route]]
+
+  def trips(self, route_id):
+    """Return the trip codes for a route_id."""
+    if self._route_trips is None:
+      self._route_trips = collections.defaultdict(list)
+      for trip, route in enumerate(self.trip_route):
+        self._route_trips[route].append(trip)
+    return self._route_trips.get(self.route_codes.get(route_id), [])
+
+def route_geometry(linkage, route_id, points, shapes):
+  """Same as mzgtfs Route.geometry(), using Linkage stop patterns.
+
+  points is a dict of stop_id to point; shapes is the result of
+  mzgtfs Feed.shapes().
+  """
+  d0 = collections.defaultdict(int)
+  d1 = collections.defaultdict(int)
+  for trip in linkage.trips(route_id):
+    shape = linkage.trip_shape[trip]
+    if shape and shape in shapes:
+      seq = tuple(shapes[shape].points())
+    else:
+      data = linkage.trip_stops[trip]
+      pairs = sorted(zip(data[0::2], data[1::2]), key=lambda x:x[0])
+      seq = tuple(points[linkage.stop_ids[stop]] for _, stop in pairs)
+    if linkage.trip_direction[trip]:
+      d1[seq] += 1
+    else:
+      d0[seq] += 1
+  route0 = []
+  if d0:
+    route0 = sorted(d0.items(), key=lambda x:x[1])[-1][0]
+  route1 = []
+  if d1:
+    route1 = sorted(d1.items(), key=lambda x:x[1])[-1][0]
+  return {
+    'type':'MultiLineString',
+    'coordinates': [route0, route1]
+  }
+
+def agency_geometry(stops):
+  """Same as mzgtfs Agency.geometry(), for a list of GTFS stops."""
+  hull = mzgtfs.geom.convex_hull(stops)
+  return {
+    'type': 'Polygon',
+    'coordinates': [
+      hull + [hull[0]]
+    ]
+  }
@@ -0,0 +1,76 @@
+"""Test parallel bootstrap."""
+import unittest
+import time
+
+import util
+import bulk
+
+def _sleep(job):
+  time.sleep(job.get('sleep', 0))
+  return bulk.bootstrap_job(job)
+
+class TestBulk(unittest.TestCase):
+  def setUp(self):
+    self.filename = util.example_gtfs_feed_path()
+
+  def test_file_jobs(self):
+    jobs = bulk.file_jobs([self.filename, '/tmp/test.zip'])
+    assert len(jobs) == 2
+    assert jobs[0]['feed']['onestopId'] == 'f-9qs-dta'
+    assert jobs[1]['feedname'] == 'test'
+
+  def test_registry_jobs(self):
+    jobs = bulk.registry_jobs(util.example_registry(), gtfs_path='/tmp')
+    assert len(jobs) == 1
+    assert jobs[0]['key'] == 'f-9qs-dta'
+    assert jobs[0]['filename'] == '/tmp/f-9qs-dta.zip'
+
+  def test_bootstrap_job(self):
+    job = bulk.file_jobs([self.filename])[0]
+    result = bulk.bootstrap_job(job)
+    assert result['error'] is None
+    assert result['stops'] == 9
+    assert result['routes'] == 5
+    assert result['operators'] == 1
+    assert result['onestopId'] == 'f-9qs-dta'
+    assert result['json']['onestopId'] == result['onestopId']
+
+  def test_bootstrap_many(self):
+    jobs = [
+      {'key': 'a', 'filename': self.filename, 'feedname': 'dta'},
+      {'key': 'b', 'filename': self.filename, 'feedname': 'dta'},
+      {'key': 'c', 'filename': '/dev/null/none.zip'}
+    ]
+    results = dict((i['key'], i) for i in bulk.bootstrap_many(jobs, workers=2))
+    assert len(results) == 3
+    assert results['a']['onestopId'] == 'f-9qs-dta'
+    assert results['b']['stops'] == 9
+    assert results['c']['error']
+    assert results['c']['json'] is None
+
+  def test_bootstrap_many_duplicate(self):
+    # The same filename twice; each job has a result.
+    jobs = bulk.file_jobs([self.filename, self.filename, self.filename])
+    results = list(bulk.bootstrap_many(jobs, workers=3))
+    assert len(results) == 3
+    assert [i['key'] for i in results] == [self.filename]*3
+    assert all(i['error'] is None for i in results)
+
+  def test_bootstrap_many_order(self):
+    jobs = [
+      {'key': 'slow', 'filename': self.filename, 'sleep': 1.0},
+      {'key': 'fast', 'filename': self.filename}
+    ]
+    results = list(bulk.bootstrap_many(jobs, workers=2, func=_sleep))
+    assert [i['key'] for i in results] == ['fast', 'slow']
+
+  def test_bootstrap_many_timeout(self):
+    jobs = [
+      {'key': 'slow', 'filename': self.filename, 'sleep': 10.0},
+      {'key': 'fast', 'filename': self.filename}
+    ]
+    t = time.time()
+    results = dict((i['key'], i) for i in bulk.bootstrap_many(jobs, workers=2, timeout=1.0, func=_sleep))
+    assert time.time() - t < 5.0
+    assert results['slow']['error'].startswith('Timeout')
+    assert results['fast']['error'] is None
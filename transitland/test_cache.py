@@ -0,0 +1,138 @@
+"""Test the response cache."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+from cache import ResponseCache
+
+class Test_normalize(unittest.TestCase):
+  def test_normalize(self):
+    assert cache.normalize('/api/v1/stops?r=100&lon=1&lat=2') == '/api/v1/stops?lat=2&lon=1&r=100'
+    assert cache.normalize('api//v1/stops/') == '/api/v1/stops'
+    assert cache.normalize('HTTP://Example.com/api/v1/stops?a=1') == 'http://example.com/api/v1/stops?a=1'
+
+  def test_cache_key(self):
+    assert cache.cache_key('/api/v1/stops?a=1') == '/api/v1/stops?a=1'
+    a = cache.cache_key('http://a.example.com/api/v1/stops', apitoken='a')
+    assert a != cache.cache_key('http://b.example.com/api/v1/stops', apitoken='a')
+    assert a != cache.cache_key('http://a.example.com/api/v1/stops', apitoken='b')
+    assert a != cache.cache_key('http://a.example.com/api/v1/stops')
+    # The token is not written to disk.
+    assert 'a.example.com' in a and not a.endswith('#a')
+
+  def test_collection(self):
+    assert cache.collection('/api/v1/stops?a=1') == '/api/v1/stops'
+    assert cache.collection('/api/v1/stops/s-9q9-test') == '/api/v1/stops'
+    assert cache.collection(cache.cache_key('http://example.com/api/v1/stops?a=1', apitoken='a')) == '/api/v1/stops'
+
+class TestResponseCache(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.now = 1000.0
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def _cache(self, **kwargs):
+    c = ResponseCache(**kwargs)
+    c.clock = lambda:self.now
+    return c
+
+  def test_get(self):
+    c = self._cache()
+    assert c.get('/api/v1/stops?a=1&b=2') is None
+    c.set('/api/v1/stops?a=1&b=2', {'stops': [1]})
+    assert c.get('/api/v1/stops?b=2&a=1') == {'stops': [1]}
+    assert c.stats['miss'] == 1
+    assert c.stats['hit'] == 1
+
+  def test_get_copy(self):
+    c = self._cache()
+    c.set('/api/v1/stops', {'stops': [1]})
+    c.get('/api/v1/stops')['stops'].append(2)
+    assert c.get('/api/v1/stops') == {'stops': [1]}
+
+  def test_lru(self):
+    c = self._cache(maxsize=2)
+    c.set('/a', 1)
+    c.set('/b', 2)
+    c.get('/a')
+    c.set('/c', 3)
+    assert c.get('/b') is None
+    assert c.get('/a') == 1
+    assert c.get('/c') == 3
+
+  def test_ttl(self):
+    c = self._cache(ttl=10, ttls={'/api/v1/stops': 100})
+    c.set('/api/v1/routes', 1)
+    c.set('/api/v1/stops?a=1', 2)
+    self.now += 50
+    assert c.get('/api/v1/routes') is None
+    assert c.get('/api/v1/stops?a=1') == 2
+    self.now += 100
+    assert c.get('/api/v1/stops?a=1') is None
+    assert c.stats['expired'] == 2
+
+  def test_disk(self):
+    c = self._cache(path=self.path)
+    c.set('/api/v1/stops?a=1', {'stops': [1]})
+    c = self._cache(path=self.path)
+    assert c.get('/api/v1/stops?a=1') == {'stops': [1]}
+    assert c.get('/api/v1/stops?a=1') == {'stops': [1]}
+    assert c.stats['disk_hit'] == 1
+    assert c.stats['hit'] == 1
+
+  def test_disk_expired(self):
+    c = self._cache(path=self.path, ttl=10)
+    c.set('/api/v1/stops?a=1', 1)
+    self.now += 20
+    c = self._cache(path=self.path)
+    assert c.get('/api/v1/stops?a=1') is None
+    assert c.stats['expired'] == 1
+
+  def test_invalidate(self):
+    c = self._cache(path=self.path)
+    c.set('/api/v1/stops?a=1', 1)
+    c.set('/api/v1/routes?a=1', 2)
+    c.invalidate('/api/v1/stops/s-9q9-test')
+    assert c.stats['invalidated'] == 1
+    assert c.get('/api/v1/stops?a=1') is None
+    assert c.get('/api/v1/routes?a=1') == 2
+    c = self._cache(path=self.path)
+    assert c.get('/api/v1/stops?a=1') is None
+    assert c.get('/api/v1/routes?a=1') == 2
+
+  def test_invalidate_all(self):
+    c = self._cache(path=self.path)
+    c.set('/api/v1/stops?a=1', 1)
+    c.set('/api/v1/routes?a=1', 2)
+    c.invalidate()
+    assert c.get('/api/v1/stops?a=1') is None
+    assert c.get('/api/v1/routes?a=1') is None
+
+  def test_invalidate_shared_path(self):
+    # Other files and directories in path are kept.
+    os.makedirs(os.path.join(self.path, 'other'))
+    with open(os.path.join(self.path, 'other', 'data.txt'), 'w') as f:
+      f.write('data')
+    c = self._cache(path=self.path)
+    c.set('/api/v1/stops?a=1', 1)
+    assert os.listdir(self.path) != ['other']
+    c.invalidate()
+    c.invalidate('/api/v1/other')
+    assert os.listdir(self.path) == ['other']
+    assert os.path.exists(os.path.join(self.path, 'other', 'data.txt'))
+
+  def test_hosts(self):
+    # Responses are kept by host and API token.
+    c = self._cache(path=self.path)
+    c.set('http://a.example.com/api/v1/stops', 1, apitoken='a')
+    c.set('http://b.example.com/api/v1/stops', 2, apitoken='a')
+    c.set('http://a.example.com/api/v1/stops', 3, apitoken='b')
+    c = self._cache(path=self.path)
+    assert c.get('http://a.example.com/api/v1/stops', apitoken='a') == 1
+    assert c.get('http://b.example.com/api/v1/stops', apitoken='a') == 2
+    assert c.get('http://a.example.com/api/v1/stops', apitoken='b') == 3
+    assert c.get('http://a.example.com/api/v1/stops') is None
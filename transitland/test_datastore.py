@@ -0,0 +1,641 @@
+"""Test Datastore."""
+import json
+import threading
+import time
+import unittest
+import urlparse
+
+import errors
+import geom
+import testing
+import util
+from cache import ResponseCache
+from datastore import Datastore, AsyncDatastore, SingleFlight
+from retry import RetryPolicy, TokenBucket
+
+class DatastoreTestCase(unittest.TestCase):
+  """A local stand-in for the Datastore API."""
+  def setUp(self):
+    self.failures = []
+    self.stops = [i.json() for i in util.example_feed().stops()]
+    # Query parameters the stand-in ignores.
+    self.ignore = set()
+
+  def app(self, method, path, data):
+    if path.startswith('/api/v1/flaky'):
+      # Fail until self.failures is empty.
+      if self.failures:
+        return self.failures.pop(0)
+      return 200, {'method': method}
+    query = dict(urlparse.parse_qsl(urlparse.urlparse(path).query))
+    for i in self.ignore:
+      query.pop(i, None)
+    if 'bbox' in query:
+      b = map(float, query['bbox'].split(','))
+      return 200, {'stops': [
+        i for i in self.stops
+        if b[0] <= i['geometry']['coordinates'][0] <= b[2] and b[1] <= i['geometry']['coordinates'][1] <= b[3]
+      ]}
+    if 'identifier_in' in query:
+      identifiers = set(query['identifier_in'].split(','))
+      return 200, {'stops': [i for i in self.stops if identifiers & set(i['identifiers'])]}
+    if 'identifier' in query:
+      return 200, {'stops': [i for i in self.stops if query['identifier'] in i['identifiers']]}
+    if path.startswith('/api/v1/stops?page'):
+      return self.paged(path, 'stops', self.stops)
+    if path.startswith('/api/v1/routes'):
+      return self.paged(path, 'routes', [{'onestopId': 'r-9q9-%s'%i, 'name': str(i)} for i in range(5)])
+    if path.startswith('/api/v1/operators'):
+      return self.paged(path, 'operators', [{'onestopId': 'o-9q9-%s'%i, 'name': str(i)} for i in range(3)])
+    if path.startswith('/api/v1/stops'):
+      return 200, {'stops': self.stops}
+    if path.startswith('/api/v1/moved'):
+      return 301, {}, {'Location': '/api/v1/echo'}
+    if path.startswith('/api/v1/echo'):
+      return 200, {'method': method, 'path': path, 'data': data}
+    return 404, {'error': 'not found'}
+
+  def paged(self, path, key, items):
+    # Pages of per_page items, with an absolute meta.next url.
+    query = dict(urlparse.parse_qsl(urlparse.urlparse(path).query))
+    page = int(query.get('page', 0))
+    per_page = int(query.get('per_page', 2))
+    data = {key: items[page*per_page:(page+1)*per_page], 'meta': {}}
+    if (page+1)*per_page < len(items):
+      data['meta']['next'] = '%sapi/v1/%s?page=%s&per_page=%s'%(self.base, key, page+1, per_page)
+    return 200, data
+
+  def roundtrip(self, data):
+    # As decoded from a response.
+    return json.loads(json.dumps(data))
+
+  def server(self, **kwargs):
+    return testing.Server(handler=testing.JSONRequestHandler, app=self.app, **kwargs)
+
+class TestDatastore(DatastoreTestCase):
+  def test_getjson(self):
+    with self.server() as server:
+      data = Datastore(server.url()).getjson('/api/v1/echo?a=1')
+    assert data['method'] == 'GET'
+    assert data['path'] == '/api/v1/echo?a=1'
+
+  def test_postjson(self):
+    with self.server() as server:
+      data = Datastore(server.url()).postjson('/api/v1/echo', {'a': 1})
+    assert data['method'] == 'POST'
+    assert data['data'] == {'a': 1}
+
+  def test_error(self):
+    with self.server() as server:
+      with self.assertRaises(errors.DatastoreError) as cm:
+        Datastore(server.url()).getjson('/api/v1/missing')
+    assert cm.exception.response_code == 404
+
+  def test_connection_error(self):
+    with self.server() as server:
+      url = server.url()
+    with self.assertRaises(errors.DatastoreError):
+      Datastore(url).getjson('/api/v1/stops')
+
+  def test_stops(self):
+    with self.server() as server:
+      stops = Datastore(server.url()).stops(point=(-122.4, 37.7))
+    assert len(stops) == len(self.stops)
+    assert set(i.onestop() for i in stops) == set(i['onestopId'] for i in self.stops)
+
+  def test_keepalive(self):
+    with self.server() as server:
+      ds = Datastore(server.url())
+      for i in range(5):
+        ds.getjson('/api/v1/echo')
+      assert server.connections == 1
+    assert ds.pool.stats['connect'] == 1
+    assert ds.pool.stats['reuse'] == 4
+
+  def test_keepalive_disabled(self):
+    with self.server() as server:
+      ds = Datastore(server.url(), pool_size=0)
+      for i in range(5):
+        ds.getjson('/api/v1/echo')
+      assert server.connections == 5
+
+  def test_idle_timeout(self):
+    with self.server() as server:
+      ds = Datastore(server.url(), idle_timeout=0)
+      for i in range(3):
+        ds.getjson('/api/v1/echo')
+      assert server.connections == 3
+
+  def test_reconnect(self):
+    # A kept connection closed while idle is replaced.
+    with self.server() as server:
+      ds = Datastore(server.url())
+      ds.getjson('/api/v1/echo')
+      for idle in ds.pool._idle.values():
+        for conn, t in idle:
+          conn.sock.close()
+      assert ds.getjson('/api/v1/echo')['method'] == 'GET'
+      assert server.connections == 2
+
+  def test_reconnect_post(self):
+    # A kept connection closed by the server is not used for a POST.
+    class Handler(testing.JSONRequestHandler):
+      def _respond(self, method):
+        testing.JSONRequestHandler._respond(self, method)
+        # Close without Connection: close, as after an idle timeout.
+        self.close_connection = 1
+    with testing.Server(handler=Handler, app=self.app) as server:
+      ds = Datastore(server.url())
+      ds.getjson('/api/v1/echo')
+      time.sleep(0.1)
+      assert ds.postjson('/api/v1/echo', {'a': 1})['method'] == 'POST'
+      assert server.connections == 2
+    assert ds.pool.stats['dropped'] == 1
+
+  def test_truncated_not_resent(self):
+    # A request is never sent again after part of the response arrived.
+    with self.server() as server:
+      ds = Datastore(server.url(), compress=False)
+      ds.getjson('/api/v1/echo?warm')
+      server.truncate = [5, 5]
+      with self.assertRaises(errors.DatastoreError):
+        ds.postjson('/api/v1/echo', {'a': 1})
+      with self.assertRaises(errors.DatastoreError):
+        ds.getjson('/api/v1/echo')
+      assert server.requests == ['/api/v1/echo?warm', '/api/v1/echo', '/api/v1/echo']
+
+  def test_redirect_credentials(self):
+    with self.server() as other:
+      app = lambda method, path, data: (302, {}, {'Location': other.url('api/v1/echo')})
+      with testing.Server(handler=testing.JSONRequestHandler, app=app) as server:
+        ds = Datastore(server.url(), apitoken='secret')
+        assert ds.getjson('/api/v1/redirect')['path'] == '/api/v1/echo'
+        assert server.headers[0]['authorization'] == 'Token token=secret'
+      assert 'authorization' not in other.headers[0]
+
+  def test_next_other_host(self):
+    # Pages on another host are fetched without the apitoken.
+    with self.server() as other:
+      page = {'stops': [], 'meta': {'next': other.url('api/v1/echo')}}
+      app = lambda method, path, data: (200, page)
+      with testing.Server(handler=testing.JSONRequestHandler, app=app) as server:
+        for stream in (False, True):
+          ds = Datastore(server.url(), apitoken='secret')
+          list(ds.iter_json('/api/v1/stops', 'stops', stream=stream))
+        assert [i['authorization'] for i in server.headers] == ['Token token=secret']*2
+      assert other.requests == ['/api/v1/echo']*2
+      assert not any('authorization' in i for i in other.headers)
+
+  def test_redirect_same_host(self):
+    with self.server() as server:
+      self.base = server.url()
+      ds = Datastore(server.url(), apitoken='secret')
+      ds.getjson('/api/v1/moved')
+      assert server.requests == ['/api/v1/moved', '/api/v1/echo']
+      assert all(i['authorization'] == 'Token token=secret' for i in server.headers)
+
+  def test_threads(self):
+    results = []
+    def work(ds):
+      for i in range(10):
+        results.append(ds.getjson('/api/v1/echo?%s'%i)['path'])
+    with self.server() as server:
+      ds = Datastore(server.url(), pool_size=4)
+      threads = [threading.Thread(target=work, args=(ds,)) for i in range(4)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+      assert server.connections <= 4
+    assert len(results) == 40
+
+  def test_iter_stops(self):
+    with self.server() as server:
+      self.base = server.url()
+      ds = Datastore(server.url())
+      stops = list(ds.iter_json('/api/v1/stops?page=0', 'stops'))
+      assert len(server.requests) == (len(self.stops)+1) / 2
+    assert [i['onestopId'] for i in stops] == [i['onestopId'] for i in self.stops]
+
+  def test_iter_routes(self):
+    with self.server() as server:
+      self.base = server.url()
+      routes = list(Datastore(server.url()).iter_routes(per_page=2))
+      assert server.requests[0] == '/api/v1/routes?per_page=2'
+      assert len(server.requests) == 3
+    assert [i.onestop() for i in routes] == ['r-9q9-%s'%i for i in range(5)]
+
+  def test_iter_operators(self):
+    with self.server() as server:
+      self.base = server.url()
+      operators = list(Datastore(server.url()).iter_operators(point=(-122.4, 37.7), radius=100))
+      assert server.requests[0] == '/api/v1/operators?lon=-122.40000000&lat=37.70000000&r=100'
+    assert [i.onestop() for i in operators] == ['o-9q9-%s'%i for i in range(3)]
+
+  def test_iter_prefetch(self):
+    # The next page is requested before the current page is consumed.
+    with self.server() as server:
+      self.base = server.url()
+      routes = Datastore(server.url()).iter_routes(per_page=2)
+      routes.next()
+      t = time.time()
+      while len(server.requests) < 2 and time.time() - t < 5:
+        time.sleep(0.01)
+      assert len(server.requests) == 2
+      assert len(list(routes)) == 4
+
+  def test_iter_prefetch_disabled(self):
+    with self.server() as server:
+      self.base = server.url()
+      items = Datastore(server.url()).iter_json('/api/v1/routes', 'routes', prefetch=False)
+      items.next()
+      time.sleep(0.1)
+      assert len(server.requests) == 1
+      assert len(list(items)) == 4
+
+  def test_iter_stream(self):
+    with self.server() as server:
+      self.base = server.url()
+      ds = Datastore(server.url())
+      stops = list(ds.iter_json('/api/v1/stops?page=0', 'stops', stream=True))
+      assert len(server.requests) == (len(self.stops)+1) / 2
+      # Connections are reused after each streamed page.
+      assert server.connections == 1
+    assert [i['onestopId'] for i in stops] == [i['onestopId'] for i in self.stops]
+    assert ds.transfer_stats['received'] < ds.transfer_stats['received_decoded']
+
+  def test_iter_stream_entities(self):
+    with self.server() as server:
+      self.base = server.url()
+      routes = list(Datastore(server.url(), compress=False).iter_routes(per_page=2, stream=True))
+    assert [i.onestop() for i in routes] == ['r-9q9-%s'%i for i in range(5)]
+
+  def test_iter_stream_incremental(self):
+    # The first item is returned before the response is complete.
+    # Whitespace, to fill the first block.
+    body = json.dumps({'stops': self.stops}).replace('}, {', '},%s{'%(' '*65536), 1)
+    half = body.index('{', 65536)
+    event = threading.Event()
+    class Handler(testing.JSONRequestHandler):
+      def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:half])
+        self.wfile.flush()
+        event.wait(5)
+        self.wfile.write(body[half:])
+    with testing.Server(handler=Handler) as server:
+      stops = Datastore(server.url()).iter_stops(stream=True)
+      assert stops.next().onestop() == self.stops[0]['onestopId']
+      assert not event.is_set()
+      event.set()
+      assert len(list(stops)) == len(self.stops) - 1
+
+  def test_iter_stream_error(self):
+    with self.server() as server:
+      with self.assertRaises(errors.DatastoreError) as e:
+        list(Datastore(server.url()).iter_json('/api/v1/missing', 'stops', stream=True))
+    assert e.exception.response_code == 404
+
+  def test_iter_stream_truncated(self):
+    with self.server(truncate=[100]) as server:
+      with self.assertRaises(errors.DatastoreError):
+        list(Datastore(server.url(), compress=False).iter_stops(stream=True))
+
+  def test_cache(self):
+    with self.server() as server:
+      ds = Datastore(server.url(), cache=ResponseCache())
+      assert ds.getjson('/api/v1/echo?a=1&b=2') == ds.getjson('/api/v1/echo?b=2&a=1')
+      assert len(server.requests) == 1
+      assert ds.cache.stats['hit'] == 1
+
+  def test_cache_shared(self):
+    # A cache shared by two hosts, or two tokens, keeps their responses apart.
+    c = ResponseCache()
+    with self.server() as a, self.server() as b:
+      Datastore(a.url(), cache=c).getjson('/api/v1/echo')
+      Datastore(b.url(), cache=c).getjson('/api/v1/echo')
+      Datastore(a.url(), cache=c, apitoken='other').getjson('/api/v1/echo')
+      Datastore(a.url(), cache=c).getjson('/api/v1/echo')
+      assert len(a.requests) == 2
+      assert len(b.requests) == 1
+
+  def test_cache_post(self):
+    # POSTs are not cached, and invalidate the collection.
+    with self.server() as server:
+      ds = Datastore(server.url(), cache=ResponseCache())
+      ds.getjson('/api/v1/echo?a=1')
+      ds.getjson('/api/v1/stops')
+      ds.postjson('/api/v1/echo', {'a': 1})
+      ds.postjson('/api/v1/echo', {'a': 1})
+      ds.getjson('/api/v1/echo?a=1')
+      ds.getjson('/api/v1/stops')
+      assert server.requests == ['/api/v1/echo?a=1', '/api/v1/stops', '/api/v1/echo', '/api/v1/echo', '/api/v1/echo?a=1']
+
+  def test_cache_changeset(self):
+    with self.server() as server:
+      ds = Datastore(server.url(), cache=ResponseCache())
+      ds.getjson('/api/v1/stops')
+      with self.assertRaises(errors.DatastoreError):
+        ds.postjson('/api/v1/changesets', {})
+      ds.getjson('/api/v1/stops')
+      assert server.requests == ['/api/v1/stops', '/api/v1/changesets', '/api/v1/stops']
+
+  def test_resolve_identifiers(self):
+    identifiers = [j for i in self.stops for j in i['identifiers']]
+    expect = dict((j, i['onestopId']) for i in self.stops for j in i['identifiers'])
+    with self.server() as server:
+      ds = Datastore(server.url())
+      found = ds.resolve_identifiers(identifiers + identifiers[:5] + ['gtfs://missing'])
+    assert dict((k, v.onestop()) for k, v in found.items()) == expect
+    assert ds.resolve_stats['identifiers'] == len(identifiers) + 6
+    assert ds.resolve_stats['unique'] == len(identifiers) + 1
+    assert ds.resolve_stats['resolved'] == len(identifiers)
+    assert ds.resolve_stats['batches'] == 1
+    assert ds.resolve_stats['fallback_batches'] == 0
+
+  def test_resolve_identifiers_ignored(self):
+    # A server without identifier_in returns all stops; they are not
+    # mapped as matches, and each identifier is queried instead.
+    self.ignore.add('identifier_in')
+    identifiers = [j for i in self.stops[:2] for j in i['identifiers']]
+    expect = dict((j, i['onestopId']) for i in self.stops[:2] for j in i['identifiers'])
+    with self.server() as server:
+      ds = Datastore(server.url())
+      found = ds.resolve_identifiers(identifiers + ['gtfs://missing'])
+      assert len(server.requests) == 1 + len(identifiers) + 1
+    assert dict((k, v.onestop()) for k, v in found.items()) == expect
+    assert ds.resolve_stats['fallback_batches'] == 1
+    self.ignore.add('identifier')
+    with self.server() as server:
+      with self.assertRaises(errors.DatastoreError):
+        Datastore(server.url()).resolve_identifiers(identifiers)
+
+  def test_resolve_identifiers_batches(self):
+    identifiers = [j for i in self.stops for j in i['identifiers']]
+    with self.server(delay=0.05) as server:
+      ds = Datastore(server.url())
+      found = ds.resolve_identifiers(identifiers, max_length=200, workers=2)
+      assert server.max_active == 2
+      for path in server.requests:
+        assert len(server.url()) + len(path) <= 200
+    assert len(found) == len(identifiers)
+    assert ds.resolve_stats['batches'] == len(server.requests)
+    assert sum(ds.resolve_stats['batch_sizes']) == len(identifiers)
+
+  def test_stops_near_stream(self):
+    points = [i['geometry']['coordinates'] for i in self.stops]
+    with self.server() as server:
+      ds = Datastore(server.url())
+      streamed = ds.stops_near(points, radius=500, stream=True)
+      expect = ds.stops_near(points, radius=500)
+    onestops = lambda results:[sorted(i.onestop() for i in stops) for stops in results]
+    assert onestops(streamed) == onestops(expect)
+
+  def test_stops_near(self):
+    points = [i['geometry']['coordinates'] for i in self.stops]
+    with self.server() as server:
+      ds = Datastore(server.url())
+      results = ds.stops_near(points, radius=500)
+      requests = len(server.requests)
+    assert requests == ds.spatial_stats['cells']
+    assert requests < len(points)
+    for point, stops in zip(points, results):
+      expect = set(
+        i['onestopId'] for i in self.stops
+        if geom.haversine(point, i['geometry']['coordinates']) <= 500
+      )
+      assert set(i.onestop() for i in stops) == expect
+
+  def _retry(self, **kwargs):
+    retry = RetryPolicy(**kwargs)
+    self.waits = []
+    retry.sleep = self.waits.append
+    return retry
+
+  def test_retry(self):
+    self.failures = [(503, {}), (429, {}, {'Retry-After': '2'})]
+    with self.server() as server:
+      ds = Datastore(server.url(), retry=self._retry())
+      assert ds.getjson('/api/v1/flaky') == {'method': 'GET'}
+      assert server.responses == [503, 429, 200]
+    assert len(self.waits) == 2
+    assert self.waits[1] == 2
+
+  def test_retry_exhausted(self):
+    self.failures = [(503, {})] * 3
+    with self.server() as server:
+      ds = Datastore(server.url(), retry=self._retry(retries=2))
+      with self.assertRaises(errors.DatastoreError) as cm:
+        ds.getjson('/api/v1/flaky')
+    assert cm.exception.response_code == 503
+
+  def test_retry_post(self):
+    self.failures = [(503, {})]
+    with self.server() as server:
+      ds = Datastore(server.url(), retry=self._retry())
+      with self.assertRaises(errors.DatastoreError):
+        ds.postjson('/api/v1/flaky')
+      self.failures = [(503, {})]
+      ds = Datastore(server.url(), retry=self._retry(retry_post=True))
+      assert ds.postjson('/api/v1/flaky') == {'method': 'POST'}
+
+  def test_retry_connection_error(self):
+    with self.server() as server:
+      url = server.url()
+    ds = Datastore(url, retry=self._retry(retries=2))
+    with self.assertRaises(errors.DatastoreError):
+      ds.getjson('/api/v1/echo')
+    assert len(self.waits) == 2
+
+  def test_ratelimit(self):
+    ratelimit = TokenBucket(1000, burst=1)
+    with self.server() as server:
+      ds = Datastore(server.url(), ratelimit=ratelimit)
+      t = time.time()
+      for i in range(21):
+        ds.getjson('/api/v1/echo')
+      assert time.time() - t >= 0.02
+
+  def _concurrent(self, ds, endpoints):
+    results = [None] * len(endpoints)
+    def work(i):
+      try:
+        results[i] = ds.getjson(endpoints[i])
+      except Exception, e:
+        results[i] = e
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(endpoints))]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    return results
+
+  def test_coalesce(self):
+    with self.server(delay=0.2) as server:
+      ds = Datastore(server.url())
+      results = self._concurrent(ds, ['/api/v1/echo?a=1&b=2']*4 + ['/api/v1/echo?b=2&a=1']*4)
+      assert len(server.requests) == 1
+    assert all(i == results[0] for i in results)
+    assert ds.singleflight.stats['calls'] == 8
+    assert ds.singleflight.stats['coalesced'] == 7
+    assert ds.singleflight.ratio() == 7 / 8.0
+    # Each caller gets its own copy.
+    results[1]['method'] = 'test'
+    assert results[0]['method'] == 'GET'
+
+  def test_coalesce_errors(self):
+    with self.server(delay=0.2) as server:
+      ds = Datastore(server.url())
+      results = self._concurrent(ds, ['/api/v1/missing']*4)
+      assert len(server.requests) == 1
+    assert all(isinstance(i, errors.DatastoreError) for i in results)
+
+  def test_coalesce_interrupted(self):
+    # Waiters are released if the call raises a non-Exception.
+    flights = SingleFlight()
+    started = threading.Event()
+    def func():
+      started.set()
+      time.sleep(0.2)
+      raise KeyboardInterrupt
+    def leader():
+      try:
+        flights.do('key', func)
+      except KeyboardInterrupt:
+        pass
+    t = threading.Thread(target=leader)
+    t.start()
+    started.wait()
+    with self.assertRaises(errors.DatastoreError):
+      flights.do('key', lambda:1)
+    t.join()
+    assert flights.do('key', lambda:1) == 1
+
+  def test_coalesce_modified(self):
+    # The first caller modifying its result does not affect waiters.
+    flights = SingleFlight()
+    release = threading.Event()
+    def func():
+      release.wait()
+      return {'tags': {'a': 1}}
+    results = []
+    waiter = threading.Thread(target=lambda:results.append(flights.do('key', lambda:None)))
+    leader = threading.Thread(target=lambda:flights.do('key', func)['tags'].update(b=2))
+    leader.start()
+    while 'key' not in flights._flights:
+      time.sleep(0.01)
+    waiter.start()
+    while flights.stats['coalesced'] < 1:
+      time.sleep(0.01)
+    release.set()
+    leader.join()
+    waiter.join()
+    assert results == [{'tags': {'a': 1}}]
+
+  def test_coalesce_disabled(self):
+    with self.server(delay=0.1) as server:
+      ds = Datastore(server.url(), coalesce=False)
+      self._concurrent(ds, ['/api/v1/echo']*4)
+      assert len(server.requests) == 4
+
+  def test_compress(self):
+    with self.server() as server:
+      ds = Datastore(server.url())
+      assert ds.getjson('/api/v1/stops') == self.roundtrip({'stops': self.stops})
+    stats = ds.transfer_stats
+    assert 0 < stats['received'] < stats['received_decoded'] / 4
+
+  def test_compress_deflate(self):
+    with self.server(encodings=('deflate',)) as server:
+      ds = Datastore(server.url())
+      assert ds.getjson('/api/v1/stops') == self.roundtrip({'stops': self.stops})
+    assert ds.transfer_stats['received'] < ds.transfer_stats['received_decoded']
+
+  def test_compress_disabled(self):
+    with self.server() as server:
+      ds = Datastore(server.url(), compress=False)
+      assert ds.getjson('/api/v1/stops') == self.roundtrip({'stops': self.stops})
+    assert ds.transfer_stats['received'] == ds.transfer_stats['received_decoded']
+
+  def test_compress_request(self):
+    data = self.roundtrip({'stops': self.stops})
+    with self.server() as server:
+      ds = Datastore(server.url(), compress_min=1024)
+      assert ds.postjson('/api/v1/echo', {'a': 1})['data'] == {'a': 1}
+      assert ds.postjson('/api/v1/echo', data)['data'] == data
+      assert server.encodings_received == [None, 'gzip']
+    stats = ds.transfer_stats
+    assert stats['sent'] < stats['sent_decoded']
+
+  def test_compress_request_disabled(self):
+    with self.server() as server:
+      ds = Datastore(server.url())
+      ds.postjson('/api/v1/echo', {'stops': self.stops})
+      assert server.encodings_received == [None]
+    assert ds.transfer_stats['sent'] == ds.transfer_stats['sent_decoded']
+
+  def test_compress_invalid(self):
+    app = lambda method, path, data: (200, {}, {'Content-Encoding': 'gzip'})
+    with testing.Server(handler=testing.JSONRequestHandler, app=app, encodings=()) as server:
+      with self.assertRaises(errors.DatastoreError):
+        Datastore(server.url()).getjson('/api/v1/echo')
+
+class TestAsyncDatastore(DatastoreTestCase):
+  def test_map_getjson(self):
+    endpoints = ['/api/v1/echo?%s'%i for i in range(20)]
+    with self.server(delay=0.01) as server:
+      with AsyncDatastore(server.url(), concurrency=4) as ds:
+        results = ds.map_getjson(endpoints)
+    assert [i['path'] for i in results] == endpoints
+
+  def test_concurrency(self):
+    with self.server(delay=0.1) as server:
+      with AsyncDatastore(server.url(), concurrency=3) as ds:
+        ds.map_getjson(['/api/v1/echo?%s'%i for i in range(9)])
+      assert server.max_active == 3
+      assert server.connections == 3
+
+  def test_map_stops(self):
+    points = [(-122.4, 37.7), (-122.5, 37.8)]
+    with self.server() as server:
+      with AsyncDatastore(server.url()) as ds:
+        results = ds.map_stops(points, radius=100)
+    assert len(results) == 2
+    assert len(results[0]) == len(self.stops)
+
+  def test_postjson_async(self):
+    with self.server() as server:
+      with AsyncDatastore(server.url()) as ds:
+        result = ds.postjson_async('/api/v1/echo', {'a': 1})
+        assert result.result()['data'] == {'a': 1}
+        assert result.done()
+
+  def test_gather_errors(self):
+    endpoints = ['/api/v1/echo', '/api/v1/missing', '/api/v1/echo']
+    with self.server() as server:
+      with AsyncDatastore(server.url()) as ds:
+        with self.assertRaises(errors.DatastoreError):
+          ds.map_getjson(endpoints)
+        results = ds.map_getjson(endpoints, return_exceptions=True)
+    assert results[0]['method'] == 'GET'
+    assert isinstance(results[1], errors.DatastoreError)
+    assert results[2]['method'] == 'GET'
+
+  def test_timeout(self):
+    with self.server(delay=0.5) as server:
+      with AsyncDatastore(server.url(), timeout=0.1) as ds:
+        with self.assertRaises(errors.DatastoreError):
+          ds.getjson_async('/api/v1/echo').result()
+
+  def test_interrupted(self):
+    # A worker ended by a non-Exception still sets its result.
+    def interrupt():
+      raise SystemExit
+    with self.server() as server:
+      with AsyncDatastore(server.url(), concurrency=1) as ds:
+        with self.assertRaises(errors.DatastoreError) as cm:
+          ds.submit(interrupt).result(timeout=5)
+        assert 'interrupted' in str(cm.exception)
+        assert ds.getjson_async('/api/v1/echo').result(timeout=5)['method'] == 'GET'
@@ -1,5 +1,7 @@
 """Test base entity."""
+import cPickle
 import json
+import pickle
 import unittest
 
 import errors
@@ -126,6 +128,55 @@ class TestEntity(unittest.TestCase):
     assert len(entity1.children) == 1
     assert len(entity2.parents) == 1
 
+  def test_descendants(self):
+    entity1 = Entity()
+    entity2 = Entity()
+    entity3 = Entity()
+    entity1.add_child(entity2)
+    descendants = entity1.descendants()
+    assert set(descendants) == set([entity2])
+    # Views are updated as children are linked.
+    entity2.add_child(entity3)
+    assert set(descendants) == set([entity2, entity3])
+    assert set(entity1.descendants()) == set([entity2, entity3])
+    assert not hasattr(descendants, 'add')
+
+  def test_ancestors(self):
+    entity1 = Entity()
+    entity2 = Entity()
+    entity3 = Entity()
+    entity2.add_child(entity3)
+    ancestors = entity3.ancestors()
+    assert set(ancestors) == set([entity2])
+    entity1.add_child(entity2)
+    assert set(ancestors) == set([entity1, entity2])
+    assert not entity1.ancestors()
+
+  def test_graph_stats(self):
+    entity1 = Entity()
+    entity2 = Entity()
+    entity1.add_child(entity2)
+    stats = dict(Entity.graph_stats)
+    entity1.descendants()
+    entity1.descendants()
+    assert Entity.graph_stats['rebuild'] == stats.get('rebuild', 0) + 1
+    assert Entity.graph_stats['hit'] == stats.get('hit', 0) + 1
+    entity2.add_child(Entity())
+    assert Entity.graph_stats['update'] == stats.get('update', 0) + 1
+
+  def test_pickle(self):
+    feed = util.example_feed()
+    entities = [feed] + list(feed.operators()) + list(feed.routes()) + list(feed.stops())
+    for module in (pickle, cPickle):
+      for protocol in (0, 1, 2):
+        for entity in entities:
+          copy = module.loads(module.dumps(entity, protocol))
+          assert type(copy) is type(entity)
+          assert copy.json() == entity.json()
+          assert getattr(copy, 'timezone', None) == getattr(entity, 'timezone', None)
+        copy = module.loads(module.dumps(feed, protocol))
+        assert set(i.onestop() for i in copy.stops()) == set(i.onestop() for i in feed.stops())
+
   # TODO: these tests are not ideal.
   def test_geometry(self):
     entity = Entity(**self.expect)
@@ -4,6 +4,7 @@ import os
 import tempfile
 import json
 
+import testing
 import util
 from feed import Feed
 
@@ -106,6 +107,20 @@ class TestFeed(unittest.TestCase):
     entity.data['url'] = self.url
     entity.download(f.name, verify=True, sha1=self.sha1_gtfs)
     assert util.sha1file(f.name) == self.sha1_gtfs
+
+  def test_download_not_modified(self):
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    entity = util.example_feed()
+    with testing.Server(path) as server:
+      entity.data['url'] = server.url(os.path.basename(util.example_gtfs_feed_path()))
+      entity.download(f.name)
+      entity.download(f.name)
+      assert server.responses == [200, 304]
+      # cache=False always downloads.
+      entity.download(f.name, cache=False)
+      assert server.responses == [200, 304, 200]
+    assert not os.path.exists(util.validators_filename(f.name))
   
   # Load / dump
   def test_bootstrap_gtfs(self):
@@ -118,6 +133,24 @@ class TestFeed(unittest.TestCase):
     assert len(o.routes()) == 5
     assert len(o.stops()) == 9
 
+  def test_bootstrap_gtfs_stream(self):
+    expect = util.example_feed()
+    entity = Feed()
+    entity.bootstrap_gtfs(util.example_gtfs_feed(), feedname='dta', stream=True)
+    self._sanity(entity)
+    assert entity.json() == expect.json()
+    o1 = expect.operator('o-9qs-demotransitauthority')
+    o2 = entity.operator('o-9qs-demotransitauthority')
+    assert o1.json() == o2.json()
+
+  def test_bootstrap_gtfs_timer(self):
+    timer = util.Timer()
+    entity = Feed()
+    entity.bootstrap_gtfs(util.example_gtfs_feed(), feedname='dta', timer=timer)
+    for stage in ['load', 'linkage', 'geohash', 'stops', 'routes', 'operators']:
+      assert stage in timer.stages
+    assert timer.total() >= 0
+
   def test_bootstrap_gtfs_onestop_id(self):
     onestop_id = 'o-9qs-test'
     gtfs_feed = util.example_gtfs_feed()
@@ -173,4 +206,22 @@ class TestFeed(unittest.TestCase):
       assert entity.stop(i.onestop())
     with self.assertRaises(ValueError):
       entity.stop('none')
-    
\ No newline at end of file
+
+  def test_stop_identifier(self):
+    entity = util.example_feed()
+    for i in entity.stops():
+      for identifier in i.identifiers():
+        assert entity.stop(identifier) is i
+    with self.assertRaises(ValueError):
+      entity.route(list(entity.stops())[0].onestop())
+
+  def test_find(self):
+    entity = util.example_feed()
+    stops = entity.stops()
+    keys = [i.onestop() for i in stops] + ['none']
+    found = entity.find(keys)
+    assert len(found) == len(stops)
+    assert 'none' not in found
+    for i in stops:
+      assert found[i.onestop()] is i
+    assert not entity.find(keys, onestop_type='r')
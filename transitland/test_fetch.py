@@ -0,0 +1,90 @@
+"""Test concurrent feed downloads."""
+import unittest
+import tempfile
+import shutil
+import os
+
+import util
+import testing
+import fetch
+from feed import Feed
+
+class Test_fetch_feeds(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.data = os.path.dirname(util.example_gtfs_feed_path())
+    self.sha1_gtfs = '4e5e6a2668d12cca29c89a969d73e05e625d9596'
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def _feeds(self, server, count):
+    return [
+      Feed(onestopId='f-9qs-test%s'%i, url=server.url('f-9qs-dta.zip'))
+      for i in range(count)
+    ]
+
+  def test_fetch_feeds(self):
+    with testing.Server(self.data) as server:
+      feeds = self._feeds(server, 4)
+      results = list(fetch.fetch_feeds(feeds, path=self.path))
+    assert len(results) == 4
+    for feed, filename, error in results:
+      assert error is None
+      assert filename == os.path.join(self.path, '%s.zip'%feed.onestop())
+      assert util.sha1file(filename) == self.sha1_gtfs
+
+  def test_fetch_feeds_errors(self):
+    with testing.Server(self.data) as server:
+      feeds = self._feeds(server, 2)
+      feeds.append(Feed(onestopId='f-9qs-missing', url=server.url('missing.zip')))
+      feeds.append(Feed(onestopId='f-9qs-nourl'))
+      results = dict((i[0].onestop(), i) for i in fetch.fetch_feeds(feeds, path=self.path))
+    assert len(results) == 4
+    assert results['f-9qs-test0'][2] is None
+    assert results['f-9qs-test1'][2] is None
+    assert results['f-9qs-missing'][2]
+    assert results['f-9qs-nourl'][2]
+
+  def test_fetch_feeds_per_host(self):
+    with testing.Server(self.data, delay=0.2) as server:
+      feeds = self._feeds(server, 6)
+      results = list(fetch.fetch_feeds(feeds, path=self.path, workers=6, per_host=2))
+      assert server.max_active == 2
+    assert len(results) == 6
+
+  def test_fetch_feeds_workers(self):
+    with testing.Server(self.data, delay=0.2) as server:
+      feeds = self._feeds(server, 4)
+      results = list(fetch.fetch_feeds(feeds, path=self.path, workers=1, per_host=4))
+      assert server.max_active == 1
+    assert len(results) == 4
+
+  def test_fetch_feeds_hashcache(self):
+    # A second run verifies unchanged files without reading them.
+    hashcache = util.HashCache(os.path.join(self.path, fetch.HASHCACHE))
+    with testing.Server(self.data) as server:
+      feeds = self._feeds(server, 2)
+      list(fetch.fetch_feeds(feeds, path=self.path, hashcache=hashcache))
+      hashcache.save()
+      hashcache = util.HashCache(os.path.join(self.path, fetch.HASHCACHE))
+      results = list(fetch.fetch_feeds(feeds, path=self.path, hashcache=hashcache))
+      assert server.responses == [200, 200, 304, 304]
+    assert [i[2] for i in results] == [None, None]
+    assert hashcache.stats['hit'] == 2
+    assert hashcache.stats['miss'] == 0
+
+  def test_fetch_feeds_hashcache_changed(self):
+    # A file changed since download is downloaded again.
+    hashcache = util.HashCache()
+    with testing.Server(self.data) as server:
+      feeds = self._feeds(server, 1)
+      list(fetch.fetch_feeds(feeds, path=self.path, hashcache=hashcache))
+      filename = os.path.join(self.path, '%s.zip'%feeds[0].onestop())
+      size = os.path.getsize(filename)
+      with open(filename, 'wb') as f:
+        f.write('x'*size)
+      list(fetch.fetch_feeds(feeds, path=self.path, hashcache=hashcache))
+      assert server.responses == [200, 304, 200]
+    assert hashcache.stats['miss'] == 1
+    assert util.sha1file(filename) == self.sha1_gtfs
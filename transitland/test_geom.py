@@ -1,7 +1,11 @@
 """Geometry unit tests."""
 import unittest
+import math
+import random
 import os
 
+import mzgeohash
+
 import errors
 import geom
 
@@ -96,4 +100,108 @@ class Test_centroid_points(unittest.TestCase):
     data = geom.centroid(EXPECT)
     for i,j in zip(data, expect):
       self.assertAlmostEqual(i,j)
-    
\ No newline at end of file
+
+class Test_haversine(unittest.TestCase):
+  def test_haversine(self):
+    # San Francisco to Los Angeles.
+    d = geom.haversine((-122.4194, 37.7749), (-118.2437, 34.0522))
+    assert 558000 < d < 561000
+    assert geom.haversine((1.0, 2.0), (1.0, 2.0)) == 0.0
+
+class Test_geohash_cover(unittest.TestCase):
+  def test_geohash_encode(self):
+    point = (-122.2, 37.4)
+    assert geom.geohash_encode(point, 4) == mzgeohash.encode(point, length=4)
+    assert geom.geohash_encode(point, 5) == mzgeohash.encode(point, length=6)[:5]
+
+  def test_geohash_bbox(self):
+    b = geom.geohash_bbox('9q9')
+    width, height = geom.geohash_size(3)
+    self.assertAlmostEqual(b[2] - b[0], width)
+    self.assertAlmostEqual(b[3] - b[1], height)
+    assert mzgeohash.encode(((b[0]+b[2])/2, (b[1]+b[3])/2), length=4)[:3] == '9q9'
+
+  def test_radius_bbox(self):
+    point = (-122.2, 37.4)
+    b = geom.radius_bbox(point, 1000)
+    self.assertAlmostEqual(geom.haversine(point, (point[0], b[3])), 1000, places=3)
+    self.assertAlmostEqual(geom.haversine(point, (b[2], point[1])), 1000, delta=1)
+
+  def test_radius_bbox_high_latitude(self):
+    for lat, radius in ((60.0, 50000), (85.0, 500000)):
+      point = (0.0, lat)
+      b = geom.radius_bbox(point, radius)
+      # The easternmost point of the circle, where it meets a meridian.
+      angle = float(radius) / geom.EARTH_RADIUS
+      east = (
+        math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat)))),
+        math.degrees(math.asin(math.sin(math.radians(lat)) / math.cos(angle)))
+      )
+      self.assertAlmostEqual(geom.haversine(point, east), radius, delta=0.01)
+      self.assertAlmostEqual(b[2], east[0], places=9)
+      assert b[0] <= -east[0] + 1e-9
+      # The cover includes the cells at the circle's east extent.
+      cells, length = geom.geohash_cover([point], radius)
+      assert any(geom.geohash_encode(east, length=length).startswith(i) for i in cells)
+
+  def test_radius_bbox_pole(self):
+    assert geom.radius_bbox((10.0, 89.9), 50000)[::2] == (-180.0, 180.0)
+    assert geom.radius_bbox((10.0, -89.9), 50000)[1] == -90.0
+    # All cells around the pole are covered.
+    cells, length = geom.geohash_cover([(10.0, 89.9)], 50000)
+    for lon in range(-180, 180, 5):
+      assert any(geom.geohash_encode((lon, 89.8), length=length).startswith(i) for i in cells)
+
+  def test_geohash_cover(self):
+    points = [[-122.2 + i * 0.001, 37.4] for i in range(100)]
+    cells, length = geom.geohash_cover(points, 100)
+    assert length == 6
+    width, height = geom.geohash_size(length)
+    for point in points:
+      b = geom.radius_bbox(point, 100)
+      assert b[2] - b[0] <= width and b[3] - b[1] <= height
+      assert any(geom.geohash_encode(point, length=length).startswith(i) for i in cells)
+    assert len(cells) < len(points)
+
+  def test_geohash_cover_merge(self):
+    # A point in every child of a cell; merged into the parent.
+    points = []
+    for i in geom.BASE32:
+      b = geom.geohash_bbox('9q9pb' + i)
+      points.append(((b[0] + b[2]) / 2, (b[1] + b[3]) / 2))
+    cells, length = geom.geohash_cover(points, 1, length=6)
+    assert cells == set(['9q9pb'])
+
+@unittest.skipIf(geom.numpy is None, 'numpy not installed')
+class Test_geohash_points(unittest.TestCase):
+  def _random(self, count, lon, lat, spread):
+    r = random.Random(count)
+    return [
+      [lon + r.uniform(-spread, spread), lat + r.uniform(-spread, spread)]
+      for i in range(count)
+    ]
+
+  def test_geohash_points(self):
+    points = geom.numpy.array(EXPECT)
+    assert geom.geohash_points(points) == '9q9'
+
+  def test_geohash_points_no_points(self):
+    with self.assertRaises(errors.NoPointsError):
+      geom.geohash_points(geom.numpy.zeros((0,2)))
+
+  def test_geohash_points_match(self):
+    for spread in [0.0001, 0.01, 1.0, 20.0]:
+      points = self._random(100, -122.2, 37.4, spread)
+      expect = mzgeohash.neighborsfit(geom.centroid(points), points)
+      data = geom.geohash_points(geom.numpy.array(points))
+      assert data == expect
+
+  def test_centroid_points(self):
+    points = self._random(1000, -122.2, 37.4, 1.0)
+    assert geom.centroid_points(geom.numpy.array(points)) == geom.centroid(points)
+
+  def test_encode_points(self):
+    points = self._random(100, 0.0, 0.0, 90.0)
+    codes = geom.encode_points(geom.numpy.array(points))
+    for point, code in zip(points, codes):
+      assert int(code) == geom.geohash_to_int(mzgeohash.encode(point))
@@ -0,0 +1,51 @@
+"""Test incremental JSON decoding."""
+import json
+import unittest
+
+import jsonstream
+
+def _chunks(text, size):
+  return [text[i:i+size] for i in range(0, len(text), size)]
+
+class Test_iter_array(unittest.TestCase):
+  def setUp(self):
+    self.data = {
+      'before': {'a': [1, 2]},
+      'stops': [{'name': u'Caf\xe9 %s'%i, 'x': i * 1.5, 'n': 10**i} for i in range(10)],
+      'meta': {'next': None, 'total': 12345}
+    }
+    self.text = json.dumps(self.data, ensure_ascii=False).encode('utf-8')
+
+  def test_iter_array(self):
+    other = {}
+    items = list(jsonstream.iter_array([self.text], 'stops', other=other))
+    assert items == self.data['stops']
+    assert other == {'before': self.data['before'], 'meta': self.data['meta']}
+
+  def test_chunks(self):
+    # Split at every position, including within numbers and UTF-8.
+    for size in (1, 2, 3, 7, 64):
+      other = {}
+      items = list(jsonstream.iter_array(_chunks(self.text, size), 'stops', other=other))
+      assert items == self.data['stops']
+      assert other['meta'] == self.data['meta']
+
+  def test_incremental(self):
+    # Items are yielded before the rest of the data is read.
+    chunks = iter(_chunks(' { "stops" : [ 1 , {"a": 2} , 3 ] } ', 4))
+    items = jsonstream.iter_array(chunks, 'stops')
+    assert next(items) == 1
+    assert next(items) == {'a': 2}
+    assert len(list(chunks)) > 0
+
+  def test_empty(self):
+    assert list(jsonstream.iter_array(['{}'], 'stops')) == []
+    assert list(jsonstream.iter_array(['{"stops": []}'], 'stops')) == []
+    other = {}
+    assert list(jsonstream.iter_array(['{"stops": null}'], 'stops', other=other)) == []
+    assert other == {'stops': None}
+
+  def test_invalid(self):
+    for text in ('', '[]', '{"stops": [1, 2', '{"stops": [1 2]}', '{"stops": [1]} x', '{1: 2}'):
+      with self.assertRaises(ValueError):
+        list(jsonstream.iter_array(_chunks(text, 3), 'stops'))
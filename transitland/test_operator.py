@@ -3,6 +3,7 @@ import unittest
 
 import util
 from operator import Operator
+from stop import Stop
 
 class TestOperator(unittest.TestCase):
   def setUp(self):
@@ -68,3 +69,14 @@ class TestOperator(unittest.TestCase):
       assert entity.stop(i.onestop())
     with self.assertRaises(ValueError):
       entity.stop('none')
+
+  def test_stop_after_link(self):
+    entity = util.example_feed().operator(self.expect['onestopId'])
+    with self.assertRaises(ValueError):
+      entity.stop('gtfs://test/s/new')
+    stop = Stop(name='new', geometry={'type':'Point', 'coordinates':[-116.8, 36.9]})
+    stop.add_identifier('gtfs://test/s/new')
+    route = list(entity.routes())[0]
+    route.add_child(stop)
+    assert entity.stop('gtfs://test/s/new') is stop
+    assert entity.stop(stop.onestop()) is stop
@@ -0,0 +1,78 @@
+"""Test retry policy and rate limiting."""
+import email.utils
+import unittest
+
+from retry import RetryPolicy, TokenBucket
+
+class TestRetryPolicy(unittest.TestCase):
+  def test_retryable(self):
+    policy = RetryPolicy(retries=2)
+    assert policy.retryable('GET', 0)
+    assert policy.retryable('GET', 1, status=503)
+    assert not policy.retryable('GET', 2, status=503)
+    assert not policy.retryable('GET', 0, status=404)
+    assert not policy.retryable('POST', 0, status=503)
+    assert not policy.retryable('POST', 0)
+
+  def test_retryable_post(self):
+    policy = RetryPolicy(retry_post=True)
+    assert policy.retryable('POST', 0, status=503)
+    assert policy.retryable('POST', 0)
+
+  def test_delay(self):
+    policy = RetryPolicy(backoff=1, max_backoff=10)
+    for attempt in range(6):
+      delays = [policy.delay(attempt) for i in range(50)]
+      assert max(delays) <= min(2**attempt, 10)
+      assert min(delays) >= 0
+      # Jitter.
+      assert len(set(delays)) > 1
+
+  def test_retry_after(self):
+    policy = RetryPolicy(max_backoff=10)
+    policy.clock = lambda:1000.0
+    assert policy.delay(0, retry_after='3') == 3
+    assert policy.delay(0, retry_after='60') == 10
+    assert policy.delay(0, retry_after=email.utils.formatdate(1005.0, usegmt=True)) == 5
+    assert policy.stats['retry_after'] == 3
+
+  def test_wait(self):
+    policy = RetryPolicy()
+    waits = []
+    policy.sleep = waits.append
+    policy.wait(0, retry_after='2')
+    assert waits == [2]
+    assert policy.stats['retry'] == 1
+
+class TestTokenBucket(unittest.TestCase):
+  def setUp(self):
+    self.now = 0.0
+
+  def _bucket(self, *args, **kwargs):
+    bucket = TokenBucket(*args, **kwargs)
+    bucket.clock = lambda:self.now
+    def sleep(seconds):
+      self.now += seconds
+    bucket.sleep = sleep
+    return bucket
+
+  def test_burst(self):
+    bucket = self._bucket(10, burst=5)
+    for i in range(5):
+      assert bucket.acquire() == 0
+    assert bucket.acquire() > 0
+
+  def test_rate(self):
+    bucket = self._bucket(10, burst=1)
+    for i in range(101):
+      bucket.acquire()
+    self.assertAlmostEqual(self.now, 10.0)
+
+  def test_refill(self):
+    bucket = self._bucket(10, burst=5)
+    for i in range(5):
+      bucket.acquire()
+    self.now += 100
+    for i in range(5):
+      assert bucket.acquire() == 0
+    assert bucket.acquire() > 0
@@ -3,6 +3,7 @@ import unittest
 
 import util
 from route import Route
+from stop import Stop
 
 class TestRoute(unittest.TestCase):
   def setUp(self):
@@ -51,4 +52,18 @@ class TestRoute(unittest.TestCase):
     entity = util.example_feed().route(self.expect['onestopId'])
     for i in self.expect['serves']:
       assert entity.stop(i)
-    
\ No newline at end of file
+    
+  def test_geohash_invalidate(self):
+    entity = util.example_feed().route(self.expect['onestopId'])
+    assert entity.geohash() == '9qsb'
+    assert entity.onestop() == self.expect['onestopId']
+    stop = Stop(name='far', geometry={'type':'Point', 'coordinates':[-122.0, 37.0]})
+    entity.add_child(stop)
+    assert entity.geohash() != '9qsb'
+    assert entity.onestop() != self.expect['onestopId']
+
+  def test_onestop_set_name(self):
+    entity = util.example_feed().route(self.expect['onestopId'])
+    assert entity.onestop() == self.expect['onestopId']
+    entity.set_name('test')
+    assert entity.onestop() == 'r-9qsb-test'
@@ -0,0 +1,128 @@
+"""Test the spatial index."""
+import random
+import unittest
+
+import geom
+import util
+from spatial import SpatialIndex
+from stoptable import StopTable
+
+def _points(count, lon=-122.2, lat=37.4, spread=0.2, seed=0):
+  r = random.Random(seed)
+  return [(lon + r.uniform(-spread, spread), lat + r.uniform(-spread, spread)) for i in range(count)]
+
+class TestSpatialIndex(unittest.TestCase):
+  def setUp(self):
+    self.points = _points(2000)
+    self.index = SpatialIndex()
+    for i, point in enumerate(self.points):
+      self.index.add(point, i)
+
+  def _within(self, point, radius):
+    # Brute force.
+    return sorted(
+      (geom.haversine(point, p), i)
+      for i, p in enumerate(self.points)
+      if geom.haversine(point, p) <= radius
+    )
+
+  def test_within(self):
+    for point in _points(20, seed=1):
+      for radius in (100, 1000, 5000):
+        assert self.index.within(point, radius) == self._within(point, radius)
+
+  def test_bbox(self):
+    b = (-122.25, 37.35, -122.15, 37.45)
+    expect = [i for i, p in enumerate(self.points) if b[0] <= p[0] <= b[2] and b[1] <= p[1] <= b[3]]
+    assert sorted(self.index.bbox(b)) == expect
+    assert self.index.bbox((0, 0, 1, 1)) == []
+
+  def test_nearest(self):
+    for point in _points(20, seed=2) + [(-100.0, 20.0), (60.0, -40.0)]:
+      expect = sorted((geom.haversine(point, p), i) for i, p in enumerate(self.points))
+      assert self.index.nearest(point) == expect[:1]
+      assert self.index.nearest(point, k=10) == expect[:10]
+
+  def test_nearest_radius(self):
+    point = self.points[0]
+    result = self.index.nearest(point, k=100, radius=1000)
+    assert result == self._within(point, 1000)[:100]
+    assert self.index.nearest((0.0, 0.0), radius=1000) == []
+
+  def test_nearest_few(self):
+    index = SpatialIndex()
+    assert index.nearest((0, 0)) == []
+    index.add((10.0, 10.0), 'a')
+    index.add((-170.0, -60.0), 'b')
+    assert [i[1] for i in index.nearest((0, 0), k=5)] == ['a', 'b']
+
+  def test_antimeridian(self):
+    index = SpatialIndex()
+    index.add((179.999, 0.0), 'west')
+    index.add((-179.999, 0.0), 'east')
+    index.add((170.0, 0.0), 'far')
+    assert [i[1] for i in index.nearest((-179.9999, 0.0), k=2)] == ['east', 'west']
+    assert [i[1] for i in index.within((179.9999, 0.0), 1000)] == ['west', 'east']
+    assert sorted(index.bbox((179.0, -1.0, -179.0, 1.0))) == ['east', 'west']
+
+  def test_poles(self):
+    index = SpatialIndex()
+    index.add((0.0, 89.9999), 'north')
+    index.add((180.0, 89.9999), 'across')
+    assert set(i[1] for i in index.within((90.0, 90.0), 100)) == set(['north', 'across'])
+    assert [i[1] for i in index.nearest((0.0, 89.9999), k=2)] == ['north', 'across']
+
+  def test_high_latitude(self):
+    # A point near the east extent of the circle, outside lat +/- dlat/cos(lat).
+    index = SpatialIndex()
+    index.add((60.0, 87.8), 'east')
+    assert [i[1] for i in index.within((0.0, 85.0), 500000)] == ['east']
+
+  def test_load(self):
+    index = SpatialIndex()
+    index.load([p[0] for p in self.points], [p[1] for p in self.points])
+    assert len(index) == len(self.points)
+    assert index.within(self.points[0], 1000) == self._within(self.points[0], 1000)
+    assert sorted(index.buckets) == sorted(self.index.buckets)
+
+  def test_load_python(self):
+    numpy, geom.numpy = geom.numpy, None
+    try:
+      index = SpatialIndex()
+      index.load([p[0] for p in self.points], [p[1] for p in self.points], items=range(len(self.points)))
+    finally:
+      geom.numpy = numpy
+    assert dict((k, list(v)) for k, v in index.buckets.items()) == dict((k, list(v)) for k, v in self.index.buckets.items())
+
+  @unittest.skipIf(geom.numpy is None, 'numpy not installed')
+  def test_load_numpy(self):
+    points = geom.numpy.array(self.points + [(float('nan'), float('nan'))])
+    index = SpatialIndex()
+    index.load(points[:,0], points[:,1], items=range(len(points)))
+    assert len(index) == len(points)
+    assert sum(len(i) for i in index.buckets.values()) == len(self.points)
+    assert index.nearest(self.points[5], k=3) == self.index.nearest(self.points[5], k=3)
+
+  def test_cell(self):
+    # Buckets are geohash cells.
+    point = self.points[0]
+    bbox = geom.geohash_bbox(self.index.cell(point))
+    assert self.index._cell(*point) == self.index._cell((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+
+  def test_from_entities(self):
+    feed = util.example_feed()
+    index = SpatialIndex.from_entities(feed.stops())
+    stop = sorted(feed.stops(), key=lambda x:x.onestop())[0]
+    d, nearest = index.nearest(stop.point())[0]
+    assert d == 0 and nearest is stop
+    assert set(i[1] for i in index.within(stop.point(), 1e7)) == feed.stops()
+
+  def test_from_stoptable(self):
+    table = StopTable()
+    for i, point in enumerate(self.points[:100]):
+      table.add(name='stop %s'%i, geometry={'type': 'Point', 'coordinates': list(point)})
+    table.add(name='no geometry')
+    index = SpatialIndex.from_stoptable(table)
+    d, stop = index.nearest(self.points[3])[0]
+    assert stop.name() == 'stop 3'
+    assert len(index.within(self.points[3], 1e7)) == 100
@@ -61,3 +61,10 @@ class TestStop(unittest.TestCase):
     entity = util.example_feed().stop(self.expect['onestopId'])
     for i in self.expect['servedBy']:
       assert entity.operator(i)
+
+  def test_geohash_set_geometry(self):
+    entity = util.example_feed().stop(self.expect['onestopId'])
+    assert entity.geohash()[:10] == '9qscv9zzb5'
+    entity.set_geometry({'type':'Point', 'coordinates':[-122.0, 37.0]})
+    assert entity.geohash()[:10] != '9qscv9zzb5'
+    assert entity.onestop() != self.expect['onestopId']
@@ -0,0 +1,124 @@
+"""Test StopTable."""
+import cPickle
+import unittest
+
+import util
+from operator import Operator
+from route import Route
+from stop import Stop
+from stoptable import StopTable, StopProxy
+
+class TestStopTable(unittest.TestCase):
+  def setUp(self):
+    self.expect = util.example_export()
+    self.features = [
+      i for i in self.expect['features'] if i['onestopId'].startswith('s')
+    ]
+
+  def test_from_json(self):
+    table = StopTable.from_json(self.features)
+    assert len(table) == len(self.features)
+    for stop, feature in zip(table, self.features):
+      assert stop.onestop() == feature['onestopId']
+      assert stop.name() == feature['name']
+      assert stop.point() == feature['geometry']['coordinates']
+      assert stop.identifiers() == feature['identifiers']
+
+  def test_interned(self):
+    table = StopTable()
+    table.add(name='a', tags={'zone_id': '1'})
+    table.add(name='a', tags={'zone_id': '1'})
+    assert len(table.names.values) == 1
+    assert len(table.tags.values) == 1
+
+  def test_proxy_equal(self):
+    table = StopTable.from_json(self.features)
+    assert table.stop(0) == table.stop(0)
+    assert table.stop(0) != table.stop(1)
+    assert len(set([table.stop(0), table.stop(0)])) == 1
+    with self.assertRaises(IndexError):
+      table.stop(len(table))
+
+  def test_proxy_slots(self):
+    table = StopTable.from_json(self.features)
+    stop = table.stop(0)
+    assert isinstance(stop, Stop)
+    assert StopProxy.__slots__ == ('table', 'row')
+    assert not hasattr(stop, '__dict__')
+    with self.assertRaises(AttributeError):
+      stop.other = 1
+
+  def test_extra(self):
+    table = StopTable.from_json(self.features)
+    # Only data without a column is kept, shared between rows.
+    assert table.extra[0] == {'servedBy': self.features[0]['servedBy']}
+    assert len(set(id(i) for i in table.extra.values())) == 1
+    stop = table.stop(0)
+    stop.merge(Stop(servedBy=['o-9q-other']))
+    assert stop.data['servedBy'] == sorted(self.features[0]['servedBy'] + ['o-9q-other'])
+    assert table.stop(1).data['servedBy'] == self.features[1]['servedBy']
+
+  def test_geohash(self):
+    table = StopTable.from_json(self.features)
+    for stop, feature in zip(table, self.features):
+      assert stop.geohash() == Stop.from_json(feature).geohash()
+
+  def test_onestop_derived(self):
+    table = StopTable()
+    stop = table.add(
+      name='Bullfrog (Demo)',
+      geometry={'type': 'Point', 'coordinates': [-116.81797, 36.88108]}
+    )
+    assert stop.onestop() == 's-9qscv9zzb5-bullfrogdemo'
+    stop.set_name('Test')
+    assert stop.onestop() == 's-9qscv9zzb5-test'
+
+  def test_add_identifier(self):
+    table = StopTable.from_json(self.features)
+    stop = table.stop(0)
+    count = len(stop.identifiers())
+    stop.add_identifier('gtfs://test/s/test')
+    stop.add_identifier('gtfs://test/s/test')
+    assert len(table.stop(0).identifiers()) == count + 1
+    assert len(table.stop(1).identifiers()) == len(self.features[1]['identifiers'])
+
+  def test_add_tags(self):
+    table = StopTable()
+    a = table.add(name='a', tags={'zone_id': '1'})
+    b = table.add(name='b', tags={'zone_id': '1'})
+    a.set_tag('zone_id', '2')
+    assert a.tag('zone_id') == '2'
+    assert b.tag('zone_id') == '1'
+
+  def test_graph(self):
+    table = StopTable.from_json(self.features)
+    route = Route(name='test')
+    operator = Operator(name='test')
+    operator.add_child(route)
+    for stop in table:
+      route.add_child(stop)
+    assert len(route.stops()) == len(table)
+    assert len(operator.stops()) == len(table)
+    for stop in table:
+      assert stop.operators() == set([operator])
+      assert route in stop.parents
+    assert operator.stop(table.stop(0).onestop()) == table.stop(0)
+
+  def test_pickle(self):
+    table = StopTable()
+    operator = Operator.from_json(self.expect, stoptable=table)
+    for protocol in (0, 2):
+      copy = cPickle.loads(cPickle.dumps(operator, protocol))
+      assert copy.json() == operator.json()
+      stop = list(copy.stops())[0]
+      assert isinstance(stop, StopProxy)
+      assert not hasattr(stop, '__dict__')
+      assert stop.table is not table
+      assert copy in stop.operators()
+
+  def test_operator_json(self):
+    expect = Operator.from_json(self.expect).json()
+    table = StopTable()
+    data = Operator.from_json(self.expect, stoptable=table).json()
+    assert len(table) == len(self.features)
+    assert data == expect
@@ -0,0 +1,106 @@
+"""Test the feed store."""
+import unittest
+import tempfile
+import shutil
+import os
+
+import util
+import testing
+from feed import Feed
+from store import FeedStore
+
+class TestFeedStore(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.data = os.path.dirname(util.example_gtfs_feed_path())
+    self.sha1_gtfs = '4e5e6a2668d12cca29c89a969d73e05e625d9596'
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def _version(self, store, onestop_id, data):
+    # Add a version of a feed with the given contents.
+    filename = store.feed_filename(onestop_id)
+    if os.path.exists(filename):
+      os.unlink(filename)
+    with open(filename, 'w') as f:
+      f.write(data)
+    return store.add(onestop_id, filename)
+
+  def test_add(self):
+    store = FeedStore(self.path)
+    sha1 = self._version(store, 'f-test', 'a'*100)
+    assert store.current('f-test') == sha1
+    assert store.versions('f-test') == [sha1]
+    assert open(store.get(sha1)).read() == 'a'*100
+    assert os.path.samefile(store.get(sha1), store.feed_filename('f-test'))
+    assert store.size() == 100
+
+  def test_add_same(self):
+    # The same contents for two feeds are stored once.
+    store = FeedStore(self.path)
+    sha1 = self._version(store, 'f-test1', 'a'*100)
+    assert self._version(store, 'f-test2', 'a'*100) == sha1
+    assert store.current('f-test2') == sha1
+    assert len(store.objects) == 1
+    assert store.size() == 100
+
+  def test_versions(self):
+    store = FeedStore(self.path)
+    sha1s = [self._version(store, 'f-test', i*100) for i in 'abc']
+    assert store.versions('f-test') == sha1s
+    assert store.current('f-test') == sha1s[-1]
+    assert open(store.get(sha1s[0])).read() == 'a'*100
+
+  def test_evict(self):
+    store = FeedStore(self.path, max_bytes=250)
+    sha1s = [self._version(store, 'f-test', i*100) for i in 'abc']
+    assert store.versions('f-test') == sha1s[1:]
+    assert not os.path.exists(store.filename(sha1s[0]))
+    assert store.get(sha1s[0]) is None
+    assert store.size() == 200
+
+  def test_evict_lru(self):
+    store = FeedStore(self.path)
+    a, b, c = [self._version(store, 'f-test', i*100) for i in 'abc']
+    # Use a, so b is the least recently used.
+    store.get(a)
+    store.max_bytes = 250
+    assert store.evict() == [b]
+    assert store.versions('f-test') == [a, c]
+
+  def test_evict_current(self):
+    # Current versions are kept, even above max_bytes.
+    store = FeedStore(self.path, max_bytes=50)
+    self._version(store, 'f-test1', 'a'*100)
+    self._version(store, 'f-test2', 'b'*100)
+    assert store.size() == 200
+    assert store.evict() == []
+
+  def test_persist(self):
+    store = FeedStore(self.path)
+    sha1 = self._version(store, 'f-test', 'a'*100)
+    store = FeedStore(self.path)
+    assert store.current('f-test') == sha1
+    assert store.get(sha1) == store.filename(sha1)
+
+  def test_download(self):
+    store = FeedStore(self.path)
+    with testing.Server(self.data) as server:
+      feed = Feed(onestopId='f-9qs-dta', url=server.url('f-9qs-dta.zip'))
+      filename = feed.download(store=store)
+      assert feed.download(store=store) == filename
+      assert server.responses == [200, 304]
+    assert filename == store.filename(self.sha1_gtfs)
+    assert store.current('f-9qs-dta') == self.sha1_gtfs
+    assert util.sha1file(filename) == self.sha1_gtfs
+
+  def test_download_same(self):
+    # The same feed published at two urls is stored once.
+    store = FeedStore(self.path)
+    with testing.Server(self.data) as server:
+      for i in range(2):
+        feed = Feed(onestopId='f-9qs-test%s'%i, url=server.url('f-9qs-dta.zip?%s'%i))
+        feed.download(store=store)
+    assert store.objects.keys() == [self.sha1_gtfs]
+    assert store.size() == os.path.getsize(util.example_gtfs_feed_path())
@@ -0,0 +1,44 @@
+"""Test streaming GTFS linkage."""
+import unittest
+
+import util
+import stream
+
+class TestLinkage(unittest.TestCase):
+  def setUp(self):
+    self.gtfs_feed = util.example_gtfs_feed()
+    self.linkage = stream.Linkage(patterns=True)
+    self.linkage.read_trips(self.gtfs_feed.iterread('trips'))
+    self.linkage.read_stop_times(self.gtfs_feed.iterread('stop_times'))
+
+  def test_stops(self):
+    gtfs_feed = util.example_gtfs_feed()
+    gtfs_feed.preload()
+    for gtfs_route in gtfs_feed.routes():
+      expect = set(i.id() for i in gtfs_route.stops())
+      assert set(self.linkage.stops(gtfs_route.id())) == expect
+
+  def test_stops_unknown(self):
+    assert self.linkage.stops('none') == []
+
+  def test_trips(self):
+    count = sum(len(self.linkage.trips(i)) for i in self.linkage.route_ids)
+    assert count == len(self.linkage.trip_codes)
+
+  def test_route_geometry(self):
+    gtfs_feed = util.example_gtfs_feed()
+    gtfs_feed.preload()
+    points = dict((i.id(), i.point()) for i in gtfs_feed.stops())
+    shapes = gtfs_feed.shapes()
+    for gtfs_route in gtfs_feed.routes():
+      data = stream.route_geometry(self.linkage, gtfs_route.id(), points, shapes)
+      assert data == gtfs_route.geometry()
+
+  def test_no_patterns(self):
+    linkage = stream.Linkage()
+    linkage.read_trips(self.gtfs_feed.iterread('trips'))
+    count = linkage.read_stop_times(self.gtfs_feed.iterread('stop_times'))
+    assert count > 0
+    assert not linkage.trip_stops
+    for route_id in linkage.route_ids:
+      assert set(linkage.stops(route_id)) == set(self.linkage.stops(route_id))
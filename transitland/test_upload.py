@@ -0,0 +1,144 @@
+"""Test changeset uploads."""
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import errors
+import testing
+import upload
+import util
+from datastore import Datastore
+from upload import ChangesetUploader
+
+class TestUpload(unittest.TestCase):
+  """Upload to a local stand-in for the Datastore changesets API."""
+  def setUp(self):
+    self.feed = util.example_feed()
+    self.path = tempfile.mkdtemp()
+    self.checkpoint = os.path.join(self.path, 'checkpoint.json')
+    self.lock = threading.Lock()
+    # Changeset id -> changes; applied changeset ids, in order.
+    self.created = {}
+    self.applied = []
+    # Fail applying after this many changesets.
+    self.fail_after = None
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def app(self, method, path, data):
+    with self.lock:
+      if path == '/api/v1/changesets':
+        changeset_id = len(self.created) + 1
+        self.created[changeset_id] = data['changeset']['payload']['changes']
+        return 200, {'id': changeset_id}
+      match = re.match('/api/v1/changesets/(\d+)/apply', path)
+      if match:
+        if self.fail_after is not None and len(self.applied) >= self.fail_after:
+          return 500, {'error': 'test'}
+        self.applied.append(int(match.group(1)))
+        return 200, {'applied': True}
+    return 404, {'error': 'not found'}
+
+  def server(self, **kwargs):
+    return testing.Server(handler=testing.JSONRequestHandler, app=self.app, **kwargs)
+
+  def uploaded(self):
+    # Onestop IDs of applied changes, in order.
+    ret = []
+    for changeset_id in self.applied:
+      for change in self.created[changeset_id]:
+        key = [i for i in change if i != 'action'][0]
+        ret.append((key, change[key]['onestopId']))
+    return ret
+
+  def test_feed_changes(self):
+    changes = list(upload.feed_changes(self.feed))
+    stages = [i[0] for i in changes]
+    assert stages == ['stops']*9 + ['routes']*5 + ['operators']
+    assert changes[0][1]['action'] == 'createUpdate'
+    assert changes[0][1]['stop']['onestopId'] == sorted(i.onestop() for i in self.feed.stops())[0]
+    assert 'features' not in changes[-1][1]['operator']
+
+  def test_chunk_changes(self):
+    changes = list(upload.feed_changes(self.feed))
+    chunks = list(upload.chunk_changes(changes, max_changes=4))
+    assert [(i[0], len(i[1])) for i in chunks] == [
+      ('stops', 4), ('stops', 4), ('stops', 1), ('routes', 4), ('routes', 1), ('operators', 1)
+    ]
+    assert sum((i[1] for i in chunks), []) == [i[1] for i in changes]
+
+  def test_chunk_changes_bytes(self):
+    changes = list(upload.feed_changes(self.feed))[:9]
+    size = max(len(json.dumps(i[1])) for i in changes) + 2
+    chunks = list(upload.chunk_changes(changes, max_bytes=size * 2))
+    assert all(i[2] <= size * 2 for i in chunks)
+    assert all(len(i[1]) <= 2 for i in chunks)
+    # A single change larger than max_bytes is its own chunk.
+    chunks = list(upload.chunk_changes(changes, max_bytes=1))
+    assert len(chunks) == 9
+
+  def test_upload(self):
+    with self.server() as server:
+      uploader = ChangesetUploader(Datastore(server.url()), max_changes=2)
+      stats = uploader.upload(self.feed)
+    uploaded = self.uploaded()
+    assert [i[0] for i in uploaded] == ['stop']*9 + ['route']*5 + ['operator']
+    assert sorted(i[1] for i in uploaded[:9]) == sorted(i.onestop() for i in self.feed.stops())
+    assert stats['chunks'] == stats['uploaded'] == 5 + 3 + 1
+    assert stats['changes'] == 15
+    assert (stats['stops'], stats['routes'], stats['operators']) == (9, 5, 1)
+    assert stats['changes_per_second'] > 0
+    assert stats['bytes'] > 0
+
+  def test_upload_parallel(self):
+    with self.server(delay=0.05) as server:
+      uploader = ChangesetUploader(Datastore(server.url()), max_changes=1, workers=3)
+      uploader.upload(self.feed)
+      assert 1 < server.max_active <= 3
+    # Each stage finishes before the next starts.
+    assert [i[0] for i in self.uploaded()] == ['stop']*9 + ['route']*5 + ['operator']
+
+  def test_resume(self):
+    with self.server() as server:
+      uploader = ChangesetUploader(Datastore(server.url()), checkpoint=self.checkpoint, max_changes=2, workers=1)
+      self.fail_after = 4
+      with self.assertRaises(errors.DatastoreError):
+        uploader.upload(self.feed)
+      assert len(self.applied) == 4
+      self.fail_after = None
+      uploader = ChangesetUploader(Datastore(server.url()), checkpoint=self.checkpoint, max_changes=2, workers=1)
+      stats = uploader.upload(self.feed)
+    assert stats['skipped'] == 4
+    assert stats['uploaded'] == 5
+    # The created but unapplied changeset is applied, not created again.
+    assert len(self.created) == 9
+    assert sorted(i[1] for i in self.uploaded()) == sorted(
+      [i.onestop() for i in self.feed.stops()] +
+      [i.onestop() for i in self.feed.routes()] +
+      [i.onestop() for i in self.feed.operators()]
+    )
+
+  def test_apply_truncated(self):
+    # The apply response is cut off after the changeset was applied;
+    # the apply is not sent again.
+    with self.server(truncate=[None, 5]) as server:
+      uploader = ChangesetUploader(Datastore(server.url()), checkpoint=self.checkpoint, workers=1)
+      with self.assertRaises(errors.DatastoreError):
+        uploader.upload(self.feed)
+      assert server.requests == ['/api/v1/changesets', '/api/v1/changesets/1/apply']
+    assert self.applied == [1]
+    assert [i['applied'] for i in util.read_json(self.checkpoint)['changesets'].values()] == [False]
+
+  def test_resume_complete(self):
+    with self.server() as server:
+      for i in range(2):
+        uploader = ChangesetUploader(Datastore(server.url()), checkpoint=self.checkpoint)
+        stats = uploader.upload(self.feed)
+    assert stats['skipped'] == stats['chunks'] == 3
+    assert stats['uploaded'] == 0
+    assert len(self.applied) == 3
@@ -2,9 +2,11 @@
 import tempfile
 import unittest
 import os
+import urllib2
 import cStringIO as StringIO
 
 import errors
+import testing
 import util
 
 class Test_download(unittest.TestCase):
@@ -30,7 +32,141 @@ class Test_download(unittest.TestCase):
   def test_download_nourl(self):
     with self.assertRaises(ValueError):
       util.download(None)
+
+  def test_download_http_error(self):
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    with testing.Server(path) as server:
+      with self.assertRaises(urllib2.HTTPError):
+        util.download(server.url('missing.zip'), f.name)
+
+  def test_download_conditional(self):
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    basename = os.path.basename(util.example_gtfs_feed_path())
+    with testing.Server(path) as server:
+      url = server.url(basename)
+      util.download(url, f.name, conditional=True)
+      validators = util.read_validators(f.name)
+      assert validators['url'] == url
+      assert validators['etag']
+      assert validators['last_modified']
+      assert validators['content_length'] == os.path.getsize(f.name)
+      util.download(url, f.name, conditional=True)
+      assert server.responses == [200, 304]
+      assert util.sha1file(f.name) == self.sha1_gtfs
+    os.unlink(util.validators_filename(f.name))
+
+  def test_download_conditional_changed(self):
+    # Validators are ignored if the file no longer matches.
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    basename = os.path.basename(util.example_gtfs_feed_path())
+    with testing.Server(path) as server:
+      url = server.url(basename)
+      util.download(url, f.name, conditional=True)
+      with open(f.name, 'w') as f2:
+        f2.write('asdf')
+      assert util.read_validators(f.name) == {}
+      util.download(url, f.name, conditional=True)
+      assert server.responses == [200, 200]
+      assert util.sha1file(f.name) == self.sha1_gtfs
+    os.unlink(util.validators_filename(f.name))
   
+  def test_download_resume(self):
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    basename = os.path.basename(util.example_gtfs_feed_path())
+    resumed = util.download_stats['resumed']
+    with testing.Server(path, truncate=[1000]) as server:
+      sha1 = util.transfer(server.url(basename), f.name)
+      assert server.responses == [200, 206]
+    assert sha1 == self.sha1_gtfs
+    assert util.sha1file(f.name) == self.sha1_gtfs
+    assert util.download_stats['resumed'] == resumed + 1
+    assert not os.path.exists('%s.part'%f.name)
+
+  def test_download_resume_part(self):
+    # A failed transfer is resumed by the next call.
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    basename = os.path.basename(util.example_gtfs_feed_path())
+    with testing.Server(path, truncate=[1000, 1000]) as server:
+      with self.assertRaises(errors.IncompleteDownloadError):
+        util.download(server.url(basename), f.name, retries=1)
+      assert os.path.getsize('%s.part'%f.name) == 2000
+      assert os.path.getsize(f.name) == 0
+      util.download(server.url(basename), f.name)
+      assert server.responses == [200, 206, 206]
+    assert util.sha1file(f.name) == self.sha1_gtfs
+    assert not os.path.exists('%s.part'%f.name)
+
+  def test_download_resume_interrupted(self):
+    # A run stopped part way through, e.g. by Ctrl-C, is resumed.
+    f = tempfile.NamedTemporaryFile()
+    path = os.path.dirname(util.example_gtfs_feed_path())
+    basename = os.path.basename(util.example_gtfs_feed_path())
+    urlopen = urllib2.urlopen
+    def interrupted(request):
+      response = urlopen(request)
+      read = response.read
+      received = []
+      def interrupt(size):
+        if received:
+          raise KeyboardInterrupt
+        received.append(size)
+        return read(size)
+      response.read = interrupt
+      return response
+    with testing.Server(path) as server:
+      urllib2.urlopen = interrupted
+      try:
+        with self.assertRaises(KeyboardInterrupt):
+          util.transfer(server.url(basename), f.name, blocksize=1000)
+      finally:
+        urllib2.urlopen = urlopen
+      assert os.path.getsize('%s.part'%f.name) == 1000
+      sha1 = util.download(server.url(basename), f.name)
+      assert server.responses == [200, 206]
+      assert server.headers[1]['range'] == 'bytes=1000-'
+      assert 'if-range' in server.headers[1]
+    assert util.sha1file(f.name) == self.sha1_gtfs
+    assert not os.path.exists('%s.part'%f.name)
+
+  def test_download_sha1(self):
+    f = tempfile.NamedTemporaryFile()
+    util.download(self.url, f.name, sha1=self.sha1_gtfs)
+    assert util.sha1file(f.name) == self.sha1_gtfs
+
+  def test_download_badsha1(self):
+    # The existing file is kept if the checksum does not match.
+    f = tempfile.NamedTemporaryFile()
+    f.write('asdf')
+    f.flush()
+    with self.assertRaises(errors.InvalidChecksumError):
+      util.download(self.url, f.name, sha1='0'*40)
+    assert open(f.name).read() == 'asdf'
+    assert not os.path.exists('%s.part'%f.name)
+
+class Test_Timer(unittest.TestCase):
+  def test_stage(self):
+    timer = util.Timer()
+    with timer.stage('a'):
+      pass
+    with timer.stage('b'):
+      pass
+    with timer.stage('a'):
+      pass
+    assert timer.stages.keys() == ['a', 'b']
+    assert timer.total() == sum(timer.stages.values())
+
+  def test_stage_error(self):
+    timer = util.Timer()
+    with self.assertRaises(ValueError):
+      with timer.stage('a'):
+        raise ValueError
+    assert 'a' in timer.stages
+
 class Test_json_pretty_dump(unittest.TestCase):
   def test_json_pretty_dump(self):
     f = StringIO.StringIO()
@@ -47,6 +183,55 @@ class Test_sha1file(unittest.TestCase):
     expect = '4e5e6a2668d12cca29c89a969d73e05e625d9596'
     assert data == expect
   
+class Test_HashCache(unittest.TestCase):
+  def setUp(self):
+    self.filename = util.example_gtfs_feed_path()
+    self.sha1_gtfs = '4e5e6a2668d12cca29c89a969d73e05e625d9596'
+
+  def test_sha1(self):
+    hashcache = util.HashCache()
+    assert hashcache.sha1(self.filename) == self.sha1_gtfs
+    assert hashcache.sha1(self.filename) == self.sha1_gtfs
+    assert hashcache.stats['miss'] == 1
+    assert hashcache.stats['hit'] == 1
+
+  def test_sha1_changed(self):
+    f = tempfile.NamedTemporaryFile()
+    f.write('asdf')
+    f.flush()
+    hashcache = util.HashCache()
+    hashcache.sha1(f.name)
+    f.write('asdf')
+    f.flush()
+    assert hashcache.sha1(f.name) == util.sha1file(f.name)
+    assert hashcache.stats['miss'] == 2
+
+  def test_update(self):
+    hashcache = util.HashCache()
+    hashcache.update(self.filename, 'test')
+    assert hashcache.sha1(self.filename) == 'test'
+    assert hashcache.stats['hit'] == 1
+
+  def test_save(self):
+    f = tempfile.NamedTemporaryFile()
+    hashcache = util.HashCache(f.name)
+    hashcache.sha1(self.filename)
+    hashcache.save()
+    hashcache = util.HashCache(f.name)
+    assert hashcache.sha1(self.filename) == self.sha1_gtfs
+    assert hashcache.stats['hit'] == 1
+
+  def test_rehash(self):
+    f = tempfile.NamedTemporaryFile()
+    hashcache = util.HashCache(f.name)
+    hashcache.update(self.filename, 'test')
+    hashcache.save()
+    hashcache = util.HashCache(f.name, rehash=True)
+    assert hashcache.sha1(self.filename) == self.sha1_gtfs
+    assert hashcache.sha1(self.filename) == self.sha1_gtfs
+    assert hashcache.stats['miss'] == 1
+    assert hashcache.stats['hit'] == 1
+
 class Test_example_registry(unittest.TestCase):
   def test_example_registry(self):
     data = util.example_registry()
@@ -0,0 +1,214 @@
+"""Local HTTP stand-in server for tests and benchmarks."""
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+import contextlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+import urlparse
+import zlib
+
+class RequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  """Serve files from server.path."""
+  def translate_path(self, path):
+    path = urlparse.urlparse(path).path
+    return os.path.join(self.server.path, *[i for i in path.split('/') if i and i != '..'])
+
+  def log_message(self, *args):
+    pass
+
+  def log_request(self, code='-', size='-'):
+    self.server.responses.append(code)
+
+  def end_headers(self):
+    if getattr(self, '_etag', None):
+      self.send_header('ETag', self._etag)
+    SimpleHTTPServer.SimpleHTTPRequestHandler.end_headers(self)
+
+  def send_head(self):
+    """Serve a file, with ETag, conditional and Range request support."""
+    self.server.requests.append(self.path)
+    self.server.headers.append(dict(self.headers))
+    self._etag = None
+    path = self.translate_path(self.path)
+    if not os.path.isfile(path):
+      return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+    st = os.stat(path)
+    modified = self.date_time_string(st.st_mtime)
+    self._etag = '"%x-%x"'%(int(st.st_mtime), st.st_size)
+    if self.headers.getheader('If-None-Match') == self._etag or \
+      self.headers.getheader('If-Modified-Since') == modified:
+      self.send_response(304)
+      self.end_headers()
+      return None
+    # Only single "bytes=<start>-" ranges are supported.
+    start = 0
+    match = re.match(r'bytes=(\d+)-$', self.headers.getheader('Range') or '')
+    if match and self.headers.getheader('If-Range') in (None, self._etag, modified):
+      start = int(match.group(1))
+      if start >= st.st_size:
+        self.send_error(416)
+        return None
+    f = open(path, 'rb')
+    f.seek(start)
+    self.send_response(206 if start else 200)
+    self.send_header('Content-Type', self.guess_type(path))
+    self.send_header('Content-Length', str(st.st_size - start))
+    self.send_header('Last-Modified', modified)
+    if start:
+      self.send_header('Content-Range', 'bytes %d-%d/%d'%(start, st.st_size - 1, st.st_size))
+    self.end_headers()
+    return f
+
+  def copyfile(self, source, outputfile):
+    # Drop the connection part way through, to simulate a failed transfer.
+    with self.server.lock:
+      truncate = self.server.truncate.pop(0) if self.server.truncate else None
+    if truncate is None:
+      return SimpleHTTPServer.SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+    outputfile.write(source.read(truncate))
+
+  def do_GET(self):
+    with self.server.track():
+      SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+class JSONRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Respond with server.app(method, path, data) -> (code, data).
+
+  app may also return (code, data, headers).
+
+  Connections are kept alive, as HTTP/1.1. gzip or deflate request
+  bodies are decoded, and responses use the first of server.encodings
+  that the client accepts.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    # As most servers do, to avoid delayed ACKs on kept connections.
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connections += 1
+
+  def log_message(self, *args):
+    pass
+
+  def _respond(self, method):
+    length = int(self.headers.getheader('Content-Length') or 0)
+    data = None
+    if length:
+      body = self.rfile.read(length)
+      encoding = self.headers.getheader('Content-Encoding')
+      if encoding:
+        body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+      data = json.loads(body)
+    self.server.requests.append(self.path)
+    self.server.headers.append(dict(self.headers))
+    self.server.encodings_received.append(self.headers.getheader('Content-Encoding'))
+    with self.server.track():
+      result = self.server.app(method, self.path, data)
+    code, data, headers = (tuple(result) + ({},))[:3]
+    body = json.dumps(data)
+    self.server.responses.append(code)
+    self.send_response(code)
+    for k, v in headers.items():
+      self.send_header(k, v)
+    accept = [i.split(';')[0].strip() for i in (self.headers.getheader('Accept-Encoding') or '').split(',')]
+    encoding = next((i for i in self.server.encodings if i in accept), None)
+    if encoding == 'gzip':
+      c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+      body = c.compress(body) + c.flush()
+    elif encoding == 'deflate':
+      body = zlib.compress(body)
+    if encoding:
+      self.send_header('Content-Encoding', encoding)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    with self.server.lock:
+      truncate = self.server.truncate.pop(0) if self.server.truncate else None
+    if truncate is not None:
+      # Drop the connection part way through.
+      body = body[:truncate]
+      self.close_connection = 1
+    self.wfile.write(body)
+
+  def do_GET(self):
+    self._respond('GET')
+
+  def do_POST(self):
+    self._respond('POST')
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Threaded HTTP server, run in a background thread.
+
+  Example:
+    with Server(path) as server:
+      util.download(server.url('f-9qs-dta.zip'))
+
+    app = lambda method, path, data: (200, {'stops': []})
+    with Server(handler=JSONRequestHandler, app=app) as server:
+      Datastore(server.url()).getjson('/api/v1/stops')
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, path=None, handler=RequestHandler, delay=0, truncate=None, app=None, encodings=('gzip', 'deflate')):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+    self.path = path
+    # For JSONRequestHandler.
+    self.app = app
+    self.encodings = encodings
+    # The headers and Content-Encoding of each request.
+    self.headers = []
+    self.encodings_received = []
+    # Seconds to wait before each response.
+    self.delay = delay
+    # Bytes to send before dropping the connection, for each response.
+    self.truncate = list(truncate or [])
+    # Request paths, response codes, connections opened,
+    # and the most concurrent requests.
+    self.requests = []
+    self.responses = []
+    self.connections = 0
+    self.active = 0
+    self.max_active = 0
+    self.lock = threading.Lock()
+    self._thread = None
+
+  @contextlib.contextmanager
+  def track(self):
+    """Count a request as active, after waiting delay seconds."""
+    with self.lock:
+      self.active += 1
+      self.max_active = max(self.active, self.max_active)
+    try:
+      time.sleep(self.delay)
+      yield
+    finally:
+      with self.lock:
+        self.active -= 1
+
+  def url(self, path=''):
+    return 'http://%s:%s/%s'%(self.server_address[0], self.server_address[1], path)
+
+  def start(self):
+    self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+    self._thread.join()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *args):
+    self.stop()
@@ -0,0 +1,228 @@
+"""Upload bootstrapped feeds to the Datastore as changesets."""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import Queue
+import sys
+import threading
+import time
+
+import bulk
+import errors
+import util
+from datastore import Datastore
+from operator import sorted_onestop
+
+# Upload stages, in dependency order: (stage, changeset entity key).
+STAGES = (
+  ('stops', 'stop'),
+  ('routes', 'route'),
+  ('operators', 'operator')
+)
+
+def feed_changes(feed):
+  """Yield (stage, change) for each entity of a bootstrapped Feed.
+
+  Stops come first, then routes, then operators. Operators are sent
+  without their features, which are uploaded as stops and routes.
+  """
+  for stage, key in STAGES:
+    for entity in sorted_onestop(getattr(feed, stage)()):
+      data = entity.json()
+      data.pop('features', None)
+      yield stage, {'action': 'createUpdate', key: data}
+
+def chunk_changes(changes, max_changes=1000, max_bytes=1000000):
+  """Group (stage, change) pairs into (stage, changes, size) chunks.
+
+  Each chunk has a single stage, at most max_changes changes, and at
+  most max_bytes of JSON, unless a single change is larger. Changes are
+  read as needed, so only one chunk is held at a time.
+  """
+  stage, chunk, size = None, [], 0
+  for s, change in changes:
+    length = len(json.dumps(change)) + 2
+    if chunk and (s != stage or len(chunk) >= max_changes or size + length > max_bytes):
+      yield stage, chunk, size
+      chunk, size = [], 0
+    stage = s
+    chunk.append(change)
+    size += length
+  if chunk:
+    yield stage, chunk, size
+
+class ChangesetUploader(object):
+  """Upload the entities of bootstrapped feeds as Datastore changesets.
+
+  Entities are split into chunks (see chunk_changes), and each chunk is
+  created and applied as its own changeset. Up to workers chunks are
+  uploaded at once; each stage finishes before the next begins. If
+  checkpoint is a filename, the changesets created and applied are
+  recorded there by chunk contents, so an interrupted upload resumes
+  where it left off, and unchanged chunks are not uploaded again.
+  Statistics for the last upload are kept in stats.
+  """
+  def __init__(self, datastore, checkpoint=None, workers=4, max_changes=1000, max_bytes=1000000, notes=None, log=None):
+    self.datastore = datastore
+    self.checkpoint = checkpoint
+    self.workers = workers
+    self.max_changes = max_changes
+    self.max_bytes = max_bytes
+    self.notes = notes
+    self.log = log or (lambda x:x)
+    self.stats = {}
+    self._lock = threading.Lock()
+    state = util.read_json(checkpoint) if checkpoint else {}
+    # Chunk key -> {'id': changeset id, 'applied': bool}
+    self.changesets = state.get('changesets', {})
+
+  def _save(self):
+    if not self.checkpoint:
+      return
+    tmp = '%s.tmp'%self.checkpoint
+    with open(tmp, 'w') as f:
+      json.dump({'changesets': self.changesets}, f)
+    os.rename(tmp, self.checkpoint)
+
+  def _record(self, key, changeset_id, applied):
+    with self._lock:
+      self.changesets[key] = {'id': changeset_id, 'applied': applied}
+      self._save()
+
+  def upload(self, feed):
+    """Upload a bootstrapped Feed. Returns stats.
+
+    Raises errors.DatastoreError if a chunk fails; completed chunks are
+    kept in the checkpoint.
+    """
+    t = time.time()
+    stats = util.Stats()
+    chunks = chunk_changes(feed_changes(feed), max_changes=self.max_changes, max_bytes=self.max_bytes)
+    for stage, group in itertools.groupby(chunks, key=lambda x:x[0]):
+      self._upload_stage(feed.onestop(), group, stats)
+    elapsed = time.time() - t
+    self.stats = {
+      'chunks': stats['chunks'],
+      'uploaded': stats['uploaded'],
+      'skipped': stats['skipped'],
+      'changes': stats['changes'],
+      'bytes': stats['bytes'],
+      'stops': stats['stops'],
+      'routes': stats['routes'],
+      'operators': stats['operators'],
+      'time': elapsed,
+      'changes_per_second': stats['changes'] / max(elapsed, 1e-9),
+      'bytes_per_second': stats['bytes'] / max(elapsed, 1e-9)
+    }
+    return self.stats
+
+  def _upload_stage(self, onestop_id, chunks, stats):
+    """Upload chunks, up to workers at once, and wait for all of them.
+
+    Chunks are read as workers become free, so few are held at once.
+    """
+    queue = Queue.Queue(maxsize=self.workers)
+    failed = []
+    def work():
+      while True:
+        chunk = queue.get()
+        if chunk is None:
+          return
+        if failed:
+          continue
+        stage, changes, size = chunk
+        try:
+          self._upload_chunk(onestop_id, stage, changes, size, stats)
+        except Exception, e:
+          failed.append(e)
+    threads = [threading.Thread(target=work) for i in range(self.workers)]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    try:
+      for chunk in chunks:
+        if failed:
+          break
+        queue.put(chunk)
+    finally:
+      for t in threads:
+        queue.put(None)
+      for t in threads:
+        t.join()
+    if failed:
+      raise failed[0]
+
+  def _upload_chunk(self, onestop_id, stage, changes, size, stats):
+    digest = hashlib.sha1(json.dumps(changes, sort_keys=True)).hexdigest()
+    key = '%s:%s:%s'%(onestop_id, stage, digest)
+    stats.incr('chunks')
+    state = self.changesets.get(key) or {}
+    if state.get('applied'):
+      stats.incr('skipped')
+      return
+    changeset_id = state.get('id')
+    if changeset_id is None:
+      data = self.datastore.postjson('/api/v1/changesets', {
+        'changeset': {
+          'notes': self.notes or 'Bootstrap of %s'%onestop_id,
+          'payload': {'changes': changes}
+        }
+      })
+      changeset_id = data.get('id')
+      if changeset_id is None:
+        raise errors.DatastoreError("Changeset response has no id", response_body=json.dumps(data))
+      self._record(key, changeset_id, False)
+    self.datastore.postjson('/api/v1/changesets/%s/apply'%changeset_id)
+    self._record(key, changeset_id, True)
+    stats.incr('uploaded')
+    stats.incr('changes', len(changes))
+    stats.incr('bytes', size)
+    stats.incr(stage, len(changes))
+    self.log("Applied changeset %s: %s %s"%(changeset_id, len(changes), stage))
+
+def run():
+  parser = argparse.ArgumentParser(
+    description='Upload GTFS feeds to the Transitland Datastore as changesets.'
+  )
+  parser.add_argument('filenames', nargs='+', help='GTFS feed filenames')
+  parser.add_argument('--datastore', help='Datastore host', required=True)
+  parser.add_argument('--apitoken', help='Datastore API token', default=os.getenv('TRANSITLAND_DATASTORE_AUTH_TOKEN'))
+  parser.add_argument('--checkpoint', help='Checkpoint file, to resume interrupted uploads')
+  parser.add_argument('--workers', help='Changesets to upload at once', type=int, default=4)
+  parser.add_argument('--max-changes', help='Maximum changes per changeset', type=int, default=1000)
+  parser.add_argument('--max-bytes', help='Maximum JSON bytes per changeset', type=int, default=1000000)
+  parser.add_argument('--stream', help='Use streaming bootstrap', action='store_true')
+  parser.add_argument('--debug', help='Print each changeset', action='store_true')
+  args = parser.parse_args()
+
+  log = None
+  if args.debug:
+    log = lambda x:sys.stderr.write('%s\n'%x)
+  datastore = Datastore(args.datastore, apitoken=args.apitoken)
+  uploader = ChangesetUploader(
+    datastore,
+    checkpoint=args.checkpoint,
+    workers=args.workers,
+    max_changes=args.max_changes,
+    max_bytes=args.max_bytes,
+    log=log
+  )
+  row = "%-40s %-30s %9s %9s %9s %10s %9s"
+  print row%('Feed', 'Onestop ID', 'Changes', 'Uploaded', 'Skipped', 'Changes/s', 'Time (s)')
+  for job in bulk.file_jobs(args.filenames):
+    feed = bulk.bootstrap_feed(job, stream=args.stream)
+    stats = uploader.upload(feed)
+    print row%(
+      job['key'],
+      feed.onestop(),
+      stats['changes'],
+      stats['uploaded'],
+      stats['skipped'],
+      '%0.1f'%stats['changes_per_second'],
+      '%0.2f'%stats['time']
+    )
+
+if __name__ == "__main__":
+  run()
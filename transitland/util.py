@@ -1,9 +1,19 @@
 """Helpful utilitors."""
-import urllib
+import httplib
+import socket
+import urllib2
+import urlparse
 import os
+import tempfile
 import json
 import hashlib
 import re
+import collections
+import contextlib
+import threading
+import time
+
+import errors
 
 ONESTOP_LENGTH = 64
 GEOHASH_LENGTH = 10
@@ -75,11 +85,237 @@ def filtfirst(entities, **kw):
     raise ValueError('No result')
   return ret[0]
 
-def download(url, filename=None):
-  """Download url to filename."""
+class SetView(collections.Set):
+  """Read-only view of a set; set operations return new sets."""
+  def __init__(self, data):
+    self._data = data
+
+  def __contains__(self, item):
+    return item in self._data
+
+  def __iter__(self):
+    return iter(self._data)
+
+  def __len__(self):
+    return len(self._data)
+
+  @classmethod
+  def _from_iterable(cls, it):
+    return set(it)
+
+class Timer(object):
+  """Record elapsed time for named stages."""
+  def __init__(self):
+    self.stages = collections.OrderedDict()
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    t = time.time()
+    try:
+      yield
+    finally:
+      self.stages[name] = self.stages.get(name, 0.0) + time.time() - t
+
+  def total(self):
+    return sum(self.stages.values())
+
+class Stats(collections.Counter):
+  """A Counter that can be updated from multiple threads."""
+  def __init__(self, *args, **kwargs):
+    super(Stats, self).__init__(*args, **kwargs)
+    self._lock = threading.Lock()
+
+  def incr(self, key, value=1):
+    with self._lock:
+      self[key] += value
+
+# Download statistics, e.g. 'downloaded' and 'not_modified'.
+download_stats = Stats()
+
+def validators_filename(filename):
+  """Sidecar file for the HTTP response validators of a download."""
+  return '%s.http.json'%filename
+
+def read_json(filename):
+  """Load a JSON file; returns an empty dict if missing or invalid."""
+  try:
+    with open(filename) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+def _unlink(*filenames):
+  for filename in filenames:
+    if os.path.exists(filename):
+      os.unlink(filename)
+
+def read_validators(filename):
+  """Return the stored response validators for a downloaded file.
+
+  Returns an empty dict if there are none, or the file has changed size.
+  """
+  data = read_json(validators_filename(filename))
+  if not os.path.exists(filename) or os.path.getsize(filename) != data.get('content_length'):
+    return {}
+  return data
+
+def write_validators(filename, url, response, sha1=None):
+  """Store the response validators for a downloaded file."""
+  headers = response.info()
+  data = {
+    'url': url,
+    'etag': headers.getheader('ETag'),
+    'last_modified': headers.getheader('Last-Modified'),
+    'content_length': os.path.getsize(filename),
+    'sha1': sha1
+  }
+  with open(validators_filename(filename), 'w') as f:
+    json.dump(data, f)
+
+def transfer(url, filename, conditional=False, sha1=None, retries=3, blocksize=65536, hashcache=None):
+  """Download url to filename, resuming after errors. Returns the SHA1.
+
+  The response is written to <filename>.part, hashed as it arrives, and
+  renamed to filename once complete. If the transfer is interrupted, it
+  is resumed with an HTTP Range request, up to retries times; a .part
+  file left by an earlier call is also resumed. If sha1 is given and
+  does not match, errors.InvalidChecksumError is raised and filename is
+  left unchanged.
+
+  With conditional=True, the ETag and Last-Modified response headers
+  are stored next to filename, and sent with the next request for the
+  same url; if the server responds 304 Not Modified, the existing file
+  is kept and None is returned. If a HashCache is given, the existing
+  file is first checked against the SHA1 recorded when it was
+  downloaded, and downloaded again if it has changed.
+  """
+  part = '%s.part'%filename
+  validators = {}
+  if conditional:
+    validators = read_validators(filename)
+    if validators.get('url') != url:
+      validators = {}
+  # Resume a .part file, if the server can tell us it is unchanged.
+  h = hashlib.sha1()
+  offset = 0
+  partinfo = read_json(validators_filename(part))
+  if os.path.exists(part) and partinfo.get('url') == url:
+    offset = os.path.getsize(part)
+    with open(part, 'rb') as f:
+      for chunk in iter(lambda:f.read(blocksize), ''):
+        h.update(chunk)
+  attempts = 0
+  while True:
+    request = urllib2.Request(url)
+    validator = partinfo.get('etag') or partinfo.get('last_modified')
+    if offset and validator:
+      request.add_header('Range', 'bytes=%d-'%offset)
+      request.add_header('If-Range', validator)
+    else:
+      if validators.get('etag'):
+        request.add_header('If-None-Match', validators['etag'])
+      if validators.get('last_modified'):
+        request.add_header('If-Modified-Since', validators['last_modified'])
+    try:
+      response = urllib2.urlopen(request)
+    except urllib2.HTTPError, e:
+      if e.code == 304 and validators and not request.has_header('Range'):
+        digest = None
+        if hashcache:
+          digest = hashcache.sha1(filename)
+        elif sha1:
+          digest = sha1file(filename)
+        if digest and validators.get('sha1') and digest != validators['sha1']:
+          # The existing file has changed since it was downloaded.
+          validators = {}
+          continue
+        if sha1 and digest != sha1:
+          raise errors.InvalidChecksumError("Incorrect checksum: %s, expected %s"%(
+            digest,
+            sha1
+          ))
+        download_stats.incr('not_modified')
+        return None
+      if e.code == 416 and offset:
+        # The .part file is not a prefix of the response; start over.
+        offset = 0
+        continue
+      raise
+    except (urllib2.URLError, socket.error, httplib.HTTPException):
+      attempts += 1
+      if attempts > retries:
+        raise
+      continue
+    if offset and validator and response.getcode() == 206:
+      mode = 'ab'
+      download_stats.incr('resumed')
+    else:
+      mode = 'wb'
+      h = hashlib.sha1()
+      offset = 0
+    length = response.info().getheader('Content-Length')
+    expect = offset + int(length) if length else None
+    error = None
+    try:
+      with open(part, mode) as f:
+        if mode == 'wb':
+          # Before the body, so an interrupted run can resume.
+          write_validators(part, url, response)
+          partinfo = read_json(validators_filename(part))
+        for chunk in iter(lambda:response.read(blocksize), ''):
+          f.write(chunk)
+          h.update(chunk)
+          offset += len(chunk)
+    except (socket.error, httplib.HTTPException), e:
+      error = e
+    finally:
+      response.close()
+    if not error and (expect is None or offset >= expect):
+      break
+    attempts += 1
+    if attempts > retries:
+      raise errors.IncompleteDownloadError(
+        "Incomplete download: received %s of %s bytes: %s"%(offset, expect, error)
+      )
+  digest = h.hexdigest()
+  if sha1 and digest != sha1:
+    _unlink(part, validators_filename(part))
+    raise errors.InvalidChecksumError("Incorrect checksum: %s, expected %s"%(
+      digest,
+      sha1
+    ))
+  os.rename(part, filename)
+  _unlink(validators_filename(part))
+  download_stats.incr('downloaded')
+  if hashcache:
+    hashcache.update(filename, digest)
+  if conditional:
+    write_validators(filename, url, response, sha1=digest)
+  else:
+    # Stale validators for the previous download.
+    _unlink(validators_filename(filename))
+  return digest
+
+def download(url, filename=None, conditional=False, sha1=None, retries=3, hashcache=None):
+  """Download url to filename. Raises urllib2.URLError on HTTP errors.
+
+  See transfer() for resuming, checksum, and conditional requests.
+  """
   if not url:
     raise ValueError("No url given.")
-  filename, response = urllib.urlretrieve(url, filename)
+  if not filename:
+    fd, filename = tempfile.mkstemp(
+      suffix=os.path.splitext(urlparse.urlparse(url).path)[1]
+    )
+    os.close(fd)
+  transfer(
+    url,
+    filename,
+    conditional=conditional,
+    sha1=sha1,
+    retries=retries,
+    hashcache=hashcache
+  )
   return filename
 
 def json_pretty_print(data):
@@ -109,6 +345,62 @@ def sha1file(filename, blocksize=65536):
           chunk = f.read(blocksize)
   return h.hexdigest()
 
+class HashCache(object):
+  """Persistent cache of file SHA1s.
+
+  Entries are keyed by path, and are valid while the file size, mtime
+  and inode are unchanged. With rehash=True, existing entries are
+  ignored, and each file is hashed again once. stats counts 'hit' and
+  'miss'.
+  """
+  def __init__(self, filename=None, rehash=False):
+    self.filename = filename
+    self.rehash = rehash
+    self.stats = Stats()
+    self.hashes = {}
+    # Paths hashed or updated since the cache was loaded.
+    self._fresh = set()
+    self._lock = threading.Lock()
+    if filename:
+      self.hashes = read_json(filename)
+
+  def _key(self, filename):
+    st = os.stat(filename)
+    return [st.st_size, int(st.st_mtime * 1e9), st.st_ino]
+
+  def sha1(self, filename):
+    """Return the SHA1 of a file, hashing it only if it has changed."""
+    path = os.path.abspath(filename)
+    key = self._key(filename)
+    with self._lock:
+      entry = self.hashes.get(path)
+      fresh = path in self._fresh
+    if entry and entry[:3] == key and (fresh or not self.rehash):
+      self.stats.incr('hit')
+      return entry[3]
+    self.stats.incr('miss')
+    sha1 = sha1file(filename)
+    self.update(filename, sha1)
+    return sha1
+
+  def update(self, filename, sha1):
+    """Record the SHA1 of a file, e.g. one that was just downloaded."""
+    path = os.path.abspath(filename)
+    key = self._key(filename)
+    with self._lock:
+      self.hashes[path] = key + [sha1]
+      self._fresh.add(path)
+
+  def save(self):
+    """Write the cache to filename."""
+    if not self.filename:
+      return
+    tmp = '%s.tmp'%self.filename
+    with self._lock:
+      with open(tmp, 'w') as f:
+        json.dump(self.hashes, f)
+    os.rename(tmp, self.filename)
+
 def example_registry(path=None):
   return os.path.join(
     os.path.dirname(__file__), 